@@ -1,18 +1,49 @@
 import os
-import io
-import shutil
+import time
+import hashlib
+import tempfile
 import logging
 from pathlib import Path
+from datetime import datetime, timezone
 from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 from googleapiclient.errors import HttpError
 from google.auth.exceptions import RefreshError
-from datetime import datetime, timezone
 
-# from backend.utilities import timer
+from backend.manifest import SyncManifest, local_stats
+from backend.hash_cache import HashCache
+from backend.registry import SaveRegistry
+from backend.remote_index import RemoteIndex, FOLDER_MIME_TYPE, METADATA_FIELDS
+from backend.transfer import (
+    TransferEngine,
+    GameTracker,
+    CancelToken,
+    TransferCanceled,
+    chunk_callback,
+    DEFAULT_WORKERS,
+)
+from backend.progress import TransferProgress, GameProgress, FileProgress
+from backend.upload_sessions import UploadSessions
+from backend.api_calls import ApiCaller, retry_delay
+from backend.metrics import Metrics
+from backend.transport import (
+    ServicePool,
+    SharedCredentials,
+    authorized_http,
+    build_drive_service,
+)
+from backend.game_settings import (
+    load_game_settings,
+    storage_mode,
+    retention_policy,
+    STORAGE_VERSIONED,
+    STORAGE_FILES,
+    STORAGE_PACKED,
+    SNAPSHOT_MODES,
+)
+from backend.snapshots import SnapshotStorage, SNAPSHOT_LAYOUT_FOLDERS
+from backend.packing import TarStreamUpload, extract_archive, PACKED_ARCHIVE_NAME
 
 logging.basicConfig(
     filename="./logs/gdrive_log.log",
@@ -29,53 +60,101 @@ SCOPES = [
     "https://www.googleapis.com/auth/drive",
     "https://www.googleapis.com/auth/drive.metadata",
 ]
+LIST_PAGE_SIZE = 1000
+# Drive rejects batches of more than 100 calls.
+DRIVE_BATCH_LIMIT = 100
+# Files at least this big are sent in chunks through a resumable session.
+# Chunk sizes must be a multiple of 256 KiB.
+DEFAULT_RESUMABLE_THRESHOLD = 8 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
 
 
 class GDrive:
-    def __init__(self):
-        self.drive_service = self._get_auth_service()
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        resumable_threshold: int = DEFAULT_RESUMABLE_THRESHOLD,
+    ):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.resumable_threshold = resumable_threshold
+        self.upload_sessions = UploadSessions()
+        self.hash_cache = HashCache()
+        self.registry = SaveRegistry()
+        self.snapshots = SnapshotStorage(self)
+        # Counts the last upload or restore, see `Metrics`.
+        self.metrics = Metrics()
+        # Every Drive request goes through this, see `ApiCaller`.
+        self.api = ApiCaller(metrics=self.metrics)
+        self.credentials = self._authenticate()
+        # httplib2 connections aren't thread safe, so every thread that talks
+        # to Drive gets its own service object from the pool, see `_service`.
+        self.services = ServicePool(self._build_service, max_idle=workers + 1)
         self.folder_ids = {"root": self._get_root_folder_id()}
+        self.remote_index = RemoteIndex(self.list_folder, self.list_folders)
         self.initialize_folder_structure()
 
     def __del__(self):
         logger.info("Closing drive service.")
-        if self.drive_service:
-            self.drive_service.close()
+        self.close()
         logger.info("Drive service closed.")
 
-    def _get_auth_service(self):
+    def close(self):
+        services = getattr(self, "services", None)
+        if services:
+            services.close()
+
+    def _authenticate(self) -> SharedCredentials:
         try:
             creds = self._get_credentials()
         except RefreshError as e:
             logger.error(f"Error during authentication: {e}")
             logger.info("Deleting credentials and reauthenticating.")
             os.remove(PATH_TO_TOKENS)
-            return self._get_auth_service()
-        return build("drive", "v3", credentials=creds)
+            return self._authenticate()
+        # Every pooled connection shares these, and whichever refreshes the
+        # token saves it for the next start.
+        creds.on_refresh = self._save_credentials
+        return creds
+
+    def _build_service(self):
+        return build_drive_service(authorized_http(self.credentials))
 
-    def _get_credentials(self):
+    def _service(self):
+        """The Drive service belonging to the calling thread."""
+        return self.services.service()
+
+    def _get_credentials(self) -> SharedCredentials:
         creds = None
         if os.path.exists(PATH_TO_TOKENS):
-            creds = Credentials.from_authorized_user_file(PATH_TO_TOKENS, SCOPES)
+            creds = SharedCredentials.from_authorized_user_file(PATH_TO_TOKENS, SCOPES)
         if not creds or not creds.valid:
             creds = self._refresh_credentials(creds)
         return creds
 
-    def _refresh_credentials(self, creds):
+    def _refresh_credentials(self, creds: SharedCredentials) -> SharedCredentials:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
+            self._save_credentials(creds)
         else:
             flow = InstalledAppFlow.from_client_secrets_file(
                 PATH_TO_CLIENT_CREDS, SCOPES
             )
-            creds = flow.run_local_server()
+            creds = SharedCredentials.from_credentials(flow.run_local_server(), SCOPES)
+            self._save_credentials(creds)
+        return creds
+
+    def _save_credentials(self, creds: SharedCredentials) -> None:
+        try:
             with open(PATH_TO_TOKENS, "w") as token:
                 token.write(creds.to_json())
-        return creds
+        except OSError as e:
+            logger.error(f"Saving the refreshed token failed: {e}")
 
     def _get_root_folder_id(self):
         return (
-            self.drive_service.files().get(fileId="root", fields="id").execute()["id"]
+            self.api.execute(self._service().files().get(fileId="root", fields="id"))["id"]
         )
 
     def initialize_folder_structure(self):
@@ -86,38 +165,190 @@ class GDrive:
                 folder_id = self.folder_ids["root"]
             else:
                 parent = folder_id
-                existent_folder = self.get_metadata(part, parent, type="folder")
+                # Raises rather than taking a failed listing for a missing folder.
+                existent_folder = self.remote_index.lookup(parent, part, type="folder")
                 if not existent_folder:
                     logger.info(f"Adding {part} to GDrive")
-                    folder_id = self.upload_to_gdrive(
+                    created_folder = self.upload_to_gdrive(
                         part, parents=[folder_id], type="folder"
                     )
+                    if not created_folder:
+                        # Nothing can be backed up without the saves folder.
+                        logger.error(f"Creating the {part} folder failed.")
+                        raise RuntimeError(f"Couldn't create the {part} folder on Drive.")
+                    folder_id = created_folder["id"]
                     self.folder_ids[part] = folder_id
                 else:
                     logger.info(f"{part} already exists.")
-                    self.folder_ids[part] = existent_folder[0]["id"]
+                    self.folder_ids[part] = existent_folder["id"]
 
-    def get_metadata(self, name: str=None, parent: str=None, type: str=None):
-        try:
-            q = 'trashed=false'
-            if name:
-                q += f" and name='{name}'"
-            if parent:
-                q += f" and '{parent}' in parents"
-            if type == "folder":
-                q += f" and mimeType = 'application/vnd.google-apps.folder'"
-
-            response = (
-                self.drive_service.files()
-                .list(q=q, fields="files(id, name, modifiedTime, parents, mimeType)")
-                .execute()
+    def _list_request(self, q: str, page_token: str = None):
+        return self._service().files().list(
+            q=q,
+            fields=f"nextPageToken, files({METADATA_FIELDS})",
+            pageSize=LIST_PAGE_SIZE,
+            pageToken=page_token,
+        )
+
+    def _remaining_pages(self, q: str, response: dict) -> list:
+        """Files from `response` plus every page after it."""
+        files = list(response.get("files", []))
+        page_token = response.get("nextPageToken")
+        while page_token:
+            response = self.api.execute(self._list_request(q, page_token))
+            files.extend(response.get("files", []))
+            page_token = response.get("nextPageToken")
+        return files
+
+    def list_folder(self, folder_id: str) -> list:
+        """Every child of a remote folder, following all result pages.
+
+        Raises:
+            HttpError: If the folder couldn't be listed. Taking it for empty
+                would get its files and folders created a second time.
+        """
+        q = f"trashed=false and '{folder_id}' in parents"
+        return self._remaining_pages(q, self.api.execute(self._list_request(q)))
+
+    def execute_batch(self, requests: dict) -> dict:
+        """Runs metadata-only requests through Drive's batch endpoint.
+
+        Requests are sent DRIVE_BATCH_LIMIT at a time, one HTTP round-trip
+        per group. Media uploads and downloads can't be batched. Requests
+        that come back throttled or with a server error are sent again in a
+        later batch, after a backoff.
+
+        Args:
+            requests (dict): Any hashable key -> unexecuted HttpRequest.
+
+        Returns:
+            dict: The same keys -> (response, error). Exactly one of the two is
+            None for every key.
+        """
+        keys = list(requests)
+        results = {}
+
+        def callback(request_id, response, exception):
+            results[keys[int(request_id)]] = (response, exception)
+
+        pending = list(range(len(keys)))
+        for attempt in range(self.api.max_retries + 1):
+            for start in range(0, len(pending), DRIVE_BATCH_LIMIT):
+                group = pending[start : start + DRIVE_BATCH_LIMIT]
+                batch = self._service().new_batch_http_request(callback=callback)
+                for i in group:
+                    batch.add(requests[keys[i]], request_id=str(i))
+                try:
+                    self.api.execute(batch, cost=len(group))
+                except HttpError as error:
+                    logger.error(f"Batch request failed: {error}")
+                    for i in group:
+                        results.setdefault(keys[i], (None, error))
+
+            pending = [
+                i
+                for i in pending
+                if results[keys[i]][1] is not None and self.api.should_retry(results[keys[i]][1])
+            ]
+            if not pending or attempt == self.api.max_retries:
+                break
+            delay = retry_delay(attempt)
+            logger.info(f"Retrying {len(pending)} batched requests in {delay:.1f}s.")
+            time.sleep(delay)
+        return results
+
+    def list_folders(self, folder_ids: list) -> dict:
+        """Lists several folders at once. The first page of every folder comes
+        from one batch, any further pages are fetched one by one.
+
+        Returns:
+            dict: folder id -> list of children. Folders that couldn't be
+            listed are left out.
+        """
+        queries = {
+            folder_id: f"trashed=false and '{folder_id}' in parents"
+            for folder_id in folder_ids
+        }
+        responses = self.execute_batch(
+            {folder_id: self._list_request(q) for folder_id, q in queries.items()}
+        )
+
+        listings = {}
+        for folder_id, (response, error) in responses.items():
+            if error:
+                logger.error(f"Listing folder {folder_id} failed: {error}")
+                continue
+            try:
+                listings[folder_id] = self._remaining_pages(queries[folder_id], response)
+            except HttpError as error:
+                logger.error(f"Listing folder {folder_id} failed: {error}")
+        return listings
+
+    def create_folders(self, folders: dict) -> dict:
+        """Creates several folders in batches.
+
+        Args:
+            folders (dict): key -> (folder name, parent folder id).
+
+        Returns:
+            dict: key -> metadata of the new folder, or None if it failed.
+        """
+        requests = {
+            key: self._service().files().create(
+                body={"name": name, "parents": [parent], "mimeType": FOLDER_MIME_TYPE},
+                fields=METADATA_FIELDS,
             )
+            for key, (name, parent) in folders.items()
+        }
+        created = {}
+        for key, (response, error) in self.execute_batch(requests).items():
+            if error:
+                logger.error(f"Creating folder {key} failed: {error}")
+            created[key] = response
+        return created
 
-        except HttpError or IndexError as error:
-            logger.error(f"An error occurred: {error}")
-            return
+    def update_metadata(self, updates: dict) -> dict:
+        """Applies metadata-only updates (renames, moves, properties) in batches.
+
+        Args:
+            updates (dict): key -> (file id, metadata body).
+
+        Returns:
+            dict: key -> updated metadata, or None if it failed.
+        """
+        requests = {
+            key: self._service().files().update(
+                fileId=file_id, body=body, fields=METADATA_FIELDS
+            )
+            for key, (file_id, body) in updates.items()
+        }
+        updated = {}
+        for key, (response, error) in self.execute_batch(requests).items():
+            if error:
+                logger.error(f"Updating {key} failed: {error}")
+            updated[key] = response
+        return updated
+
+    def delete_files(self, files: dict) -> set:
+        """Deletes files in batches.
+
+        Args:
+            files (dict): key -> file id.
 
-        return response.get("files", []) if response.get("files", []) else None
+        Returns:
+            set: The keys that were deleted.
+        """
+        requests = {
+            key: self._service().files().delete(fileId=file_id)
+            for key, file_id in files.items()
+        }
+        deleted = set()
+        for key, (response, error) in self.execute_batch(requests).items():
+            if error:
+                logger.error(f"Deleting {key} failed: {error}")
+            else:
+                deleted.add(key)
+        return deleted
 
     def upload_to_gdrive(
         self,
@@ -126,141 +357,895 @@ class GDrive:
         parents: list = [],
         update: bool = False,
         type: str = "file",
-    ) -> str:
+        remote_name: str = None,
+        on_progress=None,
+    ) -> dict:
+        """
+        Args:
+            on_progress (callable): Called with the bytes sent so far after
+                every chunk of a resumable upload.
+        """
         try:
             if not update:
                 file_metadata = {"parents": parents}
                 if type == "file":
-                    file_metadata["name"] = Path(name).parts[-1]
+                    file_metadata["name"] = remote_name or Path(name).parts[-1]
                 elif type == "folder":
                     file_metadata["name"] = name
                     file_metadata["mimeType"] = "application/vnd.google-apps.folder"
 
-            media = MediaFileUpload(name) if type == "file" else None
+            resumable = type == "file" and os.path.getsize(name) >= self.resumable_threshold
+            if resumable:
+                media = MediaFileUpload(name, chunksize=self.chunk_size, resumable=True)
+            else:
+                media = MediaFileUpload(name) if type == "file" else None
+            upload_type = {} if resumable else {"uploadType": "multipart"}
 
-            file_object = self.drive_service.files()
+            file_object = self._service().files()
 
             if not update:
                 file = file_object.create(
-                    uploadType="multipart",
                     body=file_metadata,
                     media_body=media,
-                    fields="id",
+                    fields=METADATA_FIELDS,
+                    **upload_type,
                 )
             else:
                 file = file_object.update(
-                    uploadType="multipart", media_body=media, fileId=remote_file_id
+                    media_body=media,
+                    fileId=remote_file_id,
+                    fields=METADATA_FIELDS,
+                    **upload_type,
                 )
-            file = file.execute()
+
+            if resumable:
+                target = remote_file_id if update else ",".join(parents)
+                file = self._execute_resumable(file, name, target, on_progress)
+            else:
+                file = self.api.execute(file)
+            if media:
+                self.count_transfer("upload", media.size())
 
         except HttpError as error:
             logger.error(f"An error occurred: {error}")
             return
-        return file.get("id")
-    
-    def download_file(self, file_id: str, save_path: str):
+        return file
+
+    def count_transfer(self, direction: str, size: int, files: int = 1) -> None:
+        self.metrics.count("transfer_bytes", size, direction=direction)
+        self.metrics.count("transfer_files", files, direction=direction)
+
+    def _execute_resumable(self, request, path: str, target: str, on_progress=None) -> dict:
+        """Sends a resumable upload one chunk at a time.
+
+        The session URI and offset are written to disk after every chunk, so an
+        upload cut short by a crash or a dropped connection picks up where it
+        left off the next time the same file goes to the same place.
+        """
+        stat = os.stat(path)
+        session = self.upload_sessions.get(path, stat, target)
+        if session:
+            logger.info(f"Resuming upload of {path} from byte {session['offset']}.")
+            request.resumable_uri = session["uri"]
+            # Makes the first next_chunk ask Drive how much it already has
+            # instead of trusting our offset.
+            request._in_error_state = True
+
+        response = None
+        while response is None:
+            try:
+                status, response = self.api.call(request.next_chunk)
+            except HttpError as error:
+                if request.resumable_uri and error.resp.status in (404, 410):
+                    logger.info(f"Upload session for {path} expired. Starting over.")
+                    self.upload_sessions.remove(path)
+                    request.resumable_uri = None
+                    request.resumable_progress = 0
+                    request._in_error_state = False
+                    continue
+                raise
+
+            if status:
+                logger.info(f"Upload of {path} at {int(status.progress() * 100)}%.")
+                self.upload_sessions.record(
+                    path, stat, target, request.resumable_uri, request.resumable_progress
+                )
+                if on_progress:
+                    on_progress(request.resumable_progress)
+
+        self.upload_sessions.remove(path)
+        return response
+
+    def download_file(
+        self, file_id: str, save_path: str, md5: str = None, on_progress=None
+    ) -> bool:
+        """Streams a remote file to `save_path`.
+
+        Chunks are written straight to a temporary file next to the target and
+        hashed on the way. The temporary file only replaces `save_path` once
+        the download is complete and, when `md5` is given, matches it, so an
+        interrupted or corrupt download never clobbers a good local save.
+
+        Args:
+            on_progress (callable): Called with the bytes received so far
+                after every chunk.
+
+        Returns:
+            bool: True if `save_path` now holds the remote content.
+        """
+        save_path = Path(save_path)
+        fd, temp_path = tempfile.mkstemp(
+            dir=save_path.parent, prefix=f".{save_path.name}.", suffix=".part"
+        )
         try:
-            request = self.drive_service.files().get_media(fileId=file_id)
-            file = io.BytesIO()
-            downloader = MediaIoBaseDownload(file, request)
-            done = False
+            with os.fdopen(fd, "wb") as f:
+                writer = _HashingWriter(f)
+                request = self._service().files().get_media(fileId=file_id)
+                downloader = MediaIoBaseDownload(writer, request, chunksize=self.chunk_size)
+                done = False
+
+                while not done:
+                    status, done = self.api.call(downloader.next_chunk, method="get_media")
+                    logger.info(f"Download of {save_path} at {int(status.progress() * 100)}%.")
+                    if on_progress:
+                        on_progress(status.resumable_progress)
 
-            while not done:
-                status, done = downloader.next_chunk()
-                logger.info(f"Download at {int(status.progress() * 100)}%.")
+            self.count_transfer("download", writer.size)
+            if md5 and writer.hexdigest() != md5:
+                logger.error(f"Checksum mismatch for {save_path}. Keeping the local copy.")
+                return False
+            os.replace(temp_path, save_path)
+            return True
 
         except HttpError as error:
-            logger.info(f"An error occurred: {error}")
-            file = None
-
-        if file:
-            file.seek(0)
-            with open(save_path, 'wb') as f:
-                shutil.copyfileobj(file, f)
-
-        return file.getvalue()
-    
-    def download_from_gdrive(self, parent_id: str, root_dir: str):
-        children = self.get_metadata(parent=parent_id)
-        for child in children:
+            logger.error(f"An error occurred: {error}")
+            return False
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _download_file_task(
+        self, child: dict, save_path: Path, overwrite: bool, file_progress: FileProgress
+    ) -> bool:
+        try:
+            with self.metrics.phase("transfer"):
+                return self._download_file(child, save_path, overwrite, file_progress.update)
+        finally:
+            file_progress.finish()
+
+    def _download_file(
+        self, child: dict, save_path: Path, overwrite: bool, on_progress
+    ) -> bool:
+        """Returns False if the file should have been downloaded but wasn't."""
+        if save_path.exists():
+            if self.hash_cache.md5(str(save_path)) == child.get("md5Checksum"):
+                logger.info(f"{save_path} already up-to-date.")
+                return True
+            if not overwrite:
+                logger.info(f"{save_path} differs from GDrive. Not overwriting.")
+                return True
+
+        logger.info(f"Downloading {save_path}.")
+        if not self.download_file(child["id"], save_path, child.get("md5Checksum"), on_progress):
+            return False
+        logger.info(f"{save_path} downloaded.")
+        return True
+
+    def download_from_gdrive(
+        self,
+        parent_id: str,
+        root_dir: str,
+        overwrite: bool = False,
+        progress: GameProgress = None,
+        skip=(),
+    ):
+        """Restores a remote folder into `root_dir`.
+
+        The remote tree is listed one level at a time with batched listings,
+        local folders are created as they are found, and file downloads run on
+        the transfer workers, each holding at most one chunk in memory.
+        Existing local files are left alone when they match the remote md5,
+        and otherwise only replaced when `overwrite` is set.
+
+        Args:
+            skip: Names directly under `parent_id` to leave out.
+
+        Returns:
+            bool: False if any file couldn't be downloaded.
+        """
+        progress = progress or TransferProgress("Download").game(Path(root_dir).name)
+        tracker = GameTracker(Path(root_dir).name)
+        level = {parent_id: Path(root_dir)}
+        with TransferEngine(self.workers) as engine:
+            while level:
+                self.remote_index.prefetch(level)
+                next_level = {}
+                for folder_id, local_dir in level.items():
+                    for child in self.remote_index.children(folder_id).values():
+                        if folder_id == parent_id and child["name"] in skip:
+                            continue
+                        save_path = local_dir / child["name"]
+                        if child["mimeType"] == FOLDER_MIME_TYPE:
+                            if not save_path.exists():
+                                logger.info(f"Creating {save_path}.")
+                                os.makedirs(save_path)
+                            next_level[child["id"]] = save_path
+                        elif child["mimeType"].startswith("application/vnd.google-apps."):
+                            logger.info(f"Skipping {save_path}, Google documents can't be restored.")
+                        else:
+                            file_progress = progress.add_file(int(child.get("size", 0)))
+                            tracker.task_added()
+                            engine.submit(
+                                self._download_file_task,
+                                child,
+                                save_path,
+                                overwrite,
+                                file_progress,
+                                on_done=tracker.task_done,
+                            )
+                level = next_level
+            tracker.finish_submitting()
+        self.hash_cache.save()
+        if tracker.failed:
+            logger.error(
+                f"{tracker.failed} of {tracker.tasks} files failed to download into {root_dir}."
+            )
+        return not tracker.failed
+
+    def _game_folder(self, game_name: str) -> dict:
+        saves_id = self.folder_ids[Path(DEFAULT_GDRIVE_REMOTE_SAVE_FOLDER).parts[-1]]
+        return self.remote_index.lookup(saves_id, game_name, type="folder")
+
+    def list_snapshots(self, game_name: str) -> list:
+        """Names of a game's snapshots, oldest first."""
+        self.remote_index.clear()
+        try:
+            game_folder = self._game_folder(game_name)
+            if not game_folder:
+                return []
+            created = self.snapshots.list_snapshots(game_folder["id"])
+        except HttpError as error:
+            logger.error(f"Listing the snapshots of {game_name} failed: {error}")
+            return []
+        return sorted(created, key=created.get)
+
+    def restore_game(
+        self,
+        game_name: str,
+        local_path: str,
+        overwrite: bool = False,
+        snapshot: str = None,
+        transfer_callback=None,
+    ) -> bool:
+        """Restores saves/game_name into `local_path`.
+
+        What gets restored depends on how the game is stored on Drive, not on
+        its current storage mode, see `_stored_layout`. For games stored as
+        snapshots, `snapshot` picks the one to restore, see `list_snapshots`.
+        The latest is used otherwise.
+
+        Args:
+            transfer_callback (callable): Called with a ProgressReport every
+                REPORT_INTERVAL seconds or so while files come in.
+        """
+        self.remote_index.clear()
+        self.metrics.reset()
+        try:
+            game_folder = self._game_folder(game_name)
+        except HttpError as error:
+            logger.error(f"Looking up the backup of {game_name} failed: {error}")
+            return False
+        if not game_folder:
+            logger.error(f"No backup of {game_name} on GDrive.")
+            return False
+
+        os.makedirs(local_path, exist_ok=True)
+        progress = TransferProgress("Restore", transfer_callback)
+        game_progress = progress.game(game_name)
+        try:
+            if snapshot:
+                layout, other_layouts = STORAGE_VERSIONED, ()
+            else:
+                layout, other_layouts = self._stored_layout(game_name, game_folder["id"])
+            logger.info(f"Restoring {game_name} from its {layout} backup.")
+            if layout == STORAGE_VERSIONED:
+                return self.snapshots.restore(
+                    game_folder["id"], local_path, overwrite, snapshot, game_progress
+                )
+
+            if layout == STORAGE_PACKED:
+                archive = self.remote_index.lookup(game_folder["id"], PACKED_ARCHIVE_NAME)
+                file_progress = game_progress.add_file(int(archive.get("size", 0)))
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    archive_path = os.path.join(temp_dir, PACKED_ARCHIVE_NAME)
+                    with self.metrics.phase("transfer"):
+                        downloaded = self.download_file(
+                            archive["id"],
+                            archive_path,
+                            archive.get("md5Checksum"),
+                            file_progress.update,
+                        )
+                    file_progress.finish()
+                    if not downloaded:
+                        return False
+                    extract_archive(archive_path, local_path, overwrite)
+                return True
+
+            return self.download_from_gdrive(
+                game_folder["id"], local_path, overwrite, game_progress, skip=other_layouts
+            )
+        except HttpError as error:
+            logger.error(f"Restoring {game_name} failed, Drive couldn't be listed: {error}")
+            return False
+        finally:
+            progress.finish()
+            self.metrics.write()
+
+    def _stored_layout(self, game_name: str, game_folder_id: str) -> tuple:
+        """Works out which backup under a game folder to restore.
+
+        A game can hold snapshots, a packed archive and mirrored files at
+        once, left there by earlier storage modes. The layout of the mode
+        the game was last backed up in from here wins, otherwise, e.g. on
+        a new machine, the one written most recently.
+
+        Returns:
+            tuple: (layout, names) where layout is STORAGE_VERSIONED for
+                snapshots of either snapshot mode, STORAGE_PACKED or
+                STORAGE_FILES, and names are the entries of the game folder
+                that belong to the other layouts.
+        """
+        created = self.snapshots.list_snapshots(game_folder_id)
+        archive = self.remote_index.lookup(game_folder_id, PACKED_ARCHIVE_NAME)
+        layout_names = {PACKED_ARCHIVE_NAME}
+        if created:
+            layout_names.update(SNAPSHOT_LAYOUT_FOLDERS)
+        mirrored = {
+            name: child
+            for name, child in self.remote_index.children(game_folder_id).items()
+            if name not in layout_names
+        }
+
+        found = {}
+        if created:
+            found[STORAGE_VERSIONED] = max(created.values())
+        if archive:
+            found[STORAGE_PACKED] = _modified_time(archive)
+        if mirrored:
+            found[STORAGE_FILES] = None
+        recorded = self.registry.load_storage_mode(game_name)
+        if recorded in SNAPSHOT_MODES:
+            recorded = STORAGE_VERSIONED
 
-            save_path = Path(root_dir) / child['name']
-            child_exists = Path.exists(save_path)
-            if child['mimeType'] == 'application/vnd.google-apps.folder':
-                if not child_exists:
-                    logger.info(f"Creating {save_path}.")
-                    os.mkdir(save_path)
-                    logger.info(f"{save_path} created.")
-                self.download_from_gdrive(child['id'], str(Path(root_dir) / child['name']))
+        if not found:
+            layout = STORAGE_FILES
+        elif len(found) == 1:
+            layout = next(iter(found))
+        elif recorded in found:
+            layout = recorded
+        else:
+            if STORAGE_FILES in found:
+                found[STORAGE_FILES] = self._newest_modified_time(mirrored.values())
+            layout = max(found, key=found.get)
+        return layout, layout_names if layout == STORAGE_FILES else ()
+
+    def _newest_modified_time(self, children) -> datetime:
+        """Latest modifiedTime of the files among and below `children`."""
+        newest = datetime.min.replace(tzinfo=timezone.utc)
+        for child in children:
+            if child["mimeType"] == FOLDER_MIME_TYPE:
+                files, _ = self.list_remote_tree(child["id"])
+                times = [_modified_time(file) for file in files.values()]
             else:
-                if not child_exists:
-                    logger.info(f"Downloading {save_path}.")
-                    self.download_file(child['id'], save_path)
-                    logger.info(f"{save_path} downloaded.")
+                times = [_modified_time(child)]
+            newest = max([newest] + times)
+        return newest
 
     def folder_processor(self, folder_name: str, parent_folder: str) -> str:
-        existent_folder = self.get_metadata(folder_name, parent_folder, type="folder")
+        """Id of the folder called `folder_name` in `parent_folder`, created
+        if it's missing. None if it couldn't be created."""
+        existent_folder = self.remote_index.lookup(
+            parent_folder, folder_name, type="folder"
+        )
         if not existent_folder:
             logger.info(f"{folder_name} doesn't exist. Attempting to create.")
-            current_folder_id = self.upload_to_gdrive(
+            created_folder = self.upload_to_gdrive(
                 folder_name, parents=[parent_folder], type="folder"
             )
+            if not created_folder:
+                logger.error(f"{folder_name} folder not created.")
+                return None
+            self.remote_index.add(parent_folder, created_folder)
+            current_folder_id = created_folder["id"]
             logger.info(f"{folder_name} folder created.")
         else:
             logger.info(f"{folder_name} folder exists.")
-            current_folder_id = existent_folder[0]["id"]
+            current_folder_id = existent_folder["id"]
 
         return current_folder_id
 
-    def file_processor(self, path: str, file: str, current_folder_id) -> str:
+    def file_processor(
+        self, path: str, file: str, current_folder_id, md5: str = None, on_progress=None
+    ) -> dict:
+        """Uploads or updates a single file and returns its remote metadata,
+        or None if the upload failed.
+
+        An existing remote file is only replaced when its `md5Checksum` differs
+        from the local content, so rewriting identical bytes costs nothing.
+        """
         file_path = f"{path}/{file}"
-        existent_file = self.get_metadata(file, current_folder_id)
+        existent_file = self.remote_index.lookup(current_folder_id, file)
 
         if not existent_file:
-            file_id = self.upload_to_gdrive(file_path, parents=[current_folder_id])
+            created_file = self.upload_to_gdrive(
+                file_path, parents=[current_folder_id], on_progress=on_progress
+            )
+            if created_file:
+                self.remote_index.add(current_folder_id, created_file)
+            return created_file
+
+        md5 = md5 or self.hash_cache.md5(file_path)
+        if existent_file.get("md5Checksum") != md5:
+            logger.info(f"{file_path} updating.")
+            updated_file = self.upload_to_gdrive(
+                file_path, existent_file["id"], update=True, on_progress=on_progress
+            )
+            if updated_file:
+                logger.info(f"{file_path} successfully updated.")
+                self.remote_index.add(current_folder_id, updated_file)
+                return updated_file
+            logger.error(f"{file_path} not updated.")
+            return None
         else:
-            file_id = existent_file[0]["id"]
-            local_modified_time = datetime.fromtimestamp(
-                os.path.getmtime(file_path), tz=timezone.utc
-            ).isoformat()
-            remote_modified_time = existent_file["modifiedTime"]
-
-            if local_modified_time > remote_modified_time:
-                logger.info(f"{file_path} updating.")
-                if self.update_file(file_path, existent_file.get("id")):
-                    logger.info(f"{file_path} successfully updated.")
+            logger.info(f"{file_path} already up-to-date.")
+
+        return existent_file
+
+    def ensure_folders(self, manifest: SyncManifest, rel_dirs, local_path: str) -> None:
+        """Makes sure every folder in `rel_dirs` exists under the game folder.
+
+        Works one directory level at a time: the parents of a level are listed
+        in one batch, then every folder still missing on that level is created
+        in another, so a deep tree costs a couple of round-trips per level
+        rather than per folder. Ids end up in `manifest.folders`; folders that
+        couldn't be created are logged against their local path and left out.
+        """
+        wanted = {"."}
+        for rel_dir in rel_dirs:
+            while rel_dir not in wanted:
+                wanted.add(rel_dir)
+                rel_dir = os.path.dirname(rel_dir) or "."
+
+        saves_id = self.folder_ids[Path(DEFAULT_GDRIVE_REMOTE_SAVE_FOLDER).parts[-1]]
+        levels = {}
+        for rel_dir in wanted - set(manifest.folders):
+            depth = 0 if rel_dir == "." else rel_dir.count("/") + 1
+            levels.setdefault(depth, []).append(rel_dir)
+
+        for depth in sorted(levels):
+            parents = {}
+            for rel_dir in levels[depth]:
+                if rel_dir == ".":
+                    parents[rel_dir] = (manifest.game_name, saves_id)
+                elif manifest.folders.get(os.path.dirname(rel_dir) or "."):
+                    parent_id = manifest.folders[os.path.dirname(rel_dir) or "."]
+                    parents[rel_dir] = (os.path.basename(rel_dir), parent_id)
+
+            self.remote_index.prefetch({parent for _, parent in parents.values()})
+            missing = {}
+            for rel_dir, (name, parent_id) in parents.items():
+                existent_folder = self.remote_index.lookup(parent_id, name, type="folder")
+                if existent_folder:
+                    manifest.folders[rel_dir] = existent_folder["id"]
                 else:
-                    logger.info(f"{file_path} not updated.")
-            else:
-                logger.info(f"{file_path} already up-to-date.")
+                    missing[rel_dir] = (name, parent_id)
 
-        return file_id
+            if missing:
+                logger.info(f"Creating {len(missing)} folders for {manifest.game_name}.")
+            for rel_dir, created_folder in self.create_folders(missing).items():
+                if created_folder:
+                    manifest.folders[rel_dir] = created_folder["id"]
+                    self.remote_index.add(missing[rel_dir][1], created_folder)
+                else:
+                    logger.error(
+                        f"Could not create remote folder for {os.path.join(local_path, rel_dir)}."
+                    )
 
-    def upload_files(self, local_path: str, game_name: str):
-        """Method for uploading all contents of given path.
+    def list_remote_tree(self, folder_id: str, prefix: str = "") -> tuple:
+        """Recursively lists a remote folder.
 
-        TODO: Upload to Saves/game_name
+        Returns:
+            tuple: (files, folders) where files maps a relative path to its
+            metadata and folders maps a relative path to its folder id.
         """
-        top_folder = Path(local_path).parts[-1]
+        files, folders = {}, {}
+        for child in self.remote_index.children(folder_id).values():
+            rel_path = f"{prefix}{child['name']}"
+            if child["mimeType"] == "application/vnd.google-apps.folder":
+                folders[rel_path] = child["id"]
+                sub_files, sub_folders = self.list_remote_tree(
+                    child["id"], f"{rel_path}/"
+                )
+                files.update(sub_files)
+                folders.update(sub_folders)
+            else:
+                files[rel_path] = child
+        return files, folders
+
+    def reconcile_manifest(self, manifest: SyncManifest) -> None:
+        """Drops manifest entries that no longer match what is on Drive."""
         saves_id = self.folder_ids[Path(DEFAULT_GDRIVE_REMOTE_SAVE_FOLDER).parts[-1]]
-        game_id = self.folder_processor(game_name, saves_id)
-        self.folder_ids[game_name] = game_id
-        for path, dirs, files in os.walk(local_path):
-            parts = Path(path).parts
-            parent_folder_id = (
-                self.folder_ids[path] if parts[-1] != top_folder else game_id
+        existent_folder = self.remote_index.lookup(
+            saves_id, manifest.game_name, type="folder"
+        )
+        if not existent_folder:
+            logger.info(f"{manifest.game_name} not on GDrive. Clearing manifest.")
+            manifest.clear()
+            return
+
+        manifest.folders["."] = existent_folder["id"]
+        remote_files, remote_folders = self.list_remote_tree(manifest.folders["."])
+        dropped = manifest.reconcile(remote_files, remote_folders)
+        logger.info(f"Reconciled {manifest.game_name}: {dropped} stale entries.")
+
+    def _upload_file_task(
+        self,
+        manifest: SyncManifest,
+        path: str,
+        file: str,
+        rel_path: str,
+        stat,
+        file_progress: FileProgress,
+        token: CancelToken,
+    ) -> None:
+        """Runs on a transfer worker: uploads one file and records it.
+        False if the upload failed."""
+        try:
+            token.checkpoint()
+            with self.metrics.phase("transfer"):
+                return self._upload_file(
+                    manifest, path, file, rel_path, stat, chunk_callback(file_progress, token)
+                )
+        finally:
+            file_progress.finish()
+
+    def _upload_file(
+        self,
+        manifest: SyncManifest,
+        path: str,
+        file: str,
+        rel_path: str,
+        stat,
+        on_progress,
+    ) -> bool:
+        file_path = os.path.join(path, file)
+        with self.metrics.phase("hash"):
+            md5 = self.hash_cache.md5(file_path, stat)
+
+        entry = manifest.files.get(rel_path)
+        if entry and entry.get("remote_id") and entry["md5"] == md5:
+            # Touched but rewritten with the same bytes.
+            logger.info(f"{file_path} content unchanged since last backup.")
+            manifest.record(
+                rel_path, stat, md5, entry["remote_id"], entry["remote_modified_time"]
             )
-            for folder_name in dirs:
-                logger.info(f"Processing {path}\\{folder_name} folder.")
-                folder_id = self.folder_processor(folder_name, parent_folder_id)
-                self.folder_ids[f"{path}\\{folder_name}"] = folder_id
-                logger.info(
-                    f"Folder {path}\\{folder_name} processed. Folder id is: {folder_id}."
+            return True
+
+        parent_folder_id = manifest.folders[os.path.dirname(rel_path) or "."]
+        remote_file = self.file_processor(path, file, parent_folder_id, md5, on_progress)
+        if not remote_file:
+            return False
+        manifest.record(
+            rel_path,
+            stat,
+            md5,
+            remote_file["id"],
+            remote_file.get("modifiedTime"),
+        )
+        logger.info(f"{file_path} processed. File id is: {remote_file['id']}.")
+        return True
+
+    def upload_games(
+        self,
+        save_list: list,
+        progress_callback=None,
+        token: CancelToken = None,
+        reconcile: bool = False,
+        rebuild_manifest: bool = False,
+        transfer_callback=None,
+    ) -> dict:
+        """Uploads several games through one shared pool of transfer workers.
+
+        Games are walked one after another on the calling thread, which also
+        creates any missing remote folders level by level, so a parent always
+        exists before its children. Changed files are handed to the workers through a
+        bounded queue, so one game's uploads overlap with the next game's walk.
+        Files whose size and mtime match the game's sync manifest are skipped
+        without contacting Drive. How the rest are stored depends on the game's
+        storage mode: as versioned snapshots by default (see `SnapshotStorage`),
+        mirrored in place, or as a single archive (see `_upload_packed_task`).
+
+        Args:
+            save_list (list): (game_name, local_path) pairs.
+            progress_callback (callable): Called with (games_completed,
+                game_name) when a game starts and when it finishes.
+            token (CancelToken): Checked before each game, each file and each
+                chunk. Canceling stops the run within a chunk; files finished
+                by then are recorded, so the next run doesn't look at them
+                again and half-sent resumable uploads pick up where they
+                stopped. Pausing holds every transfer until it's resumed.
+            reconcile (bool): Check manifests against Drive first, for when the
+                remote side may have been changed by hand.
+            rebuild_manifest (bool): Forget manifests and check every file again.
+            transfer_callback (callable): Called with a ProgressReport, with
+                bytes and files sent across all games, every REPORT_INTERVAL
+                seconds or so.
+
+        Returns:
+            dict: game name -> how its backup went, see `GameTracker.status`.
+                Games a canceled run didn't get to are left out.
+        """
+        # Listings are only trusted for the length of one run.
+        self.remote_index.clear()
+        self.metrics.reset()
+        settings = load_game_settings()
+        completed = []
+        statuses = {}
+        progress = TransferProgress("Upload", transfer_callback)
+        token = token or CancelToken()
+
+        def game_complete(tracker: GameTracker):
+            # Only files that made it to Drive were recorded, failed ones are
+            # tried again next run.
+            tracker.manifest.save()
+            status = statuses[tracker.game_name] = tracker.status
+            self.registry.record_backup(
+                tracker.game_name, tracker.started, tracker.tasks - tracker.failed, status
+            )
+            if status == "canceled":
+                logger.info(f"Stopped uploading {tracker.game_name}.")
+                return
+            completed.append(tracker.game_name)
+            if tracker.failed:
+                logger.error(
+                    f"{tracker.failed} of {tracker.tasks} uploads of {tracker.game_name} failed."
                 )
+            logger.info(f"Finished uploading {tracker.game_name}, {status}.")
+            if progress_callback:
+                progress_callback(len(completed), tracker.game_name)
+
+        with TransferEngine(self.workers) as engine:
+            try:
+                for game_name, local_path in save_list:
+                    token.checkpoint()
+                    if progress_callback:
+                        progress_callback(len(completed), game_name)
+
+                    manifest = SyncManifest(game_name, self.registry)
+                    mode = storage_mode(game_name, settings)
+                    if rebuild_manifest:
+                        manifest.clear()
+                    tracker = GameTracker(
+                        game_name,
+                        game_complete,
+                        manifest,
+                        progress=progress.game(game_name),
+                        token=token,
+                    )
+                    try:
+                        if manifest.use_mode(mode):
+                            # Entries of another mode point at another layout.
+                            logger.info(
+                                f"{game_name} is now stored as {mode}. Checking every file again."
+                            )
+                        elif reconcile:
+                            with self.metrics.phase("plan"):
+                                self.reconcile_manifest(manifest)
+
+                        if mode == STORAGE_PACKED:
+                            self._queue_packed_game(engine, tracker, local_path)
+                        elif mode in SNAPSHOT_MODES:
+                            self.snapshots.queue_game(
+                                engine,
+                                tracker,
+                                local_path,
+                                mode,
+                                retention_policy(game_name, settings),
+                            )
+                        else:
+                            self._queue_game(engine, tracker, local_path)
+                    except HttpError as error:
+                        # Going on without a listing would upload duplicates.
+                        logger.error(f"Skipping {game_name}, Drive couldn't be listed: {error}")
+                        tracker.task_added()
+                        tracker.task_done(False)
+                    finally:
+                        tracker.finish_submitting()
+            except TransferCanceled:
+                logger.info("Upload canceled.")
+
+        progress.finish()
+        self.hash_cache.save()
+        self.metrics.write()
+        return statuses
+
+    def _queue_game(self, engine: TransferEngine, tracker: GameTracker, local_path: str):
+        manifest = tracker.manifest
+        changed = []
+        with self.metrics.phase("scan"):
+            for path, dirs, files in os.walk(local_path):
+                rel_dir = Path(os.path.relpath(path, local_path)).as_posix()
+                for file in files:
+                    tracker.token.checkpoint()
+                    file_path = os.path.join(path, file)
+                    rel_path = file if rel_dir == "." else f"{rel_dir}/{file}"
+                    try:
+                        stat = os.stat(file_path)
+                    except OSError as e:
+                        # Games often delete temporary files while saving.
+                        logger.warning(f"Skipping {file_path}, it can't be read: {e}")
+                        continue
+
+                    if manifest.is_unchanged(rel_path, stat):
+                        logger.info(f"{file_path} unchanged since last backup.")
+                        continue
+                    changed.append((path, file, rel_dir, rel_path, stat))
+
+        if not changed:
+            return
+        with self.metrics.phase("plan"):
+            self.ensure_folders(
+                manifest, {rel_dir for _, _, rel_dir, _, _ in changed}, local_path
+            )
+
+        for path, file, rel_dir, rel_path, stat in changed:
+            if rel_dir not in manifest.folders:
+                logger.error(f"Skipping {os.path.join(path, file)}, its folder is missing.")
+                continue
+            logger.info(f"Queueing {os.path.join(path, file)}.")
+            tracker.task_added()
+            engine.submit(
+                self._upload_file_task,
+                manifest,
+                path,
+                file,
+                rel_path,
+                stat,
+                tracker.progress.add_file(stat.st_size),
+                tracker.token,
+                on_done=tracker.task_done,
+            )
+
+    def _queue_packed_game(
+        self, engine: TransferEngine, tracker: GameTracker, local_path: str
+    ):
+        manifest = tracker.manifest
+        with self.metrics.phase("scan"):
+            stats = local_stats(local_path)
+        # Entries recorded by a packed upload all point at the one archive.
+        # Anything else was stored another way and the archive may not exist.
+        archive_ids = {entry.get("remote_id") for entry in manifest.files.values()}
+        if (
+            manifest.mode == STORAGE_PACKED
+            and len(archive_ids) <= 1
+            and manifest.all_unchanged(stats)
+        ):
+            logger.info(f"{manifest.game_name} unchanged since last packed backup.")
+            return
+
+        with self.metrics.phase("plan"):
+            self.ensure_folders(manifest, [], local_path)
+        if "." not in manifest.folders:
+            logger.error(f"Skipping {manifest.game_name}, its folder is missing.")
+            return
+        logger.info(f"Queueing packed backup of {local_path}.")
+        tracker.task_added()
+        # Counted in uncompressed bytes, the archive's size isn't known up front.
+        file_progress = tracker.progress.add_file(
+            sum(stat.st_size for stat in stats.values())
+        )
+        engine.submit(
+            self._upload_packed_task,
+            manifest,
+            local_path,
+            stats,
+            file_progress,
+            tracker.token,
+            on_done=tracker.task_done,
+        )
+
+    def _upload_packed_task(
+        self,
+        manifest: SyncManifest,
+        local_path: str,
+        stats: dict,
+        file_progress: FileProgress,
+        token: CancelToken,
+    ):
+        """Runs on a transfer worker: streams the whole save folder into one
+        compressed archive on Drive, replacing the previous one. False if the
+        upload failed."""
+        token.checkpoint()
+        game_folder_id = manifest.folders["."]
+        existent_file = self.remote_index.lookup(game_folder_id, PACKED_ARCHIVE_NAME)
+        media = TarStreamUpload(local_path, self.chunk_size)
+        file_object = self._service().files()
+        if existent_file:
+            request = file_object.update(
+                fileId=existent_file["id"], media_body=media, fields=METADATA_FIELDS
+            )
+        else:
+            request = file_object.create(
+                body={"name": PACKED_ARCHIVE_NAME, "parents": [game_folder_id]},
+                media_body=media,
+                fields=METADATA_FIELDS,
+            )
+
+        try:
+            response = None
+            with self.metrics.phase("transfer"):
+                while response is None:
+                    status, response = self.api.call(request.next_chunk)
+                    if status:
+                        logger.info(f"Packed {status.resumable_progress} bytes of {local_path}.")
+                        file_progress.update(status.resumable_progress)
+                        token.checkpoint()
+        except HttpError as error:
+            logger.error(f"An error occurred: {error}")
+            return False
+        finally:
+            media.close()
+            file_progress.finish()
+
+        self.remote_index.add(game_folder_id, response)
+        self.count_transfer("upload", int(response.get("size", 0)))
+        for rel_path in set(manifest.files) - set(stats):
+            manifest.forget(rel_path)
+        for rel_path, stat in stats.items():
+            manifest.record(rel_path, stat, None, response["id"], response.get("modifiedTime"))
+        logger.info(f"{local_path} packed. File id is: {response['id']}.")
+        return True
+
+    def upload_files(
+        self,
+        local_path: str,
+        game_name: str,
+        reconcile: bool = False,
+        rebuild_manifest: bool = False,
+        token: CancelToken = None,
+    ) -> str:
+        """Method for uploading all contents of given path to saves/game_name.
+
+        See `upload_games`, this is the single-game form of it.
+
+        Returns:
+            str: How the backup went, see `GameTracker.status`.
+        """
+        statuses = self.upload_games(
+            [(game_name, local_path)],
+            token=token,
+            reconcile=reconcile,
+            rebuild_manifest=rebuild_manifest,
+        )
+        return statuses.get(game_name, "canceled")
+
+
+def _modified_time(metadata: dict) -> datetime:
+    return datetime.fromisoformat(metadata["modifiedTime"].replace("Z", "+00:00"))
+
+
+class _HashingWriter:
+    """File wrapper that keeps an md5 of everything written through it."""
 
-            for file in files:
-                logger.info(f"Processing {path}\\{file}.")
-                file_id = self.file_processor(path, file, parent_folder_id)
-                logger.info(f"{path}\\{file} processed. File id is: {file_id}.")
+    def __init__(self, f):
+        self._f = f
+        self._md5 = hashlib.md5()
+        self.size = 0
 
+    def write(self, data: bytes) -> int:
+        self._md5.update(data)
+        self.size += len(data)
+        return self._f.write(data)
 
+    def hexdigest(self) -> str:
+        return self._md5.hexdigest()
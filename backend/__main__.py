@@ -0,0 +1,215 @@
+"""Command line interface, for scripted and scheduled backups.
+
+    python -m backend status
+    python -m backend discover
+    python -m backend backup [game ...]
+    python -m backend restore <game> [--to PATH] [--snapshot NAME] [--overwrite]
+    python -m backend snapshots <game>
+    python -m backend watch
+
+Nothing here imports Qt, and the Google client libraries are only imported by
+the commands that talk to Drive, so `status` and `discover` start quickly.
+"""
+import sys
+import time
+import signal
+import argparse
+
+from backend.registry import SaveRegistry
+from backend.status import game_status, format_size
+from backend.game_settings import load_game_settings, storage_mode
+from backend.file_discovery import start_discovery
+from backend.watcher import BackupDaemon, DEFAULT_DEBOUNCE, DEFAULT_SETTLE
+from backend.transfer import CancelToken
+
+
+def load_saves() -> dict:
+    """game name -> save folder, as found by discovery or added in the GUI."""
+    return SaveRegistry().saves()
+
+
+def select_saves(saves: dict, games: list) -> dict:
+    if not games:
+        return saves
+    unknown = [game for game in games if game not in saves]
+    if unknown:
+        raise SystemExit(f"Unknown game(s): {', '.join(unknown)}")
+    return {game: saves[game] for game in games}
+
+
+def print_progress(report) -> None:
+    """Keeps one status line up to date on a terminal. Left out when the
+    output goes to a file, the log has the same numbers."""
+    if sys.stderr.isatty():
+        sys.stderr.write(f"\r\033[K{report.game_name}: {report}")
+        sys.stderr.flush()
+
+
+def end_progress() -> None:
+    if sys.stderr.isatty():
+        sys.stderr.write("\r\033[K")
+
+
+def connect():
+    # Imported here so the commands that stay offline never load googleapiclient.
+    from backend.GDrive import GDrive
+
+    return GDrive()
+
+
+def status(args) -> int:
+    registry = SaveRegistry()
+    saves = select_saves(registry.saves(), args.games)
+    settings = load_game_settings()
+    width = max((len(name) for name in saves), default=0)
+    for game_name, save_path in saves.items():
+        status = game_status(game_name, save_path, registry)
+        last_backup = (
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(status["last_backup"]))
+            if status["last_backup"]
+            else "-"
+        )
+        size = format_size(status["size"]) if status["size"] is not None else "-"
+        print(
+            f"{game_name:<{width}}  {storage_mode(game_name, settings):<9}  "
+            f"{last_backup:<16}  {size:>9}  {status['state']:<20}  {save_path}"
+        )
+    return 0
+
+
+def discover(args) -> int:
+    start_discovery(use_cache=not args.full)
+    return 0
+
+
+def backup(args) -> int:
+    saves = select_saves(load_saves(), args.games)
+    drive = connect()
+    token = CancelToken()
+
+    def interrupt(signum, frame) -> None:
+        # The first Ctrl+C stops cleanly within a chunk, so finished files are
+        # recorded and the next backup resumes. A second one gives up at once.
+        if token.canceled:
+            raise KeyboardInterrupt
+        end_progress()
+        print("Stopping, press Ctrl+C again to quit right away.", file=sys.stderr)
+        token.cancel()
+
+    previous_handler = signal.signal(signal.SIGINT, interrupt)
+    try:
+
+        def report(completed: int, game_name: str) -> None:
+            end_progress()
+            print(f"[{completed}/{len(saves)}] {game_name}")
+
+        statuses = drive.upload_games(
+            list(saves.items()),
+            report,
+            token,
+            reconcile=args.reconcile,
+            rebuild_manifest=args.rebuild_manifest,
+            transfer_callback=print_progress,
+        )
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+        end_progress()
+        drive.close()
+    unfinished = [
+        f"{game} ({statuses.get(game, 'canceled')})"
+        for game in saves
+        if statuses.get(game) != "completed"
+    ]
+    if unfinished:
+        print(f"Not fully backed up: {', '.join(unfinished)}", file=sys.stderr)
+    return 1 if unfinished else 0
+
+
+def restore(args) -> int:
+    save_path = args.to or load_saves().get(args.game)
+    if not save_path:
+        raise SystemExit(f"No save folder known for {args.game}, pass --to.")
+    drive = connect()
+    try:
+        restored = drive.restore_game(
+            args.game,
+            save_path,
+            args.overwrite,
+            args.snapshot,
+            transfer_callback=print_progress,
+        )
+    finally:
+        end_progress()
+        drive.close()
+    print(f"Restored {args.game} to {save_path}." if restored else "Restore failed.")
+    return 0 if restored else 1
+
+
+def snapshots(args) -> int:
+    drive = connect()
+    try:
+        for name in drive.list_snapshots(args.game):
+            print(name)
+    finally:
+        drive.close()
+    return 0
+
+
+def watch(args) -> int:
+    drive = connect()
+    daemon = BackupDaemon(
+        drive, select_saves(load_saves(), args.games), args.debounce, args.settle
+    )
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        drive.close()
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m backend", description="Back up game saves to Google Drive.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("status", help="Show which games changed since their last backup.")
+    command.add_argument("games", nargs="*")
+    command.set_defaults(func=status)
+
+    command = commands.add_parser("discover", help="Look for save folders.")
+    command.add_argument("--full", action="store_true", help="List every folder again instead of reusing the last run's listings.")
+    command.set_defaults(func=discover)
+
+    command = commands.add_parser("backup", help="Upload saves, all games by default.")
+    command.add_argument("games", nargs="*")
+    command.add_argument("--reconcile", action="store_true", help="Check manifests against Drive first.")
+    command.add_argument("--rebuild-manifest", action="store_true", help="Forget the local manifests and check every file again.")
+    command.set_defaults(func=backup)
+
+    command = commands.add_parser("restore", help="Download a game's saves.")
+    command.add_argument("game")
+    command.add_argument("--to", help="Restore here instead of the game's save folder.")
+    command.add_argument("--snapshot", help="Snapshot to restore, the latest by default.")
+    command.add_argument("--overwrite", action="store_true", help="Replace existing files.")
+    command.set_defaults(func=restore)
+
+    command = commands.add_parser("snapshots", help="List a game's snapshots.")
+    command.add_argument("game")
+    command.set_defaults(func=snapshots)
+
+    command = commands.add_parser("watch", help="Back up games whenever their saves change.")
+    command.add_argument("games", nargs="*")
+    command.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE)
+    command.add_argument("--settle", type=float, default=DEFAULT_SETTLE)
+    command.set_defaults(func=watch)
+    return parser
+
+
+def main(argv: list = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
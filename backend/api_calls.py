@@ -0,0 +1,232 @@
+import json
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
+
+from backend.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# Drive allows 12,000 queries a minute per user, 200 a second. The bucket
+# stays a quarter below that; a burst fits one full batch.
+DEFAULT_RATE = 150.0  # requests per second
+DEFAULT_BURST = 100
+DEFAULT_MAX_IN_FLIGHT = 8
+MAX_RETRIES = 8
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 64.0
+# Requests already in flight when Drive starts throttling all come back
+# throttled. Within this many seconds they count as one signal, not several.
+DECREASE_COOLDOWN = 2.0
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+SERVER_ERRORS = {500, 502, 503, 504}
+CONNECTION_ERRORS = (ConnectionError, TimeoutError, httplib2.HttpLib2Error)
+
+
+class TokenBucket:
+    """Spaces requests out to `rate` a second on average, allowing bursts of
+    up to `burst`. Thread safe."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int = 1) -> None:
+        """Takes `tokens`, sleeping until the bucket has refilled enough.
+
+        Tokens are taken right away and the bucket may go negative, so
+        callers are served in the order they arrive and a big batch waits
+        for its share rather than starving behind small requests.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """Limit on requests in flight, adjusted AIMD style.
+
+    Every throttled response halves the limit (at most once per
+    DECREASE_COOLDOWN), and each run of `limit` successes raises it by one
+    again, up to `max_limit`. The limit hovers just below where Drive starts
+    pushing back.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max(min_limit, max_limit)
+        self.min_limit = min_limit
+        self.limit = self.max_limit
+        self._in_flight = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, throttled: bool = False) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                now = time.monotonic()
+                if now - self._last_decrease >= DECREASE_COOLDOWN:
+                    self._last_decrease = now
+                    self.limit = max(self.min_limit, self.limit // 2)
+                    self._successes = 0
+                    logger.info(f"Drive is throttling, down to {self.limit} requests at once.")
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+
+class ApiCaller:
+    """The one way Drive requests are sent.
+
+    Each request waits for the rate limiter and for a slot under the
+    concurrency limit. Throttling (429, or 403 with a rate limit reason),
+    server errors and dropped connections are retried with exponential
+    backoff and jitter, honoring Retry-After. Any other error, or one that
+    persists through MAX_RETRIES, is raised as before.
+
+    Calls, errors, retries and latency are recorded in `metrics` by method
+    (list, create, update, get_media, ...).
+    """
+
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE,
+        burst: int = DEFAULT_BURST,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        max_retries: int = MAX_RETRIES,
+        metrics: Metrics = None,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveConcurrency(max_in_flight)
+        self.max_retries = max_retries
+        self.metrics = metrics or Metrics()
+
+    def execute(self, request, cost: int = 1):
+        """Runs `request.execute()`. `cost` is the number of calls it counts
+        for against the quota, e.g. the size of a batch."""
+        return self.call(request.execute, cost=cost)
+
+    def call(self, func, *args, cost: int = 1, method: str = None):
+        """Runs `func(*args)`, which sends one request, e.g. `next_chunk`.
+
+        Args:
+            method (str): Name to record the call under. Taken from the
+                request `func` belongs to by default.
+        """
+        method = method or request_method(getattr(func, "__self__", None))
+        attempt = 0
+        while True:
+            self.bucket.acquire(cost)
+            self.concurrency.acquire()
+            throttled = False
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            except HttpError as error:
+                self.metrics.count("api_errors", method=method, status=error.resp.status)
+                throttled = is_throttled(error)
+                if attempt >= self.max_retries or not (
+                    throttled or error.resp.status in SERVER_ERRORS
+                ):
+                    raise
+                failure, delay = error, retry_delay(attempt, retry_after(error))
+                reason = "throttled" if throttled else "server_error"
+            except CONNECTION_ERRORS as error:
+                self.metrics.count("api_errors", method=method, status="connection")
+                if attempt >= self.max_retries:
+                    raise
+                failure, delay = error, retry_delay(attempt)
+                reason = "connection"
+            finally:
+                self.concurrency.release(throttled)
+                self.metrics.count("api_calls", method=method)
+                self.metrics.observe(
+                    "api_latency_seconds", time.perf_counter() - start, method=method
+                )
+
+            self.metrics.count("api_retries", method=method, reason=reason)
+            attempt += 1
+            logger.info(f"Drive request failed ({failure}), retry {attempt} in {delay:.1f}s.")
+            time.sleep(delay)
+
+    def should_retry(self, error: Exception) -> bool:
+        """Whether `call` would have retried `error`, for errors that come
+        back some other way, like inside a batch response."""
+        if isinstance(error, HttpError):
+            return is_throttled(error) or error.resp.status in SERVER_ERRORS
+        return isinstance(error, CONNECTION_ERRORS)
+
+
+def request_method(request) -> str:
+    """Short name of a Drive request: "list", "create", "get_media", ..."""
+    if isinstance(request, BatchHttpRequest):
+        return "batch"
+    method = getattr(request, "methodId", None)
+    if not method:
+        return "other"
+    method = method.rsplit(".", 1)[-1]
+    if method == "get" and "alt=media" in getattr(request, "uri", ""):
+        return "get_media"
+    return method
+
+
+def is_throttled(error: HttpError) -> bool:
+    status = error.resp.status
+    if status == 429:
+        return True
+    if status != 403:
+        return False
+    try:
+        errors = json.loads(error.content.decode("utf-8"))["error"].get("errors", [])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return False
+    return any(item.get("reason") in RATE_LIMIT_REASONS for item in errors)
+
+
+def retry_after(error: HttpError) -> float:
+    """Seconds the Retry-After header asks for, or None."""
+    value = error.resp.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(attempt: int, after: float = None) -> float:
+    """Seconds to wait before retry number `attempt + 1`: what Retry-After
+    asked for, or exponential backoff. Either way part of it is random, so
+    clients throttled at the same moment don't all come back together."""
+    if after is not None:
+        return after + random.uniform(0, BACKOFF_BASE)
+    delay = min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
@@ -0,0 +1,150 @@
+import random
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MIN_CHUNK_SIZE = 64 * 1024
+AVG_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+READ_SIZE = 4 * MAX_CHUNK_SIZE
+# Without numpy the rolling hash runs in Python at a few MB/s while holding
+# the GIL, which stalls the other transfer workers. Bigger files are then
+# stored whole instead of chunked, see `chunkable`.
+SLOW_CHUNKING_MAX_FILE_SIZE = 32 * 1024 * 1024
+SCAN_BLOCK = 64 * 1024
+
+# Gear table for the rolling hash. It's seeded so chunk boundaries stay the
+# same across runs and machines, otherwise nothing would ever deduplicate.
+_GEAR = [random.Random(0x5A7E + i).getrandbits(64) for i in range(256)]
+_MASK = AVG_CHUNK_SIZE - 1
+_HASH_BITS = 0xFFFFFFFFFFFFFFFF
+# Only the low bits of the hash are tested, and each byte is shifted one bit
+# further left per step, so those bits only depend on the last few bytes.
+_WINDOW = _MASK.bit_length()
+if numpy is not None:
+    _GEAR_LOW = numpy.array([g & _MASK for g in _GEAR], dtype=numpy.uint32)
+
+
+def chunkable(size: int) -> bool:
+    """Whether a file of `size` bytes is worth splitting into chunks here."""
+    return numpy is not None or size <= SLOW_CHUNKING_MAX_FILE_SIZE
+
+
+def _find_cut(buf: bytearray) -> int:
+    """Length of the first chunk in `buf`, which holds at least one chunk's
+    worth of data or the rest of the file."""
+    end = min(len(buf), MAX_CHUNK_SIZE)
+    if end <= MIN_CHUNK_SIZE:
+        return end
+    if numpy is not None:
+        return _find_cut_numpy(buf, end)
+
+    h = 0
+    gear = _GEAR
+    for i in range(MIN_CHUNK_SIZE, end):
+        h = ((h << 1) + gear[buf[i]]) & _HASH_BITS
+        if not h & _MASK:
+            return i + 1
+    return end
+
+
+def _find_cut_numpy(buf: bytearray, end: int) -> int:
+    """`_find_cut` on whole arrays: the low bits of the hash at every position
+    are the sum of the last _WINDOW gear values, each shifted by its age.
+    Gives the same cuts as the loop, at memory speed and without the GIL.
+    Works through SCAN_BLOCK positions at a time, as most cuts come early."""
+    pos = MIN_CHUNK_SIZE
+    while pos < end:
+        stop = min(pos + SCAN_BLOCK, end)
+        # The bytes before `pos` that still count, the hash starts at the minimum.
+        first = max(MIN_CHUNK_SIZE, pos - _WINDOW + 1)
+        gear = _GEAR_LOW[numpy.frombuffer(buf, numpy.uint8, stop - first, first)]
+        h = gear.copy()
+        for age in range(1, min(_WINDOW, len(gear))):
+            # Wraps around in 32 bits, which leaves the masked bits intact.
+            h[age:] += gear[:-age] << numpy.uint32(age)
+        cuts = numpy.flatnonzero((h[pos - first :] & numpy.uint32(_MASK)) == 0)
+        if len(cuts):
+            return pos + int(cuts[0]) + 1
+        pos = stop
+    return end
+
+
+def iter_chunks(path: str):
+    """Splits a file into content-defined chunks.
+
+    Boundaries are picked with a gear rolling hash, so an edit only changes the
+    chunks around it and the rest of the file still matches chunks uploaded by
+    earlier versions. Chunks are between MIN_CHUNK_SIZE and MAX_CHUNK_SIZE
+    bytes, averaging about AVG_CHUNK_SIZE.
+
+    Yields:
+        bytes: The chunks, in order.
+    """
+    buf = bytearray()
+    with open(path, "rb") as f:
+        eof = False
+        while not eof:
+            data = f.read(READ_SIZE)
+            eof = not data
+            buf += data
+            while len(buf) >= MAX_CHUNK_SIZE or (eof and buf):
+                cut = _find_cut(buf)
+                yield bytes(buf[:cut])
+                del buf[:cut]
+
+
+class ChunkRegistry:
+    """Thread-safe record of the chunk digests stored remotely.
+
+    Workers `claim` a digest before uploading it, so two files sharing a new
+    chunk don't both send it. A file that finds its chunk claimed by another
+    worker must `wait` for that upload before counting on the chunk.
+    """
+
+    def __init__(self, known=()):
+        self._known = set(known)
+        # digest -> Event set once the claiming worker is done with it.
+        self._uploading = {}
+        self._lock = threading.Lock()
+
+    def claim(self, digest: str) -> bool:
+        """True if the caller should upload the chunk, and then `confirm` or
+        `release` it."""
+        with self._lock:
+            if digest in self._known or digest in self._uploading:
+                return False
+            self._uploading[digest] = threading.Event()
+            return True
+
+    def confirm(self, digest: str) -> None:
+        """Marks a claimed chunk as stored."""
+        with self._lock:
+            self._known.add(digest)
+            done = self._uploading.pop(digest)
+        done.set()
+
+    def release(self, digest: str) -> None:
+        """Gives a claimed chunk back after its upload failed."""
+        with self._lock:
+            done = self._uploading.pop(digest, None)
+        if done:
+            done.set()
+
+    def wait(self, digest: str) -> bool:
+        """Blocks while a chunk is being uploaded by another worker.
+
+        Returns:
+            bool: True if the chunk is stored, False if nobody managed to.
+        """
+        while True:
+            with self._lock:
+                if digest in self._known:
+                    return True
+                done = self._uploading.get(digest)
+            if done is None:
+                return False
+            done.wait()
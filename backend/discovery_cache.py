@@ -0,0 +1,63 @@
+import os
+import time
+import threading
+from pathlib import Path
+
+from backend.utilities import load_from_json, save_to_json
+
+DISCOVERY_CACHE_PATH = Path("./data/discovery_cache.json")
+# Listings of directories modified this recently aren't trusted on the next run:
+# another change within the same mtime tick (2s on FAT) would go unnoticed.
+RACY_WINDOW_NS = 2 * 1_000_000_000
+
+
+class DiscoveryCache:
+    """Subdirectory listings from the last discovery, keyed by path and valid
+    while the directory's mtime matches.
+
+    A directory's mtime changes whenever an entry directly inside it is added,
+    removed or renamed, so an unchanged directory can be walked from the cache
+    at the cost of one `stat` instead of a full listing. Changes further down
+    only touch their own parent, which is checked the same way when the walk
+    gets there. The file is only rewritten when a listing changed.
+    """
+
+    def __init__(self, location: Path = DISCOVERY_CACHE_PATH):
+        self.location = Path(location)
+        self._lock = threading.Lock()
+        self._previous = load_from_json(self.location) if self.location.exists() else {}
+        self._current = {}
+        self._recorded = False
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str, stat: os.stat_result) -> list:
+        """Cached subdirectory names of `path`, or None when it has to be listed."""
+        entry = self._previous.get(path)
+        if entry and entry["mtime_ns"] == stat.st_mtime_ns:
+            with self._lock:
+                self._current[path] = entry
+                self.hits += 1
+            return entry["subdirs"]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def record(self, path: str, stat: os.stat_result, subdirs: list) -> None:
+        if time.time_ns() - stat.st_mtime_ns < RACY_WINDOW_NS:
+            return
+        with self._lock:
+            self._current[path] = {"mtime_ns": stat.st_mtime_ns, "subdirs": subdirs}
+            self._recorded = True
+
+    def save(self) -> None:
+        """Keeps only the directories seen by this run, so removed folders and
+        folders below a newly found save folder drop out."""
+        with self._lock:
+            # Hits reuse the previous entries, so the same paths mean the same file.
+            if self._recorded or self._current.keys() != self._previous.keys():
+                os.makedirs(self.location.parent, exist_ok=True)
+                save_to_json(self._current, self.location)
+            self._previous = self._current
+            self._current = {}
+            self._recorded = False
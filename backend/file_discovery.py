@@ -1,15 +1,21 @@
 import os
 import re
 import sys
+import logging
 
 sys.path[0] += "\\.."
-from backend.utilities import load_from_json, save_to_json
+from backend.registry import SaveRegistry
+from backend.discovery_cache import DiscoveryCache
 import pathlib
 
-import concurrent.futures
+import queue
 import threading
+from typing import NamedTuple
 
-json_lock = threading.Lock()
+from backend import steam
+from backend.known_saves import load_known_saves, build_index, windows_folders
+
+logger = logging.getLogger(__name__)
 
 # Don't really like this, but we'll figure out a better solution later
 # Maybe save these to a configuration file in json?
@@ -22,8 +28,6 @@ PC_DEFAULT = [
 
 REMOTE_SAVE_PATH = "root/saves/"
 
-# Maybe we should use SQL instead of saving to json. Would allow saving date backed up.
-DISCOVERED_FOLDERS_PATH = pathlib.Path("./data/discovered_folders.json")
 EXCLUDED_FOLDERS = set(
     [
         "Python",
@@ -36,62 +40,303 @@ EXCLUDED_FOLDERS = set(
     ]
 )
 
-def discover_folders_parallel(paths_to_process: list) -> None:
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        # Submit the discover_folders function for each path to process
-        results = [executor.submit(discover_folders, path) for path in paths_to_process]
+# How many levels below each search root are looked at.
+MAX_DEPTH = 12
+# Saves rarely sit deep inside a game's install folder, unlike in AppData.
+INSTALL_DIR_DEPTH = 4
+DISCOVERY_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# Directories between two progress reports.
+PROGRESS_INTERVAL = 100
+# Levels below each root that are always spread over the workers. Deeper
+# down, unchanged directories are walked by the worker that reached them.
+INLINE_DEPTH = 2
+
 
-        # Wait for all tasks to complete
-        concurrent.futures.wait(results)
+class SearchRoot(NamedTuple):
+    path: str
+    # Name for every save folder found below, instead of guessing it from the path.
+    game_name: str = None
+    max_depth: int = MAX_DEPTH
+    # The path is itself a save folder, no need to search it.
+    save_folder: bool = False
 
-    joined_results = {}
-    
-    for result in results:
-        joined_results.update(result.result())
 
-    save_to_json(joined_results, DISCOVERED_FOLDERS_PATH)
+def discover_folders_parallel(
+    paths_to_process: list,
+    use_cache: bool = True,
+    registry: SaveRegistry = None,
+    on_found=None,
+    progress_callback=None,
+    should_stop=None,
+) -> list:
+    """Searches all `paths_to_process` and adds the new save folders to the
+    registry.
 
-def discover_folders(path: str) -> None:
-    """Method to discover location of save files. Currently only seeks steam save data in Windows.
+    Args:
+        use_cache (bool): Reuse the listings of directories that haven't changed
+            since the last discovery. False lists everything again.
+        on_found (callable): Called with (game_name, save_path) for every
+            save folder added, as soon as it is found. Each one is then added
+            to the registry on its own instead of all at the end.
+        progress_callback, should_stop: See `DirectoryScanner`.
 
-    TODO:   - Make OS agnostic
-            - Error Handling
+    Returns:
+        list: The (game name, save folder) pairs that were added.
     """
-    with json_lock:
-        discovered_folders = load_from_json(DISCOVERED_FOLDERS_PATH)
+    registry = registry or SaveRegistry()
+    cache = DiscoveryCache() if use_cache else None
+    added = []
 
+    def add_found(game_name: str, save_path: str) -> None:
+        if registry.add_save(game_name, save_path):
+            added.append((game_name, save_path))
+            on_found(game_name, save_path)
 
-    discovered_paths = set(discovered_folders.values())
-    discovered_game_names = set(discovered_folders)
-
-
-    for root, dirs, files in os.walk(path):
-        if root.count(os.sep) > 15:
-            dirs[:] = []
-        else:
-            dirs[:] = set(dirs) - EXCLUDED_FOLDERS - discovered_game_names
-            matching = [dir for dir in dirs if dir.lower().startswith('save')]
-            if matching:
-                save_path = f"{root}/{matching[0]}"
-                dirs[:] = []
-                
-                if len(os.listdir(save_path)) > 0 and str(
-                    pathlib.Path(save_path)
-                ) not in discovered_paths:
-                    p = pathlib.Path(root)
-
-                    if "common" in root:
-                        game_name = p.parts[p.parts.index("common") + 1]
-                    else:
-                        game_name = p.parts[-1]
-
-                    discovered_folders[game_name] = str(pathlib.Path(save_path))
+    scanner = DirectoryScanner(
+        skip_names=set(registry.saves()),
+        cache=cache,
+        on_found=add_found if on_found else None,
+        progress_callback=progress_callback,
+        should_stop=should_stop,
+    )
+    found = scanner.scan(paths_to_process)
+    if not on_found:
+        # Earlier roots are the more reliable ones, and entries the user
+        # already has are never replaced.
+        added = registry.add_saves(found)
+    # A canceled scan didn't see every directory, keep the old listings.
+    if cache and not scanner.canceled:
+        cache.save()
+    return added
 
+
+def discover_folders(path: str, registry: SaveRegistry = None) -> dict:
+    """Method to discover location of save files under a single path.
+
+    Returns:
+        dict: The registered save folders plus the ones found under `path`.
+    """
+    discovered_folders = (registry or SaveRegistry()).saves()
+    discovered_paths = set(discovered_folders.values())
+    scanner = DirectoryScanner(skip_names=set(discovered_folders))
+    for game_name, save_path in scanner.scan([path]):
+        if save_path not in discovered_paths and game_name not in discovered_folders:
+            discovered_folders[game_name] = save_path
+            discovered_paths.add(save_path)
     return discovered_folders
 
 
+class DirectoryScanner:
+    """Looks for save folders under several roots with a pool of threads.
+
+    Every directory is its own task on a shared queue, so a big root such as
+    AppData is spread over all workers instead of keeping one thread busy
+    while the others sit idle. Below the first INLINE_DEPTH levels, the
+    worker that finds a directory unchanged in the cache walks its cached
+    subdirectories itself, which only costs a `stat` each.
+    """
+
+    def __init__(
+        self,
+        skip_names: set = None,
+        workers: int = DISCOVERY_WORKERS,
+        max_depth: int = MAX_DEPTH,
+        cache: DiscoveryCache = None,
+        on_found=None,
+        progress_callback=None,
+        should_stop=None,
+    ):
+        """
+        Args:
+            skip_names (set): Directory names not to descend into, on top of
+                EXCLUDED_FOLDERS. Usually the names of games already found.
+            workers (int): Number of threads listing directories.
+            max_depth (int): Levels below each plain path root to look at.
+            cache (DiscoveryCache): Listings from the previous run, so
+                unchanged directories aren't listed again.
+            on_found (callable): Called with (game_name, save_path) as soon as
+                a save folder is found, from whichever thread found it.
+            progress_callback (callable): Called with the number of
+                directories looked at so far, every PROGRESS_INTERVAL of them.
+            should_stop (callable): Checked before each directory; returning
+                True abandons the rest of the scan.
+        """
+        self.skip_names = EXCLUDED_FOLDERS | (skip_names or set())
+        self.workers = workers
+        self.max_depth = max_depth
+        self.cache = cache
+        self.on_found = on_found
+        self.progress_callback = progress_callback
+        self.should_stop = should_stop
+        self.scanned = 0
+        self.canceled = False
+        self._queue = queue.Queue()
+        self._found = []
+        self._lock = threading.Lock()
+
+    def scan(self, roots: list) -> list:
+        """
+        Args:
+            roots (list): Paths or SearchRoots. Roots named after a game in
+                `skip_names` are left out.
+
+        Returns:
+            list: (game name, save folder) pairs, ordered by the root they
+                were found under.
+        """
+        self._found = []
+        self.scanned = 0
+        self.canceled = False
+        for index, root in enumerate(roots):
+            if not isinstance(root, SearchRoot):
+                root = SearchRoot(str(root), max_depth=self.max_depth)
+            if root.game_name in self.skip_names or not os.path.isdir(root.path):
+                continue
+            if root.save_folder:
+                if _has_entries(root.path):
+                    self._add_found(index, root.game_name, str(pathlib.Path(root.path)))
+                continue
+            self._queue.put((str(root.path), 0, index, root, None))
+
+        threads = [
+            threading.Thread(target=self._worker, daemon=True) for _ in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        self._queue.join()
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+        self._found.sort(key=lambda found: found[0])
+        return [(game_name, save_path) for _, game_name, save_path in self._found]
+
+    def _worker(self) -> None:
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            try:
+                self._walk(*task)
+            except Exception as e:
+                logger.warning(f"Error scanning `{task[0]}`: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _walk(self, path: str, depth: int, index: int, root: SearchRoot, entry) -> None:
+        """Scans one directory, then queues its subdirectories, or walks
+        them right here when they came from the cache.
+
+        Args:
+            entry (os.DirEntry): `path` as listed in its parent, if it was.
+        """
+        if self.canceled or (self.should_stop and self.should_stop()):
+            # Let the queue drain without adding anything to it.
+            self.canceled = True
+            return
+        subdirs, save_path, cached = self._scan_directory(path, entry)
+        if save_path:
+            self._add_found(index, root.game_name or game_name_for(path), save_path)
+        with self._lock:
+            self.scanned += 1
+            report = self.scanned % PROGRESS_INTERVAL == 0
+        if report and self.progress_callback:
+            self.progress_callback(self.scanned)
+        if depth >= root.max_depth:
+            return
+        for name, sub_entry in subdirs:
+            task = (os.path.join(path, name), depth + 1, index, root, sub_entry)
+            if cached and depth >= INLINE_DEPTH:
+                self._walk(*task)
+            else:
+                self._queue.put(task)
+
+    def _add_found(self, index: int, game_name: str, save_path: str) -> None:
+        with self._lock:
+            self._found.append((index, game_name, save_path))
+        if self.on_found:
+            self.on_found(game_name, save_path)
+
+    def _scan_directory(self, path: str, entry=None) -> tuple:
+        """Looks at one directory.
+
+        Returns:
+            tuple: (subdirectories to descend into as (name, os.DirEntry or
+                None) pairs, save folder found here or None, whether the
+                listing came from the cache). Once a save folder is found
+                nothing below is searched. Empty save folders don't count,
+                like the "Saved Games" every Proton prefix has.
+        """
+        subdirs, cached = self._list_subdirs(path, entry)
+        if subdirs is None:
+            return [], None, cached
+        subdirs = [(name, sub_entry) for name, sub_entry in subdirs if name not in self.skip_names]
+
+        for name in sorted(name for name, _ in subdirs if name.lower().startswith("save")):
+            save_path = os.path.join(path, name)
+            if _has_entries(save_path):
+                return [], str(pathlib.Path(save_path)), cached
+        return subdirs, None, cached
+
+    def _list_subdirs(self, path: str, entry=None) -> tuple:
+        """The subdirectories of `path`, from the cache when the directory
+        hasn't changed.
+
+        Args:
+            entry (os.DirEntry): `path` as listed in its parent. On Windows
+                its stat came with the listing, so it's free.
+
+        Returns:
+            tuple: ((name, os.DirEntry or None) pairs, or None if `path`
+                can't be read, and whether they came from the cache).
+        """
+        try:
+            stat = None
+            if self.cache:
+                stat = entry.stat(follow_symlinks=False) if entry else os.stat(path)
+                subdirs = self.cache.get(path, stat)
+                if subdirs is not None:
+                    return [(name, None) for name in subdirs], True
+
+            subdirs = []
+            with os.scandir(path) as entries:
+                for sub_entry in entries:
+                    # DirEntry caches the type from the directory listing, so
+                    # this doesn't cost a stat per entry.
+                    try:
+                        if sub_entry.is_dir(follow_symlinks=False):
+                            subdirs.append((sub_entry.name, sub_entry))
+                    except OSError:
+                        continue
+        except OSError:
+            return None, False
+
+        if self.cache:
+            self.cache.record(path, stat, [name for name, _ in subdirs])
+        return subdirs, False
+
+
+def _has_entries(path: str) -> bool:
+    try:
+        with os.scandir(path) as entries:
+            return next(entries, None) is not None
+    except OSError:
+        return False
+
+
+def game_name_for(path: str) -> str:
+    """Name of the game owning a folder that holds a save folder."""
+    parts = pathlib.Path(path).parts
+    if "common" in parts[:-1]:
+        return parts[parts.index("common") + 1]
+    return parts[-1]
+
+
 def discover_steam_libraries() -> list:
-    """Method for discovering Steam libraries on all drives using default SteamLibrary naming convention."""
+    """Fallback for when no Steam installation was found: probes every drive
+    for the default SteamLibrary and Steam folder names."""
+    if sys.platform != "win32":
+        return []
 
     drive_letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
     game_install_location = "SteamLibrary/steamapps/common"
@@ -103,26 +348,95 @@ def discover_steam_libraries() -> list:
         )
         for drive in drive_letters
         if os.path.exists(
-            f"{drive}:{game_install_location if drive != 'C' else default_install_location}"
+            f"{drive}:/{game_install_location if drive != 'C' else default_install_location}"
         )
     ]
 
 
-def generate_paths() -> list:
-    """Simple method to build list of paths for PC"""
-    paths = PC_DEFAULT
-    paths += STEAM_PATH
+def steam_installations() -> dict:
+    """Steam root -> the SteamApps installed in any of its libraries."""
+    return {
+        steam_root: [
+            app
+            for library in steam.library_folders(steam_root)
+            for app in steam.installed_apps(library)
+        ]
+        for steam_root in steam.steam_roots()
+    }
+
 
-    paths += discover_steam_libraries()
+def known_save_roots(installations: dict) -> list:
+    """Save folders of the games listed in known_saves.json that exist here."""
+    index = build_index(load_known_saves(), installations)
+    return [
+        SearchRoot(save_path, game_name, save_folder=True)
+        for game_name, save_path in index.resolve().items()
+    ]
+
+
+def steam_search_roots(installations: dict) -> list:
+    """Where to look for the saves of every installed Steam game.
+
+    Games are read from each library's app manifests, so they get their real
+    names and only their own folders are searched: the Steam Cloud folder,
+    the install folder and, on Linux, the game's Proton prefix.
+    """
+    cloud_roots, roots = [], []
+    for steam_root, apps in installations.items():
+        cloud_folders = steam.cloud_save_folders(steam_root, apps)
+        for app in apps:
+            if app.app_id in cloud_folders:
+                cloud_roots.append(
+                    SearchRoot(cloud_folders[app.app_id], app.name, save_folder=True)
+                )
+            roots.append(SearchRoot(str(app.install_path), app.name, INSTALL_DIR_DEPTH))
+            roots += [
+                SearchRoot(str(folder), app.name)
+                for folder in prefix_folders(app.compat_user_path)
+                if os.path.isdir(folder)
+            ]
+    return cloud_roots + roots
+
+
+def prefix_folders(user_folder: pathlib.Path) -> list:
+    """Folders of a Proton prefix's user profile that games save to. Each is
+    searched on its own, so a save folder found in one of them doesn't hide
+    the others."""
+    folders = [folder for paths in windows_folders(user_folder).values() for folder in paths]
+    return folders + [user_folder / "Saved Games"]
+
+
+def generate_paths() -> list:
+    """Builds the list of places to search, most reliable first: known save
+    locations, then the folders of installed Steam games, then a generic
+    search of the usual save folders for everything else."""
+    installations = steam_installations()
+    paths = known_save_roots(installations)
+    known_games = {root.game_name for root in paths}
+    paths += [
+        root for root in steam_search_roots(installations) if root.game_name not in known_games
+    ]
+    if not installations:
+        paths += STEAM_PATH + discover_steam_libraries()
+    paths += PC_DEFAULT
 
     return paths
 
 
-def start_discovery():
-    """Begins the save discovery process"""
+def start_discovery(
+    use_cache: bool = True, on_found=None, progress_callback=None, should_stop=None
+) -> list:
+    """Begins the save discovery process. See `discover_folders_parallel`."""
 
     print("Generating paths...")
     paths = generate_paths()
     print("Discovering saves...")
-    discover_folders_parallel(paths)
+    added = discover_folders_parallel(
+        paths,
+        use_cache,
+        on_found=on_found,
+        progress_callback=progress_callback,
+        should_stop=should_stop,
+    )
     print("Done!")
+    return added
@@ -0,0 +1,39 @@
+import os
+from pathlib import Path
+
+from backend.utilities import load_from_json, save_to_json
+from backend.retention import DEFAULT_RETENTION
+
+GAME_SETTINGS_PATH = Path("./data/game_settings.json")
+
+# How a game's saves are stored on Drive.
+STORAGE_VERSIONED = "versioned"  # Whole-file objects plus a manifest per snapshot.
+STORAGE_FILES = "files"  # Mirror the save tree file for file, overwriting in place.
+STORAGE_PACKED = "packed"  # One compressed archive per backup.
+STORAGE_DEDUP = "dedup"  # Content-defined chunks plus a manifest per snapshot.
+STORAGE_MODES = (STORAGE_VERSIONED, STORAGE_FILES, STORAGE_PACKED, STORAGE_DEDUP)
+SNAPSHOT_MODES = (STORAGE_VERSIONED, STORAGE_DEDUP)
+
+
+def load_game_settings(location: Path = GAME_SETTINGS_PATH) -> dict:
+    return load_from_json(location) if os.path.exists(location) else {}
+
+
+def storage_mode(game_name: str, settings: dict = None) -> str:
+    settings = load_game_settings() if settings is None else settings
+    return settings.get(game_name, {}).get("storage", STORAGE_VERSIONED)
+
+
+def set_storage_mode(game_name: str, mode: str, location: Path = GAME_SETTINGS_PATH) -> None:
+    if mode not in STORAGE_MODES:
+        raise ValueError(f"Unknown storage mode `{mode}`.")
+    settings = load_game_settings(location)
+    settings.setdefault(game_name, {})["storage"] = mode
+    os.makedirs(Path(location).parent, exist_ok=True)
+    save_to_json(settings, location)
+
+
+def retention_policy(game_name: str, settings: dict = None) -> dict:
+    """Snapshot retention for a game, see `retention.snapshots_to_keep`."""
+    settings = load_game_settings() if settings is None else settings
+    return {**DEFAULT_RETENTION, **settings.get(game_name, {}).get("retention", {})}
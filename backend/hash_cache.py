@@ -0,0 +1,84 @@
+import os
+import hashlib
+import threading
+from pathlib import Path
+
+from backend.utilities import load_from_json, save_to_json
+
+HASH_CACHE_PATH = Path("./data/hash_cache.json")
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def md5_of_file(path: str) -> str:
+    """Hex md5 of a local file, matching Drive's `md5Checksum`."""
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class HashCache:
+    """Local md5s keyed by path, valid while the inode, size and mtime match.
+
+    A file is only read again once it has actually been written to, so hashing
+    a save library that hasn't changed costs one `stat` per file. Games that
+    save by renaming a new file over the old one give it a new inode each
+    time, which only replaces the path's entry. Entries of files that no
+    longer exist are dropped on `save`.
+    """
+
+    def __init__(self, location: Path = HASH_CACHE_PATH):
+        self.location = Path(location)
+        self._lock = threading.Lock()
+        hashes = load_from_json(self.location) if self.location.exists() else {}
+        # Caches written before entries were keyed by path have no inode in
+        # them, those files are simply hashed again.
+        self._hashes = {
+            path: entry for path, entry in hashes.items() if "inode" in entry
+        }
+        self._dirty = len(self._hashes) != len(hashes)
+        # Paths looked up since the last `save`, known to still exist.
+        self._used = set()
+
+    def md5(self, path: str, stat: os.stat_result = None) -> str:
+        stat = stat or os.stat(path)
+        key = os.path.abspath(path)
+        inode = f"{stat.st_dev}:{stat.st_ino}"
+        with self._lock:
+            entry = self._hashes.get(key)
+            self._used.add(key)
+        if (
+            entry
+            and entry["inode"] == inode
+            and entry["size"] == stat.st_size
+            and entry["mtime_ns"] == stat.st_mtime_ns
+        ):
+            return entry["md5"]
+
+        md5 = md5_of_file(path)
+        with self._lock:
+            self._hashes[key] = {
+                "inode": inode,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "md5": md5,
+            }
+            self._dirty = True
+        return md5
+
+    def save(self) -> None:
+        with self._lock:
+            gone = [
+                path
+                for path in self._hashes
+                if path not in self._used and not os.path.exists(path)
+            ]
+            for path in gone:
+                del self._hashes[path]
+            self._used = set()
+            if not (self._dirty or gone):
+                return
+            os.makedirs(self.location.parent, exist_ok=True)
+            save_to_json(self._hashes, self.location)
+            self._dirty = False
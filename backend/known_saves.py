@@ -0,0 +1,173 @@
+import os
+import re
+import sys
+import fnmatch
+import itertools
+from pathlib import Path
+
+from backend.utilities import load_from_json
+
+# Shipped with the app, game name -> {"steam_id": ..., "paths": [...]}.
+KNOWN_SAVES_PATH = Path(__file__).with_name("known_saves.json")
+# Same format, for adding games or fixing paths locally. Wins over the shipped list.
+USER_KNOWN_SAVES_PATH = Path("./data/known_saves.json")
+
+_VARIABLE = re.compile(r"<(\w+)>")
+
+
+def load_known_saves(
+    locations: tuple = (KNOWN_SAVES_PATH, USER_KNOWN_SAVES_PATH)
+) -> dict:
+    known_saves = {}
+    for location in locations:
+        if os.path.exists(location):
+            known_saves.update(load_from_json(location))
+    return known_saves
+
+
+def windows_folders(user_folder: Path) -> dict:
+    """Variables for the usual folders of a Windows user profile."""
+    return {
+        "appdata": [user_folder / "AppData" / "Roaming"],
+        "localappdata": [user_folder / "AppData" / "Local"],
+        "locallow": [user_folder / "AppData" / "LocalLow"],
+        "documents": [user_folder / "Documents"],
+    }
+
+
+def system_variables(steam_roots: list = ()) -> dict:
+    """Values of the path variables on this machine. A variable can have
+    several values (one per Steam installation, say) or none at all, in which
+    case paths using it are left out."""
+    home = Path.home()
+    variables = {"home": [home], "steam": list(steam_roots), "storeuserid": ["*"]}
+    if sys.platform == "win32":
+        variables.update(windows_folders(home))
+        if os.environ.get("APPDATA"):
+            variables["appdata"] = [Path(os.environ["APPDATA"])]
+        if os.environ.get("LOCALAPPDATA"):
+            variables["localappdata"] = [Path(os.environ["LOCALAPPDATA"])]
+    else:
+        variables["xdgdata"] = [Path(os.environ.get("XDG_DATA_HOME") or home / ".local/share")]
+        variables["xdgconfig"] = [Path(os.environ.get("XDG_CONFIG_HOME") or home / ".config")]
+    return variables
+
+
+def expand(template: str, variables: dict) -> list:
+    """Every path `template` stands for, e.g. one per Steam installation for
+    `<steam>/userdata/...`."""
+    names = [name.lower() for name in _VARIABLE.findall(template)]
+    if any(not variables.get(name) for name in names):
+        return []
+
+    paths = []
+    pieces = _VARIABLE.split(template)
+    for values in itertools.product(*(variables[name] for name in names)):
+        # split() alternates literal text and variable names.
+        expanded = "".join(
+            str(values[i // 2]) if i % 2 else piece for i, piece in enumerate(pieces)
+        )
+        paths.append(os.path.normpath(expanded))
+    return paths
+
+
+class _Node:
+    __slots__ = ("children", "games")
+
+    def __init__(self):
+        self.children = {}
+        self.games = []  # (priority, game name) of the templates ending here
+
+
+class KnownSaveIndex:
+    """Known save locations, stored as a trie of path components.
+
+    Templates share most of their leading folders (`<appdata>`, the Steam
+    folder, ...), so resolving the whole list checks each shared folder once
+    and only descends where it exists: a few `stat` calls per installed game
+    instead of a walk over everything.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+
+    def add(self, game_name: str, path: str, priority: int = 0) -> None:
+        """Adds an expanded path. Components may hold `*` and `?` wildcards."""
+        node = self._root
+        for part in Path(path).parts:
+            node = node.children.setdefault(part, _Node())
+        node.games.append((priority, game_name))
+
+    def resolve(self) -> dict:
+        """
+        Returns:
+            dict: game name -> save folder, for the games whose folder exists
+                and isn't empty. A game's earliest listed path wins.
+        """
+        found = {}
+        for anchor, node in self._root.children.items():
+            if os.path.isdir(anchor):
+                self._resolve(anchor, node, found)
+        return {game_name: path for game_name, (_, path) in found.items()}
+
+    def _resolve(self, path: str, node: _Node, found: dict) -> None:
+        if node.games and _has_entries(path):
+            for priority, game_name in node.games:
+                if game_name not in found or priority < found[game_name][0]:
+                    found[game_name] = (priority, path)
+
+        listing = None
+        for name, child in node.children.items():
+            if "*" in name or "?" in name:
+                if listing is None:
+                    listing = _subdirs(path)
+                for match in fnmatch.filter(listing, name):
+                    self._resolve(os.path.join(path, match), child, found)
+            else:
+                child_path = os.path.join(path, name)
+                if os.path.isdir(child_path):
+                    self._resolve(child_path, child, found)
+
+
+def build_index(known_saves: dict, installations: dict) -> KnownSaveIndex:
+    """Expands every known location for this machine.
+
+    Args:
+        known_saves (dict): As loaded by `load_known_saves`.
+        installations (dict): Steam root -> installed SteamApps. Installed
+            games get `<base>` (their install folder) and, under Proton, the
+            Windows folders of their prefix. They are named as in Steam.
+    """
+    variables = system_variables(list(installations))
+    apps = {app.app_id: app for apps in installations.values() for app in apps}
+
+    index = KnownSaveIndex()
+    for game_name, entry in known_saves.items():
+        game_variables = variables
+        app = apps.get(str(entry.get("steam_id")))
+        if app:
+            game_name = app.name
+            game_variables = {**variables, "base": [app.install_path]}
+            if os.path.isdir(app.compat_user_path):
+                game_variables.update(windows_folders(app.compat_user_path))
+
+        for priority, template in enumerate(entry.get("paths", [])):
+            for path in expand(template, game_variables):
+                index.add(game_name, path, priority)
+    return index
+
+
+def _subdirs(path: str) -> list:
+    try:
+        with os.scandir(path) as entries:
+            return [entry.name for entry in entries if entry.is_dir()]
+    except OSError:
+        return []
+
+
+def _has_entries(path: str) -> bool:
+    try:
+        with os.scandir(path) as entries:
+            return next(entries, None) is not None
+    except OSError:
+        return False
@@ -0,0 +1,164 @@
+import os
+import logging
+import threading
+from pathlib import Path
+
+from backend.registry import SaveRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class SyncManifest:
+    """Per-game record of what has already been uploaded, kept in the
+    save registry.
+
+    Files are keyed by their path relative to the game's save folder, using
+    forward slashes. Folders map the same kind of relative path to the Drive
+    folder id, with "." standing for the game folder itself. Only the file
+    entries that changed since the last `save` are written back. `mode` is
+    the storage mode the entries were recorded in, entries from another mode
+    say nothing about what's stored in this one, see `use_mode`.
+    """
+
+    def __init__(self, game_name: str, registry: SaveRegistry = None):
+        self.game_name = game_name
+        self.registry = registry or SaveRegistry()
+        self.files = {}
+        self.folders = {}
+        self.mode = None
+        self._changed = set()
+        self._removed = set()
+        self._replace = False
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        self.files, self.folders = self.registry.load_file_state(self.game_name)
+        self.mode = self.registry.load_storage_mode(self.game_name)
+
+    def save(self) -> None:
+        with self._lock:
+            self.registry.save_file_state(
+                self.game_name,
+                {rel_path: self.files[rel_path] for rel_path in self._changed},
+                self._removed,
+                self.folders,
+                replace=self._replace,
+                storage_mode=self.mode,
+            )
+            self._changed = set()
+            self._removed = set()
+            self._replace = False
+
+    def clear(self) -> None:
+        with self._lock:
+            self.files = {}
+            self.folders = {}
+            self.mode = None
+            self._changed = set()
+            self._removed = set()
+            self._replace = True
+
+    def use_mode(self, mode: str) -> bool:
+        """Makes `mode` the one entries are recorded in, forgetting every
+        entry recorded in another mode or in an unknown one.
+
+        Returns:
+            bool: True if entries had to be forgotten.
+        """
+        if self.mode == mode:
+            return False
+        forgot = bool(self.files or self.folders)
+        if forgot:
+            self.clear()
+        self.mode = mode
+        return forgot
+
+    def is_unchanged(self, rel_path: str, stat: os.stat_result) -> bool:
+        """True when the local stat matches what was recorded at the last upload."""
+        entry = self.files.get(rel_path)
+        return bool(
+            entry
+            and entry.get("remote_id")
+            and entry["size"] == stat.st_size
+            and entry["mtime_ns"] == stat.st_mtime_ns
+        )
+
+    def all_unchanged(self, stats: dict) -> bool:
+        """True when the manifest holds exactly the files in `stats`, all
+        unchanged."""
+        return set(stats) == set(self.files) and all(
+            self.is_unchanged(rel_path, stat) for rel_path, stat in stats.items()
+        )
+
+    def record(
+        self,
+        rel_path: str,
+        stat: os.stat_result,
+        md5: str,
+        remote_id: str,
+        remote_modified_time: str,
+        chunks: list = None,
+    ) -> None:
+        entry = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "md5": md5,
+            "remote_id": remote_id,
+            "remote_modified_time": remote_modified_time,
+        }
+        if chunks is not None:
+            entry["chunks"] = chunks
+        with self._lock:
+            self.files[rel_path] = entry
+            self._changed.add(rel_path)
+            self._removed.discard(rel_path)
+
+    def forget(self, rel_path: str) -> None:
+        with self._lock:
+            self.files.pop(rel_path, None)
+            self._changed.discard(rel_path)
+            self._removed.add(rel_path)
+
+    def reconcile(self, remote_files: dict, remote_folders: dict) -> int:
+        """Drop entries that no longer match the remote side.
+
+        Args:
+            remote_files (dict): relative path -> remote metadata for every file
+                currently under the game folder.
+            remote_folders (dict): relative path -> folder id for every folder.
+
+        Returns:
+            int: The number of file entries that were dropped.
+        """
+        stale = [
+            rel_path
+            for rel_path, entry in self.files.items()
+            if rel_path not in remote_files
+            or remote_files[rel_path]["id"] != entry["remote_id"]
+            or remote_files[rel_path].get("modifiedTime") != entry["remote_modified_time"]
+        ]
+        for rel_path in stale:
+            self.forget(rel_path)
+
+        self.folders = {
+            rel_dir: folder_id
+            for rel_dir, folder_id in self.folders.items()
+            if rel_dir == "." or remote_folders.get(rel_dir) == folder_id
+        }
+        return len(stale)
+
+
+def local_stats(local_path: str) -> dict:
+    """Relative path -> stat for every file under `local_path`. Files that
+    disappear during the walk, like a game's temporary files, are left out."""
+    stats = {}
+    for path, dirs, files in os.walk(local_path):
+        rel_dir = Path(os.path.relpath(path, local_path)).as_posix()
+        for file in files:
+            rel_path = file if rel_dir == "." else f"{rel_dir}/{file}"
+            try:
+                stats[rel_path] = os.stat(os.path.join(path, file))
+            except OSError as e:
+                logger.warning(f"Skipping {os.path.join(path, file)}, it can't be read: {e}")
+    return stats
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = Path("./data/metrics")
+REPORT_PATH = METRICS_DIR / "last_run.json"
+# Point node_exporter's --collector.textfile.directory here, or copy the file.
+PROMETHEUS_PATH = METRICS_DIR / "savesync.prom"
+PROMETHEUS_PREFIX = "savesync_"
+# Upper bounds in seconds. A Drive call takes from tens of milliseconds for
+# a cached listing to minutes for a big chunk on a slow line.
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Help text of every metric, which also fixes their Prometheus type.
+COUNTERS = {
+    "api_calls": "Drive requests sent, retries included.",
+    "api_errors": "Drive requests that failed, by HTTP status.",
+    "api_retries": "Drive requests retried, by reason.",
+    "transfer_bytes": "Bytes sent to or received from Drive.",
+    "transfer_files": "Files uploaded or restored.",
+    "phase_seconds": "Seconds spent per phase, summed over threads.",
+}
+HISTOGRAMS = {
+    "api_latency_seconds": "Time per Drive request.",
+}
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)  # the last is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """Counters and latency histograms for one run of the backend.
+
+    Recording takes a lock and a dict lookup, cheap next to the Drive call
+    or file it measures, so it stays on all the time. `write` saves the run
+    as a JSON report and as a Prometheus textfile.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started = time.time()
+            self._counters = {}  # (name, labels) -> value
+            self._histograms = {}  # (name, labels) -> Histogram
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def phase(self, name: str):
+        """Adds the time spent in the block to phase_seconds{phase=name}."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.count("phase_seconds", time.perf_counter() - start, phase=name)
+
+    def report(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {
+                key: (list(h.counts), h.count, h.sum, h.quantile(0.5), h.quantile(0.95))
+                for key, h in self._histograms.items()
+            }
+
+        report = {
+            "started": self.started,
+            "duration": time.time() - self.started,
+            "counters": {},
+            "histograms": {},
+        }
+        for (name, labels), value in sorted(counters.items()):
+            report["counters"].setdefault(name, []).append({**dict(labels), "value": value})
+        for (name, labels), (counts, count, total, p50, p95) in sorted(histograms.items()):
+            report["histograms"].setdefault(name, []).append(
+                {
+                    **dict(labels),
+                    "count": count,
+                    "sum": total,
+                    "p50": p50,
+                    "p95": p95,
+                    "buckets": dict(zip([*map(str, LATENCY_BUCKETS), "+Inf"], counts)),
+                }
+            )
+        return report
+
+    def prometheus(self) -> str:
+        """The metrics in Prometheus' text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(h.counts), h.count, h.sum) for key, h in self._histograms.items()}
+
+        lines = []
+        for name, help_text in COUNTERS.items():
+            rows = [(labels, value) for (n, labels), value in counters.items() if n == name]
+            if not rows:
+                continue
+            metric = f"{PROMETHEUS_PREFIX}{name}_total"
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            lines += [f"{metric}{_labels(labels)} {value}" for labels, value in sorted(rows)]
+
+        for name, help_text in HISTOGRAMS.items():
+            rows = [(labels, h) for (n, labels), h in histograms.items() if n == name]
+            if not rows:
+                continue
+            metric = f"{PROMETHEUS_PREFIX}{name}"
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+            for labels, (counts, count, total) in sorted(rows):
+                cumulative = 0
+                for bound, bucket_count in zip([*map(str, LATENCY_BUCKETS), "+Inf"], counts):
+                    cumulative += bucket_count
+                    lines.append(f"{metric}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{metric}_sum{_labels(labels)} {total}")
+                lines.append(f"{metric}_count{_labels(labels)} {count}")
+
+        metric = f"{PROMETHEUS_PREFIX}last_run_timestamp_seconds"
+        lines += [f"# TYPE {metric} gauge", f"{metric} {self.started}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, report_path: Path = REPORT_PATH, prometheus_path: Path = PROMETHEUS_PATH) -> None:
+        """Writes the JSON report and the Prometheus textfile. Each is written
+        to a temporary file first, so a scraper never reads half a file."""
+        try:
+            _write_atomic(report_path, json.dumps(self.report(), indent=2))
+            _write_atomic(prometheus_path, self.prometheus())
+        except OSError as e:
+            logger.error(f"Writing metrics failed: {e}")
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    path = Path(path)
+    os.makedirs(path.parent, exist_ok=True)
+    temp_path = path.with_name(f".{path.name}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_path, path)
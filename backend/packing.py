@@ -0,0 +1,134 @@
+import os
+import tarfile
+import logging
+import threading
+
+from googleapiclient.http import MediaUpload
+
+logger = logging.getLogger(__name__)
+
+PACKED_ARCHIVE_NAME = "snapshot.tar.gz"
+PACKED_MIME_TYPE = "application/gzip"
+
+
+class TarStreamUpload(MediaUpload):
+    """Resumable upload body that tars and gzips a folder on the fly.
+
+    A background thread writes the archive into a pipe and the uploader reads
+    it back one chunk at a time, so neither the archive nor the save tree is
+    ever held in memory or copied to disk. Only the chunk in flight is kept,
+    which is enough to resend it if Drive asks for it again.
+    """
+
+    def __init__(self, local_path: str, chunksize: int):
+        self._chunksize = chunksize
+        self._chunk_start = 0
+        self._chunk = None
+        self._pending = b""
+        self._error = None
+
+        read_fd, write_fd = os.pipe()
+        self._reader = os.fdopen(read_fd, "rb")
+        self._writer = threading.Thread(
+            target=self._write_archive,
+            args=(local_path, os.fdopen(write_fd, "wb")),
+            daemon=True,
+        )
+        self._writer.start()
+
+    def _write_archive(self, local_path: str, pipe) -> None:
+        try:
+            with tarfile.open(fileobj=pipe, mode="w|gz") as tar:
+                for path, dirs, files in os.walk(local_path):
+                    dirs.sort()
+                    for name in dirs + sorted(files):
+                        full_path = os.path.join(path, name)
+                        try:
+                            tar.add(
+                                full_path,
+                                arcname=os.path.relpath(full_path, local_path),
+                                recursive=False,
+                            )
+                        except FileNotFoundError:
+                            # Games often delete temporary files while saving.
+                            logger.warning(f"Skipping {full_path}, it disappeared.")
+        except BrokenPipeError:
+            logger.info(f"Packing {local_path} stopped, the upload was abandoned.")
+        except Exception as e:
+            self._error = e
+            logger.error(f"Packing {local_path} failed: {e}")
+        finally:
+            try:
+                pipe.close()
+            except BrokenPipeError:
+                pass
+
+    def chunksize(self) -> int:
+        return self._chunksize
+
+    def mimetype(self) -> str:
+        return PACKED_MIME_TYPE
+
+    def size(self):
+        return None
+
+    def resumable(self) -> bool:
+        return True
+
+    def getbytes(self, begin: int, length: int) -> bytes:
+        if self._chunk is not None and begin == self._chunk_start:
+            return self._chunk
+        if self._chunk is not None and begin != self._chunk_start + len(self._chunk):
+            raise ValueError(f"Packed uploads can't seek to byte {begin}.")
+
+        # Read one byte past the chunk to know whether this is the last one.
+        data = self._pending + self._read(length + 1 - len(self._pending))
+        if len(data) > length:
+            chunk, self._pending = data[:length], data[length:]
+        elif len(data) == length:
+            # A full-sized last chunk looks like there's more to come, and an
+            # empty final chunk can't be sent. gzip ignores trailing zero
+            # padding, so finish with a single zero byte instead.
+            chunk, self._pending = data, b"\x00"
+        else:
+            self._writer.join()
+            if self._error:
+                raise self._error
+            chunk, self._pending = data, b""
+
+        self._chunk_start = begin
+        self._chunk = chunk
+        return chunk
+
+    def _read(self, length: int) -> bytes:
+        parts = []
+        while length > 0:
+            part = self._reader.read(length)
+            if not part:
+                break
+            parts.append(part)
+            length -= len(part)
+        return b"".join(parts)
+
+    def close(self) -> None:
+        """Stops the archive writer if the upload is abandoned early."""
+        self._reader.close()
+        self._writer.join()
+
+    def to_json(self):
+        raise NotImplementedError("Packed uploads can't be serialized.")
+
+
+def extract_archive(archive_path: str, destination: str, overwrite: bool = False) -> None:
+    """Unpacks a packed snapshot into `destination`. Files that already exist
+    are only replaced when `overwrite` is set."""
+    os.makedirs(destination, exist_ok=True)
+    with tarfile.open(archive_path, mode="r:gz") as tar:
+        members = [
+            member
+            for member in tar.getmembers()
+            if overwrite
+            or member.isdir()
+            or not os.path.exists(os.path.join(destination, member.name))
+        ]
+        tar.extractall(destination, members=members, filter="data")
@@ -0,0 +1,218 @@
+import time
+import logging
+import threading
+from collections import deque
+from typing import NamedTuple
+
+from backend.status import format_size
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two calls of the report callback.
+REPORT_INTERVAL = 0.5
+# Seconds between two progress lines in the log.
+LOG_INTERVAL = 10.0
+# Throughput is measured over this many seconds, so it follows the current
+# speed rather than the average since the start.
+RATE_WINDOW = 10.0
+
+
+class ProgressReport(NamedTuple):
+    game_name: str
+    game_bytes_done: int
+    game_bytes_total: int
+    bytes_done: int
+    bytes_total: int
+    files_done: int
+    files_total: int
+    bytes_per_second: float
+    files_per_second: float
+    eta: float  # Seconds, None while the rate is unknown.
+
+    @property
+    def fraction(self) -> float:
+        if self.bytes_total:
+            return min(1.0, self.bytes_done / self.bytes_total)
+        return self.files_done / self.files_total if self.files_total else 0.0
+
+    def __str__(self) -> str:
+        text = (
+            f"{format_size(self.bytes_done)} of {format_size(self.bytes_total)}, "
+            f"{self.files_done} of {self.files_total} files, "
+            f"{format_size(self.bytes_per_second)}/s, {self.files_per_second:.1f} files/s"
+        )
+        if self.eta is not None:
+            text += f", {format_duration(self.eta)} left"
+        return text
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds // 60 % 60:02d}m"
+
+
+class TransferProgress:
+    """Byte-level progress of one upload or restore run.
+
+    Files are added with their size when they are queued and report how many
+    bytes went through after every chunk. Totals are kept per file, per game
+    and for the whole run. Counting is a few additions under a lock; the
+    report callback and the log only see a summary, at most every `interval`
+    and `log_interval` seconds, so chunk-sized updates stay cheap.
+
+    Totals grow while later games are still being walked, so the ETA is for
+    the work known so far.
+    """
+
+    def __init__(
+        self,
+        label: str,
+        callback=None,
+        interval: float = REPORT_INTERVAL,
+        log_interval: float = LOG_INTERVAL,
+    ):
+        """
+        Args:
+            label (str): Names the run in the log, e.g. "Upload".
+            callback (callable): Called with a ProgressReport, from whichever
+                thread made the progress.
+        """
+        self.label = label
+        self.callback = callback
+        self.interval = interval
+        self.log_interval = log_interval
+        self._lock = threading.Lock()
+        self._games = {}  # game name -> [bytes done, bytes total]
+        self._current_game = None
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self.files_done = 0
+        self.files_total = 0
+        self._samples = deque()  # (time, bytes done, files done)
+        self._next_report = 0.0
+        self._next_log = time.monotonic() + log_interval
+
+    def game(self, game_name: str) -> "GameProgress":
+        with self._lock:
+            self._games.setdefault(game_name, [0, 0])
+            self._current_game = game_name
+        return GameProgress(self, game_name)
+
+    def _add_file(self, game_name: str, size: int) -> None:
+        with self._lock:
+            self._games[game_name][1] += size
+            self.bytes_total += size
+            self.files_total += 1
+
+    def _advance(self, game_name: str, delta: int, files: int = 0) -> None:
+        with self._lock:
+            self._games[game_name][0] += delta
+            self.bytes_done += delta
+            self.files_done += files
+            self._current_game = game_name
+            now = time.monotonic()
+            if now < self._next_report and now < self._next_log:
+                return
+            report = self._report(now)
+            notify = now >= self._next_report
+            log = now >= self._next_log
+            if notify:
+                self._next_report = now + self.interval
+            if log:
+                self._next_log = now + self.log_interval
+        self._publish(report, notify, log)
+
+    def _report(self, now: float) -> ProgressReport:
+        samples = self._samples
+        samples.append((now, self.bytes_done, self.files_done))
+        while len(samples) > 2 and now - samples[0][0] > RATE_WINDOW:
+            samples.popleft()
+        start, bytes_then, files_then = samples[0]
+        elapsed = now - start
+        bytes_per_second = (self.bytes_done - bytes_then) / elapsed if elapsed else 0.0
+        files_per_second = (self.files_done - files_then) / elapsed if elapsed else 0.0
+
+        eta = None
+        if self.bytes_total and bytes_per_second > 0:
+            eta = max(0, self.bytes_total - self.bytes_done) / bytes_per_second
+        elif not self.bytes_total and files_per_second > 0:
+            eta = (self.files_total - self.files_done) / files_per_second
+
+        game_done, game_total = self._games.get(self._current_game, (0, 0))
+        return ProgressReport(
+            self._current_game,
+            game_done,
+            game_total,
+            self.bytes_done,
+            self.bytes_total,
+            self.files_done,
+            self.files_total,
+            bytes_per_second,
+            files_per_second,
+            eta,
+        )
+
+    def _publish(self, report: ProgressReport, notify: bool = True, log: bool = True) -> None:
+        if log:
+            logger.info(f"{self.label}: {report}")
+        if notify and self.callback:
+            try:
+                self.callback(report)
+            except Exception as e:
+                logger.error(f"Progress callback failed: {e}")
+
+    def finish(self) -> ProgressReport:
+        """Logs and reports the final totals."""
+        with self._lock:
+            report = self._report(time.monotonic())
+        self._publish(report)
+        return report
+
+
+class GameProgress:
+    """The part of a `TransferProgress` belonging to one game."""
+
+    def __init__(self, progress: TransferProgress, game_name: str):
+        self.progress = progress
+        self.game_name = game_name
+
+    def add_file(self, size: int) -> "FileProgress":
+        """Counts a queued file towards the totals."""
+        self.progress._add_file(self.game_name, size)
+        return FileProgress(self, size)
+
+
+class FileProgress:
+    """Progress of one file. `update` is meant to be passed as the
+    `on_progress` callback of chunked transfers."""
+
+    def __init__(self, game: GameProgress, size: int):
+        self.game = game
+        self.size = size
+        self.done = 0
+        self.finished = False
+
+    def update(self, done: int) -> None:
+        """
+        Args:
+            done (int): Bytes of the file transferred so far. Can go down when
+                a transfer starts over.
+        """
+        done = min(done, self.size)
+        if self.finished or done == self.done:
+            return
+        delta, self.done = done - self.done, done
+        self.game.progress._advance(self.game.game_name, delta)
+
+    def finish(self) -> None:
+        """Marks the file as handled, whether it was sent, skipped or failed,
+        so what's left only counts work still to do."""
+        if self.finished:
+            return
+        self.finished = True
+        delta, self.done = self.size - self.done, self.size
+        self.game.progress._advance(self.game.game_name, delta, files=1)
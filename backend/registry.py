@@ -0,0 +1,372 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+from backend.utilities import load_from_json
+
+REGISTRY_PATH = Path("./data/saves.db")
+# Where saves and sync manifests were kept before the registry, imported once
+# when the database is created.
+LEGACY_SAVES_PATH = Path("./data/discovered_folders.json")
+LEGACY_MANIFEST_DIR = Path("./data/manifests")
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    -- The storage mode file_state was recorded in.
+    storage_mode TEXT
+);
+-- Kept apart from games so removing a save from the list keeps its sync state.
+CREATE TABLE IF NOT EXISTS save_paths (
+    game_id INTEGER PRIMARY KEY REFERENCES games(id) ON DELETE CASCADE,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS backups (
+    id INTEGER PRIMARY KEY,
+    game_id INTEGER NOT NULL REFERENCES games(id) ON DELETE CASCADE,
+    started_at REAL NOT NULL,
+    finished_at REAL NOT NULL,
+    files INTEGER NOT NULL,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS backups_by_game ON backups(game_id, finished_at);
+CREATE TABLE IF NOT EXISTS file_state (
+    game_id INTEGER NOT NULL REFERENCES games(id) ON DELETE CASCADE,
+    rel_path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    md5 TEXT,
+    remote_id TEXT,
+    remote_modified_time TEXT,
+    chunks TEXT,
+    PRIMARY KEY (game_id, rel_path)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS remote_folders (
+    game_id INTEGER NOT NULL REFERENCES games(id) ON DELETE CASCADE,
+    rel_dir TEXT NOT NULL,
+    folder_id TEXT NOT NULL,
+    PRIMARY KEY (game_id, rel_dir)
+) WITHOUT ROWID;
+"""
+# Brings a database made by an older version up to the next one. Databases
+# created from scratch get SCHEMA, which is already current.
+MIGRATIONS = {
+    2: "ALTER TABLE games ADD COLUMN storage_mode TEXT",
+}
+
+
+class SaveRegistry:
+    """SQLite store for the list of saves, backup history and per-file sync
+    state.
+
+    Every change is its own small transaction instead of a rewrite of the
+    whole list. The database runs in WAL mode, so the GUI, the CLI and the
+    watcher daemon can read it while another process writes. Connections are
+    per thread, as sqlite3 requires.
+    """
+
+    def __init__(self, location: Path = REGISTRY_PATH):
+        self.location = Path(location)
+        self._local = threading.local()
+        os.makedirs(self.location.parent, exist_ok=True)
+        self._create_schema()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.location, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+        return connection
+
+    def close(self) -> None:
+        """Closes the calling thread's connection."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _create_schema(self) -> None:
+        connection = self._connection()
+        if connection.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        with connection:
+            # Takes the write lock first, so two processes starting at once
+            # don't both migrate.
+            connection.execute("BEGIN IMMEDIATE")
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return
+            if version == 0:
+                for statement in SCHEMA.split(";"):
+                    if statement.strip():
+                        connection.execute(statement)
+                self._migrate_json(connection)
+            else:
+                for step in range(version + 1, SCHEMA_VERSION + 1):
+                    connection.execute(MIGRATIONS[step])
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _migrate_json(self, connection: sqlite3.Connection) -> None:
+        if LEGACY_SAVES_PATH.exists() and os.path.getsize(LEGACY_SAVES_PATH):
+            for game_name, path in load_from_json(LEGACY_SAVES_PATH).items():
+                game_id = self._game_id(connection, game_name)
+                connection.execute(
+                    "INSERT OR IGNORE INTO save_paths (game_id, path) VALUES (?, ?)",
+                    (game_id, path),
+                )
+
+        if LEGACY_MANIFEST_DIR.is_dir():
+            for manifest_path in LEGACY_MANIFEST_DIR.glob("*.json"):
+                manifest = load_from_json(manifest_path)
+                if not manifest.get("game_name"):
+                    continue
+                game_id = self._game_id(connection, manifest["game_name"])
+                self._write_file_state(
+                    connection,
+                    game_id,
+                    manifest.get("files", {}),
+                    (),
+                    manifest.get("folders", {}),
+                )
+
+    def _game_id(self, connection: sqlite3.Connection, game_name: str) -> int:
+        connection.execute("INSERT OR IGNORE INTO games (name) VALUES (?)", (game_name,))
+        return connection.execute(
+            "SELECT id FROM games WHERE name = ?", (game_name,)
+        ).fetchone()[0]
+
+    def saves(self) -> dict:
+        """game name -> save folder."""
+        rows = self._connection().execute(
+            "SELECT name, path FROM games JOIN save_paths ON save_paths.game_id = games.id "
+            "ORDER BY name COLLATE NOCASE"
+        )
+        return dict(rows)
+
+    def add_save(self, game_name: str, path: str) -> bool:
+        """
+        Returns:
+            bool: False if the game already has a save folder or the folder
+                already belongs to another game.
+        """
+        connection = self._connection()
+        with connection:
+            return self._insert_save(connection, game_name, path)
+
+    def add_saves(self, saves: list) -> list:
+        """Adds several (game name, save folder) pairs in one transaction,
+        skipping the ones `add_save` would refuse.
+
+        Returns:
+            list: The pairs that were added.
+        """
+        added = []
+        connection = self._connection()
+        with connection:
+            for game_name, path in saves:
+                if self._insert_save(connection, game_name, path):
+                    added.append((game_name, path))
+        return added
+
+    def _insert_save(self, connection: sqlite3.Connection, game_name: str, path: str) -> bool:
+        if connection.execute("SELECT 1 FROM save_paths WHERE path = ?", (path,)).fetchone():
+            return False
+        game_id = self._game_id(connection, game_name)
+        cursor = connection.execute(
+            "INSERT OR IGNORE INTO save_paths (game_id, path) VALUES (?, ?)",
+            (game_id, path),
+        )
+        return cursor.rowcount == 1
+
+    def set_path(self, game_name: str, path: str) -> bool:
+        connection = self._connection()
+        try:
+            with connection:
+                game_id = self._game_id(connection, game_name)
+                connection.execute(
+                    "INSERT INTO save_paths (game_id, path) VALUES (?, ?) "
+                    "ON CONFLICT (game_id) DO UPDATE SET path = excluded.path",
+                    (game_id, path),
+                )
+        except sqlite3.IntegrityError:
+            # The folder belongs to another game.
+            return False
+        return True
+
+    def rename(self, game_name: str, new_name: str) -> bool:
+        """Renames a game, keeping its history and sync state.
+
+        Returns:
+            bool: False if `new_name` is already in the list.
+        """
+        connection = self._connection()
+        with connection:
+            row = connection.execute(
+                "SELECT games.id, save_paths.path FROM games "
+                "LEFT JOIN save_paths ON save_paths.game_id = games.id WHERE name = ?",
+                (new_name,),
+            ).fetchone()
+            if row and row[1] is not None:
+                return False
+            if row:
+                # Left over from a removed save, its state is for another folder.
+                connection.execute("DELETE FROM games WHERE id = ?", (row[0],))
+            connection.execute(
+                "UPDATE games SET name = ? WHERE name = ?", (new_name, game_name)
+            )
+        return True
+
+    def remove(self, game_name: str) -> None:
+        """Takes a game off the list of saves. Its sync state and history stay."""
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "DELETE FROM save_paths WHERE game_id = (SELECT id FROM games WHERE name = ?)",
+                (game_name,),
+            )
+
+    def record_backup(
+        self,
+        game_name: str,
+        started_at: float,
+        files: int,
+        status: str = "completed",
+    ) -> None:
+        connection = self._connection()
+        with connection:
+            game_id = self._game_id(connection, game_name)
+            connection.execute(
+                "INSERT INTO backups (game_id, started_at, finished_at, files, status) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (game_id, started_at, time.time(), files, status),
+            )
+
+    def last_backups(self) -> dict:
+        """game name -> time of its last finished backup."""
+        rows = self._connection().execute(
+            "SELECT name, MAX(finished_at) FROM backups "
+            "JOIN games ON games.id = backups.game_id GROUP BY game_id"
+        )
+        return dict(rows)
+
+    def last_backup(self, game_name: str) -> float:
+        """Time of the game's last finished backup, or None."""
+        return self._connection().execute(
+            "SELECT MAX(finished_at) FROM backups "
+            "JOIN games ON games.id = backups.game_id WHERE name = ?",
+            (game_name,),
+        ).fetchone()[0]
+
+    def load_file_state(self, game_name: str) -> tuple:
+        """
+        Returns:
+            tuple: (files, folders) in the form `SyncManifest` keeps them.
+        """
+        connection = self._connection()
+        files = {}
+        for rel_path, size, mtime_ns, md5, remote_id, remote_modified_time, chunks in (
+            connection.execute(
+                "SELECT rel_path, size, mtime_ns, md5, remote_id, remote_modified_time, chunks "
+                "FROM file_state JOIN games ON games.id = file_state.game_id WHERE name = ?",
+                (game_name,),
+            )
+        ):
+            entry = {
+                "size": size,
+                "mtime_ns": mtime_ns,
+                "md5": md5,
+                "remote_id": remote_id,
+                "remote_modified_time": remote_modified_time,
+            }
+            if chunks is not None:
+                entry["chunks"] = json.loads(chunks)
+            files[rel_path] = entry
+
+        folders = dict(
+            connection.execute(
+                "SELECT rel_dir, folder_id FROM remote_folders "
+                "JOIN games ON games.id = remote_folders.game_id WHERE name = ?",
+                (game_name,),
+            )
+        )
+        return files, folders
+
+    def load_storage_mode(self, game_name: str) -> str:
+        """The storage mode the game's file state was recorded in, or None if
+        it was recorded before modes were kept or never."""
+        row = self._connection().execute(
+            "SELECT storage_mode FROM games WHERE name = ?", (game_name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def save_file_state(
+        self,
+        game_name: str,
+        changed: dict,
+        removed,
+        folders: dict,
+        replace: bool = False,
+        storage_mode: str = None,
+    ) -> None:
+        """Writes the entries that changed since the last save in one
+        transaction.
+
+        Args:
+            changed (dict): relative path -> entry, added or updated.
+            removed: Relative paths to drop.
+            folders (dict): Every known folder id, replacing the stored ones.
+            replace (bool): Drop all stored file entries first.
+            storage_mode (str): The mode the entries were recorded in.
+        """
+        connection = self._connection()
+        with connection:
+            game_id = self._game_id(connection, game_name)
+            connection.execute(
+                "UPDATE games SET storage_mode = ? WHERE id = ?", (storage_mode, game_id)
+            )
+            if replace:
+                connection.execute("DELETE FROM file_state WHERE game_id = ?", (game_id,))
+            connection.execute("DELETE FROM remote_folders WHERE game_id = ?", (game_id,))
+            self._write_file_state(connection, game_id, changed, removed, folders)
+
+    def _write_file_state(
+        self,
+        connection: sqlite3.Connection,
+        game_id: int,
+        changed: dict,
+        removed,
+        folders: dict,
+    ) -> None:
+        connection.executemany(
+            "DELETE FROM file_state WHERE game_id = ? AND rel_path = ?",
+            ((game_id, rel_path) for rel_path in removed),
+        )
+        connection.executemany(
+            "INSERT OR REPLACE INTO file_state (game_id, rel_path, size, mtime_ns, md5, "
+            "remote_id, remote_modified_time, chunks) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    game_id,
+                    rel_path,
+                    entry["size"],
+                    entry["mtime_ns"],
+                    entry.get("md5"),
+                    entry.get("remote_id"),
+                    entry.get("remote_modified_time"),
+                    json.dumps(entry["chunks"]) if "chunks" in entry else None,
+                )
+                for rel_path, entry in changed.items()
+            ),
+        )
+        connection.executemany(
+            "INSERT OR REPLACE INTO remote_folders (game_id, rel_dir, folder_id) VALUES (?, ?, ?)",
+            ((game_id, rel_dir, folder_id) for rel_dir, folder_id in folders.items()),
+        )
@@ -0,0 +1,78 @@
+import threading
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+METADATA_FIELDS = "id, name, modifiedTime, parents, mimeType, md5Checksum, size"
+
+
+class RemoteIndex:
+    """In-memory view of the Drive folders touched during a run.
+
+    Each folder is listed once, in full, the first time one of its children is
+    asked for. After that lookups are plain dictionary reads, and anything we
+    create ourselves is added to the index instead of being listed again.
+    """
+
+    def __init__(self, list_folder, list_folders=None):
+        """
+        Args:
+            list_folder (callable): Takes a folder id and returns a list with the
+                metadata of every child of that folder. Raises if the folder
+                can't be listed, nothing is indexed for it then.
+            list_folders (callable): Optional bulk form of `list_folder`, takes
+                several folder ids and returns a dict of folder id -> children.
+        """
+        self._list_folder = list_folder
+        self._list_folders = list_folders
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._children = {}
+
+    def prefetch(self, folder_ids) -> None:
+        """Lists every folder in `folder_ids` that isn't indexed yet in one go."""
+        with self._lock:
+            missing = [f for f in set(folder_ids) if f not in self._children]
+        if not missing or not self._list_folders:
+            return
+
+        for folder_id, children in self._list_folders(missing).items():
+            listing = {}
+            for child in children:
+                listing.setdefault(child["name"], child)
+            with self._lock:
+                self._children.setdefault(folder_id, listing)
+
+    def children(self, folder_id: str) -> dict:
+        """Name-keyed metadata for every child of `folder_id`."""
+        with self._lock:
+            if folder_id in self._children:
+                return self._children[folder_id]
+
+        listing = {}
+        for child in self._list_folder(folder_id):
+            # Drive allows duplicate names, keep the first like the old lookups.
+            listing.setdefault(child["name"], child)
+
+        with self._lock:
+            return self._children.setdefault(folder_id, listing)
+
+    def lookup(self, folder_id: str, name: str, type: str = None) -> dict:
+        child = self.children(folder_id).get(name)
+        if child and type == "folder" and child.get("mimeType") != FOLDER_MIME_TYPE:
+            return None
+        return child
+
+    def remove(self, folder_id: str, name: str) -> None:
+        with self._lock:
+            self._children.get(folder_id, {}).pop(name, None)
+
+    def add(self, folder_id: str, metadata: dict) -> None:
+        """Records a child we created or updated ourselves."""
+        with self._lock:
+            if folder_id in self._children:
+                self._children[folder_id][metadata["name"]] = metadata
+            if metadata.get("mimeType") == FOLDER_MIME_TYPE:
+                # A folder we just created has no children yet.
+                self._children.setdefault(metadata["id"], {})
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+DEFAULT_RETENTION = {"keep_last": 5, "daily": 7, "weekly": 4}
+
+
+def snapshots_to_keep(
+    created: dict, keep_last: int = 0, daily: int = 0, weekly: int = 0
+) -> set:
+    """Picks the snapshots a retention policy keeps.
+
+    Args:
+        created (dict): Snapshot name -> creation datetime.
+        keep_last (int): Keep this many of the newest snapshots.
+        daily (int): Keep the newest snapshot of each of the last `daily` days
+            that have one.
+        weekly (int): Same for ISO weeks.
+
+    Returns:
+        set: Names of the snapshots to keep. The newest one is always kept.
+    """
+    newest_first = sorted(created, key=created.get, reverse=True)
+    keep = set(newest_first[: max(1, keep_last)])
+
+    for count, period in ((daily, _day), (weekly, _week)):
+        seen = set()
+        for name in newest_first:
+            if len(seen) >= count:
+                break
+            key = period(created[name])
+            if key not in seen:
+                seen.add(key)
+                keep.add(name)
+    return keep
+
+
+def _day(moment: datetime):
+    return moment.date()
+
+
+def _week(moment: datetime) -> tuple:
+    return moment.isocalendar()[:2]
@@ -0,0 +1,560 @@
+import os
+import io
+import json
+import hashlib
+import logging
+import tempfile
+from functools import partial
+from pathlib import Path
+from datetime import datetime, timezone
+
+from googleapiclient.http import MediaIoBaseUpload
+from googleapiclient.errors import HttpError
+
+from backend.manifest import SyncManifest, local_stats
+from backend.remote_index import METADATA_FIELDS
+from backend.chunking import iter_chunks, chunkable, ChunkRegistry
+from backend.transfer import TransferEngine, GameTracker, CancelToken, chunk_callback
+from backend.progress import TransferProgress, GameProgress, FileProgress
+from backend.game_settings import STORAGE_DEDUP
+from backend.retention import snapshots_to_keep
+
+logger = logging.getLogger(__name__)
+
+# Layout of a game folder in the snapshot modes.
+SNAPSHOTS_FOLDER = "snapshots"
+OBJECTS_FOLDER = "objects"  # Whole files named by md5, versioned mode.
+CHUNKS_FOLDER = "chunks"  # Content-defined chunks named by sha256, dedup mode.
+SNAPSHOT_LAYOUT_FOLDERS = (SNAPSHOTS_FOLDER, OBJECTS_FOLDER, CHUNKS_FOLDER)
+# What a file's snapshot entry points at in each content folder.
+CONTENT_KEYS = {OBJECTS_FOLDER: "md5", CHUNKS_FOLDER: "chunks"}
+SNAPSHOT_NAME_FORMAT = "%Y%m%dT%H%M%SZ"
+SNAPSHOT_SUFFIX = ".json"
+
+
+class SnapshotStorage:
+    """Point-in-time snapshots of a game's saves.
+
+    Every backup run that changed something writes one small JSON manifest to
+    saves/<game>/snapshots/ listing each file and the content it had. The
+    content itself lives in content-addressed objects (versioned mode) or
+    chunks (dedup mode), so unchanged files are shared by reference between
+    snapshots and a new snapshot only costs the bytes that changed. Old
+    snapshots are pruned by the game's retention policy and content no kept
+    snapshot refers to is deleted with them. Dedup mode stores files too big
+    to chunk quickly (see `chunking.chunkable`) as objects too.
+    """
+
+    def __init__(self, drive):
+        """
+        Args:
+            drive (GDrive): Used for every Drive call.
+        """
+        self.drive = drive
+
+    def queue_game(
+        self,
+        engine: TransferEngine,
+        tracker: GameTracker,
+        local_path: str,
+        mode: str,
+        retention: dict,
+    ) -> None:
+        manifest = tracker.manifest
+        with self.drive.metrics.phase("scan"):
+            stats = local_stats(local_path)
+        layout = {
+            rel_path: content_folder(mode, stat.st_size) for rel_path, stat in stats.items()
+        }
+        stored = self._stored_files(manifest, layout)
+        if manifest.all_unchanged(stats) and stored == set(stats):
+            logger.info(f"{manifest.game_name} unchanged since last snapshot.")
+            return
+
+        content_folders = sorted(set(layout.values()))
+        with self.drive.metrics.phase("plan"):
+            self.drive.ensure_folders(
+                manifest, content_folders + [SNAPSHOTS_FOLDER], local_path
+            )
+        if any(name not in manifest.folders for name in content_folders + [SNAPSHOTS_FOLDER]):
+            logger.error(f"Skipping {manifest.game_name}, its folders are missing.")
+            return
+
+        stored = self._stored_files(manifest, layout)
+        registries = {
+            name: ChunkRegistry(self.drive.remote_index.children(manifest.folders[name]))
+            for name in content_folders
+        }
+        queued = []
+        tracker.finalize = partial(
+            self._finish_snapshot, manifest, stats, layout, queued, retention
+        )
+        for rel_path, stat in stats.items():
+            if manifest.is_unchanged(rel_path, stat) and rel_path in stored:
+                continue
+            logger.info(f"Queueing {rel_path} of {local_path}.")
+            queued.append(rel_path)
+            tracker.task_added()
+            folder_name = layout[rel_path]
+            task = (
+                self._upload_chunked_file_task
+                if folder_name == CHUNKS_FOLDER
+                else self._upload_object_task
+            )
+            engine.submit(
+                task,
+                manifest,
+                registries[folder_name],
+                manifest.folders[folder_name],
+                os.path.join(local_path, rel_path),
+                rel_path,
+                stat,
+                tracker.progress.add_file(stat.st_size),
+                tracker.token,
+                on_done=tracker.task_done,
+            )
+
+    def _stored_files(self, manifest: SyncManifest, layout: dict) -> set:
+        """Files the manifest says are already stored where `layout`, relative
+        path -> content folder, wants them."""
+        stored = set()
+        for rel_path, folder_name in layout.items():
+            entry = manifest.files.get(rel_path)
+            content_id = manifest.folders.get(folder_name)
+            if (
+                entry
+                and content_id
+                and entry.get("remote_id") == content_id
+                and entry.get(CONTENT_KEYS[folder_name]) is not None
+            ):
+                stored.add(rel_path)
+        return stored
+
+    def _upload_object_task(
+        self,
+        manifest: SyncManifest,
+        registry: ChunkRegistry,
+        objects_id: str,
+        file_path: str,
+        rel_path: str,
+        stat,
+        file_progress: FileProgress,
+        token: CancelToken,
+    ) -> None:
+        """Runs on a transfer worker: stores one whole file as an object named
+        by its md5, unless an identical object already exists. False if the
+        upload failed."""
+        try:
+            token.checkpoint()
+            with self.drive.metrics.phase("transfer"):
+                return self._upload_object(
+                    manifest,
+                    registry,
+                    objects_id,
+                    file_path,
+                    rel_path,
+                    stat,
+                    chunk_callback(file_progress, token),
+                )
+        finally:
+            file_progress.finish()
+
+    def _upload_object(
+        self,
+        manifest: SyncManifest,
+        registry: ChunkRegistry,
+        objects_id: str,
+        file_path: str,
+        rel_path: str,
+        stat,
+        on_progress,
+    ) -> bool:
+        with self.drive.metrics.phase("hash"):
+            md5 = self.drive.hash_cache.md5(file_path, stat)
+        if registry.claim(md5):
+            try:
+                created_object = self.drive.upload_to_gdrive(
+                    file_path,
+                    parents=[objects_id],
+                    remote_name=md5,
+                    on_progress=on_progress,
+                )
+            except Exception:
+                registry.release(md5)
+                raise
+            if not created_object:
+                registry.release(md5)
+                return False
+            if created_object.get("md5Checksum") != md5:
+                logger.error(f"{file_path} changed while uploading. Dropping it.")
+                self.drive.delete_files({file_path: created_object["id"]})
+                registry.release(md5)
+                return False
+            self.drive.remote_index.add(objects_id, created_object)
+            registry.confirm(md5)
+            logger.info(f"{file_path} stored as object {md5}.")
+        elif registry.wait(md5):
+            logger.info(f"{file_path} content already stored.")
+        else:
+            logger.error(f"{file_path} not stored, another upload of its content failed.")
+            return False
+
+        manifest.record(rel_path, stat, md5, objects_id, None)
+        return True
+
+    def _upload_chunked_file_task(
+        self,
+        manifest: SyncManifest,
+        registry: ChunkRegistry,
+        chunks_id: str,
+        file_path: str,
+        rel_path: str,
+        stat,
+        file_progress: FileProgress,
+        token: CancelToken,
+    ) -> None:
+        """Runs on a transfer worker: uploads the chunks of one file that
+        Drive doesn't have yet and records the file's chunk list. False if
+        the upload failed."""
+        try:
+            token.checkpoint()
+            with self.drive.metrics.phase("transfer"):
+                return self._upload_chunked_file(
+                    manifest,
+                    registry,
+                    chunks_id,
+                    file_path,
+                    rel_path,
+                    stat,
+                    chunk_callback(file_progress, token),
+                )
+        finally:
+            file_progress.finish()
+
+    def _upload_chunked_file(
+        self,
+        manifest: SyncManifest,
+        registry: ChunkRegistry,
+        chunks_id: str,
+        file_path: str,
+        rel_path: str,
+        stat,
+        on_progress,
+    ) -> bool:
+        digests = []
+        # Chunks this file shares with uploads other workers are still doing.
+        others = []
+        uploaded = 0
+        offset = 0
+        for chunk in iter_chunks(file_path):
+            offset += len(chunk)
+            digest = hashlib.sha256(chunk).hexdigest()
+            digests.append(digest)
+            if not registry.claim(digest):
+                others.append(digest)
+                on_progress(offset)
+                continue
+            try:
+                created_chunk = self.drive.api.execute(
+                    self.drive._service().files().create(
+                        body={"name": digest, "parents": [chunks_id]},
+                        media_body=MediaIoBaseUpload(
+                            io.BytesIO(chunk), mimetype="application/octet-stream"
+                        ),
+                        fields=METADATA_FIELDS,
+                    )
+                )
+            except HttpError as error:
+                registry.release(digest)
+                logger.error(f"Uploading a chunk of {file_path} failed: {error}")
+                return False
+            except Exception:
+                registry.release(digest)
+                raise
+            self.drive.remote_index.add(chunks_id, created_chunk)
+            registry.confirm(digest)
+            self.drive.count_transfer("upload", len(chunk), files=0)
+            uploaded += 1
+            on_progress(offset)
+
+        if uploaded:
+            self.drive.count_transfer("upload", 0)
+        # Only waited for now, this worker holds no claims of its own anymore.
+        missing = [digest for digest in others if not registry.wait(digest)]
+        if missing:
+            logger.error(
+                f"{file_path} not stored, {len(missing)} of its chunks failed to upload elsewhere."
+            )
+            return False
+        manifest.record(rel_path, stat, None, chunks_id, None, chunks=digests)
+        logger.info(f"{file_path} chunked: {uploaded} of {len(digests)} chunks uploaded.")
+        return True
+
+    def _finish_snapshot(
+        self,
+        manifest: SyncManifest,
+        stats: dict,
+        layout: dict,
+        queued: list,
+        retention: dict,
+    ) -> bool:
+        """Uploads the snapshot manifest once every file is stored, then
+        prunes old snapshots.
+
+        Returns:
+            bool: False if no snapshot was written, the next run tries again.
+        """
+        files = {}
+        for rel_path, stat in stats.items():
+            entry = manifest.files.get(rel_path)
+            content_key = CONTENT_KEYS[layout[rel_path]]
+            if (
+                not entry
+                or entry.get(content_key) is None
+                or not manifest.is_unchanged(rel_path, stat)
+            ):
+                logger.error(f"Snapshot of {manifest.game_name} incomplete, {rel_path} failed.")
+                return False
+            files[rel_path] = {"size": entry["size"], content_key: entry[content_key]}
+
+        created = datetime.now(timezone.utc)
+        snapshot = {
+            "game_name": manifest.game_name,
+            "created": created.isoformat(),
+            "files": files,
+        }
+        snapshots_id = manifest.folders[SNAPSHOTS_FOLDER]
+        name = f"{created.strftime(SNAPSHOT_NAME_FORMAT)}{SNAPSHOT_SUFFIX}"
+        media = MediaIoBaseUpload(
+            io.BytesIO(json.dumps(snapshot).encode("utf-8")), mimetype="application/json"
+        )
+        files = self.drive._service().files()
+        # Names only go down to the second. Two backups within one second
+        # would leave two snapshots with the same name, and either might be
+        # the one restored, so the later one replaces the earlier.
+        existing = self.drive.remote_index.lookup(snapshots_id, name)
+        if existing:
+            request = files.update(
+                fileId=existing["id"], media_body=media, fields=METADATA_FIELDS
+            )
+        else:
+            request = files.create(
+                body={"name": name, "parents": [snapshots_id]},
+                media_body=media,
+                fields=METADATA_FIELDS,
+            )
+        try:
+            snapshot_file = self.drive.api.execute(request)
+        except HttpError as error:
+            logger.error(f"Uploading the snapshot of {manifest.game_name} failed: {error}")
+            # Otherwise the next run would find them stored and unchanged, and
+            # never write the snapshot. Their content is still matched by name.
+            for rel_path in queued:
+                manifest.forget(rel_path)
+            return False
+        for rel_path in set(manifest.files) - set(stats):
+            manifest.forget(rel_path)
+        self.drive.remote_index.add(snapshots_id, snapshot_file)
+        logger.info(f"Snapshot {snapshot_file['name']} of {manifest.game_name} uploaded.")
+
+        self.prune(manifest.folders["."], retention)
+        return True
+
+    def list_snapshots(self, game_folder_id: str) -> dict:
+        """Snapshot name -> creation time for every snapshot of a game."""
+        snapshots_folder = self.drive.remote_index.lookup(
+            game_folder_id, SNAPSHOTS_FOLDER, type="folder"
+        )
+        if not snapshots_folder:
+            return {}
+
+        created = {}
+        for name in self.drive.remote_index.children(snapshots_folder["id"]):
+            try:
+                moment = datetime.strptime(
+                    name.removesuffix(SNAPSHOT_SUFFIX), SNAPSHOT_NAME_FORMAT
+                )
+            except ValueError:
+                continue
+            created[name] = moment.replace(tzinfo=timezone.utc)
+        return created
+
+    def _read_snapshot(self, game_folder_id: str, name: str) -> dict:
+        snapshots_folder = self.drive.remote_index.lookup(
+            game_folder_id, SNAPSHOTS_FOLDER, type="folder"
+        )
+        snapshot_file = self.drive.remote_index.lookup(snapshots_folder["id"], name)
+        return json.loads(
+            self.drive.api.execute(
+                self.drive._service().files().get_media(fileId=snapshot_file["id"])
+            )
+        )
+
+    def prune(self, game_folder_id: str, retention: dict) -> int:
+        """Deletes the snapshots `retention` doesn't keep, then any object or
+        chunk the remaining snapshots no longer refer to. Both deletions go
+        out as batches.
+
+        Returns:
+            int: The number of snapshots deleted.
+        """
+        created = self.list_snapshots(game_folder_id)
+        keep = snapshots_to_keep(created, **retention)
+        doomed = set(created) - keep
+        if not doomed:
+            return 0
+
+        index = self.drive.remote_index
+        snapshots_id = index.lookup(game_folder_id, SNAPSHOTS_FOLDER, type="folder")["id"]
+        snapshot_ids = {name: index.lookup(snapshots_id, name)["id"] for name in doomed}
+        for name in self.drive.delete_files(snapshot_ids):
+            index.remove(snapshots_id, name)
+        logger.info(f"Pruned {len(doomed)} snapshots from {game_folder_id}.")
+
+        referenced = set()
+        try:
+            for name in keep:
+                for entry in self._read_snapshot(game_folder_id, name)["files"].values():
+                    referenced.update(entry.get("chunks", []))
+                    if entry.get("md5"):
+                        referenced.add(entry["md5"])
+        except HttpError as error:
+            # Without every kept snapshot we can't tell what is garbage.
+            logger.error(f"Skipping cleanup, reading a snapshot failed: {error}")
+            return len(doomed)
+
+        for folder_name in (OBJECTS_FOLDER, CHUNKS_FOLDER):
+            folder = index.lookup(game_folder_id, folder_name, type="folder")
+            if not folder:
+                continue
+            garbage = {
+                name: content["id"]
+                for name, content in index.children(folder["id"]).items()
+                if name not in referenced
+            }
+            for name in self.drive.delete_files(garbage):
+                index.remove(folder["id"], name)
+            logger.info(f"Deleted {len(garbage)} unreferenced {folder_name}.")
+        return len(doomed)
+
+    def restore(
+        self,
+        game_folder_id: str,
+        local_path: str,
+        overwrite: bool = False,
+        snapshot_name: str = None,
+        progress: GameProgress = None,
+    ) -> bool:
+        """Restores a snapshot, the latest one unless `snapshot_name` is given.
+
+        Returns:
+            bool: False if the snapshot or any of its files couldn't be restored.
+        """
+        created = self.list_snapshots(game_folder_id)
+        if not created:
+            logger.error(f"No snapshots to restore into {local_path}.")
+            return False
+        snapshot_name = snapshot_name or max(created, key=created.get)
+        if snapshot_name not in created:
+            logger.error(f"No snapshot named {snapshot_name}.")
+            return False
+
+        try:
+            snapshot = self._read_snapshot(game_folder_id, snapshot_name)
+        except (HttpError, ValueError) as error:
+            logger.error(f"Reading snapshot {snapshot_name} failed: {error}")
+            return False
+        content_ids = {}
+        for folder_name in (OBJECTS_FOLDER, CHUNKS_FOLDER):
+            folder = self.drive.remote_index.lookup(game_folder_id, folder_name, type="folder")
+            if folder:
+                children = self.drive.remote_index.children(folder["id"])
+                content_ids.update({name: child["id"] for name, child in children.items()})
+
+        logger.info(f"Restoring snapshot {snapshot_name} into {local_path}.")
+        progress = progress or TransferProgress("Restore").game(Path(local_path).name)
+        tracker = GameTracker(Path(local_path).name)
+        with TransferEngine(self.drive.workers) as engine:
+            for rel_path, entry in snapshot["files"].items():
+                save_path = Path(local_path) / rel_path
+                if save_path.exists():
+                    if entry.get("md5") and self.drive.hash_cache.md5(str(save_path)) == entry["md5"]:
+                        logger.info(f"{save_path} already up-to-date.")
+                        continue
+                    if not overwrite:
+                        logger.info(f"{save_path} exists. Not overwriting.")
+                        continue
+                tracker.task_added()
+                engine.submit(
+                    self._restore_file_task,
+                    entry,
+                    save_path,
+                    content_ids,
+                    progress.add_file(entry["size"]),
+                    on_done=tracker.task_done,
+                )
+            tracker.finish_submitting()
+        self.drive.hash_cache.save()
+        if tracker.failed:
+            logger.error(
+                f"{tracker.failed} of {tracker.tasks} files of snapshot {snapshot_name} "
+                f"couldn't be restored."
+            )
+        return not tracker.failed
+
+    def _restore_file_task(
+        self, entry: dict, save_path: Path, content_ids: dict, file_progress: FileProgress
+    ) -> bool:
+        try:
+            with self.drive.metrics.phase("transfer"):
+                return self._restore_file(entry, save_path, content_ids, file_progress)
+        finally:
+            file_progress.finish()
+
+    def _restore_file(
+        self, entry: dict, save_path: Path, content_ids: dict, file_progress: FileProgress
+    ) -> bool:
+        os.makedirs(save_path.parent, exist_ok=True)
+        if "md5" in entry:
+            if entry["md5"] not in content_ids:
+                logger.error(f"Object for {save_path} is missing.")
+                return False
+            if not self.drive.download_file(
+                content_ids[entry["md5"]], save_path, entry["md5"], file_progress.update
+            ):
+                return False
+            logger.info(f"{save_path} restored.")
+            return True
+
+        fd, temp_path = tempfile.mkstemp(
+            dir=save_path.parent, prefix=f".{save_path.name}.", suffix=".part"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for digest in entry["chunks"]:
+                    chunk = self.drive.api.execute(
+                        self.drive._service().files().get_media(fileId=content_ids[digest])
+                    )
+                    if hashlib.sha256(chunk).hexdigest() != digest:
+                        logger.error(f"Chunk {digest} of {save_path} is corrupt.")
+                        return False
+                    f.write(chunk)
+                    self.drive.count_transfer("download", len(chunk), files=0)
+                    file_progress.update(f.tell())
+            os.replace(temp_path, save_path)
+            self.drive.count_transfer("download", 0)
+            logger.info(f"{save_path} restored.")
+            return True
+        except (HttpError, KeyError) as error:
+            logger.error(f"Restoring {save_path} failed: {error}")
+            return False
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def content_folder(mode: str, size: int) -> str:
+    """Where a file of `size` bytes is stored in a snapshot `mode`."""
+    if mode == STORAGE_DEDUP and chunkable(size):
+        return CHUNKS_FOLDER
+    return OBJECTS_FOLDER
@@ -0,0 +1,53 @@
+import os
+
+from backend.registry import SaveRegistry
+from backend.manifest import SyncManifest, local_stats
+
+STATE_MISSING = "missing"
+STATE_NEVER = "never backed up"
+STATE_UP_TO_DATE = "up to date"
+
+
+def game_status(game_name: str, save_path: str, registry: SaveRegistry = None) -> dict:
+    """Local-only status of a game's saves, comparing the folder with the
+    sync state recorded at its last backup. Doesn't touch the network.
+
+    Returns:
+        dict: "state" (one of the STATE_* strings or "<n> changed, <m>
+            removed"), "size" in bytes (None if the folder is missing),
+            "files" and "last_backup" (a timestamp or None).
+    """
+    registry = registry or SaveRegistry()
+    status = {
+        "state": STATE_MISSING,
+        "size": None,
+        "files": 0,
+        "last_backup": registry.last_backup(game_name),
+    }
+    if not os.path.isdir(save_path):
+        return status
+
+    stats = local_stats(save_path)
+    status["size"] = sum(stat.st_size for stat in stats.values())
+    status["files"] = len(stats)
+
+    manifest = SyncManifest(game_name, registry)
+    if not manifest.files:
+        status["state"] = STATE_NEVER
+        return status
+
+    changed = sum(
+        not manifest.is_unchanged(rel_path, stat) for rel_path, stat in stats.items()
+    )
+    removed = len(set(manifest.files) - set(stats))
+    status["state"] = (
+        STATE_UP_TO_DATE if not changed and not removed else f"{changed} changed, {removed} removed"
+    )
+    return status
+
+
+def format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
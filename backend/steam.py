@@ -0,0 +1,171 @@
+import os
+import re
+import sys
+import glob
+from pathlib import Path
+from typing import NamedTuple
+
+# Steam's own tools show up as installed apps but never hold saves.
+TOOL_APP_IDS = {"228980"}  # Steamworks Common Redistributables
+TOOL_NAME_PREFIXES = ("Proton", "Steam Linux Runtime", "Steamworks")
+
+_VDF_TOKEN = re.compile(r'"((?:[^"\\]|\\.)*)"|([{}])|//[^\n]*|(\S+)')
+_VDF_ESCAPES = {"n": "\n", "t": "\t", "\\": "\\", '"': '"'}
+
+
+class SteamApp(NamedTuple):
+    app_id: str
+    name: str
+    install_dir: str
+    library: Path
+
+    @property
+    def install_path(self) -> Path:
+        return self.library / "steamapps" / "common" / self.install_dir
+
+    @property
+    def compat_user_path(self) -> Path:
+        """The Windows user folder inside the app's Proton prefix, where
+        AppData and Documents live when the game runs on Linux."""
+        return (
+            self.library
+            / "steamapps"
+            / "compatdata"
+            / self.app_id
+            / "pfx"
+            / "drive_c"
+            / "users"
+            / "steamuser"
+        )
+
+
+def parse_vdf(text: str) -> dict:
+    """Parses Valve's KeyValues text format (.vdf and .acf files).
+
+    Keys are lowercased, since Steam isn't consistent about their case
+    ("LibraryFolders" in older files, "libraryfolders" in newer ones).
+    """
+    root = {}
+    stack = [root]
+    key = None
+    for match in _VDF_TOKEN.finditer(text):
+        quoted, brace, bare = match.groups()
+        if brace == "{":
+            child = {}
+            stack[-1][key] = child
+            stack.append(child)
+            key = None
+        elif brace == "}":
+            if len(stack) > 1:
+                stack.pop()
+            key = None
+        elif quoted is not None or (bare is not None and not bare.startswith("[")):
+            value = (
+                re.sub(r"\\(.)", lambda m: _VDF_ESCAPES.get(m[1], m[0]), quoted)
+                if quoted is not None
+                else bare
+            )
+            if key is None:
+                key = value.lower()
+            else:
+                stack[-1][key] = value
+                key = None
+    return root
+
+
+def _load_vdf(path: Path) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return parse_vdf(f.read())
+    except OSError:
+        return {}
+
+
+def steam_roots() -> list:
+    """Steam installations on this machine."""
+    candidates = []
+    if sys.platform == "win32":
+        try:
+            import winreg
+
+            with winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Valve\Steam") as key:
+                candidates.append(Path(winreg.QueryValueEx(key, "SteamPath")[0]))
+        except OSError:
+            pass
+        candidates.append(Path("C:/Program Files (x86)/Steam"))
+    elif sys.platform == "darwin":
+        candidates.append(Path("~/Library/Application Support/Steam").expanduser())
+    else:
+        candidates += [
+            Path("~/.steam/steam").expanduser(),
+            Path("~/.local/share/Steam").expanduser(),
+            # Flatpak
+            Path("~/.var/app/com.valvesoftware.Steam/.local/share/Steam").expanduser(),
+        ]
+    return _existing_unique(candidates)
+
+
+def library_folders(steam_root: Path) -> list:
+    """Library roots listed in `steamapps/libraryfolders.vdf`, the Steam
+    installation itself included."""
+    data = _load_vdf(Path(steam_root) / "steamapps" / "libraryfolders.vdf")
+    libraries = [Path(steam_root)]
+    for key, value in data.get("libraryfolders", {}).items():
+        # Newer files nest the path with the app list, older ones map the
+        # index straight to the path. Other keys are bookkeeping.
+        if not key.isdigit():
+            continue
+        path = value.get("path") if isinstance(value, dict) else value
+        if path:
+            libraries.append(Path(path))
+    return _existing_unique(libraries)
+
+
+def installed_apps(library: Path) -> list:
+    """Apps installed in a library, from its `appmanifest_*.acf` files."""
+    apps = []
+    pattern = os.path.join(glob.escape(str(library)), "steamapps", "appmanifest_*.acf")
+    for manifest_path in glob.glob(pattern):
+        state = _load_vdf(Path(manifest_path)).get("appstate", {})
+        app_id, name = state.get("appid"), state.get("name")
+        if not app_id or not name or not state.get("installdir"):
+            continue
+        if app_id in TOOL_APP_IDS or name.startswith(TOOL_NAME_PREFIXES):
+            continue
+        apps.append(SteamApp(app_id, name, state["installdir"], Path(library)))
+    return apps
+
+
+def cloud_save_folders(steam_root: Path, apps: list) -> dict:
+    """Steam Cloud folders (`userdata/<user>/<appid>/remote`) that hold files.
+
+    Returns:
+        dict: app id -> folder. With several Steam accounts the first one
+            that has saves for the app is used.
+    """
+    folders = {}
+    app_ids = {app.app_id for app in apps}
+    try:
+        users = os.scandir(Path(steam_root) / "userdata")
+    except OSError:
+        return folders
+    with users:
+        for user in users:
+            if not user.is_dir():
+                continue
+            for app_id in app_ids - set(folders):
+                remote = os.path.join(user.path, app_id, "remote")
+                try:
+                    if os.listdir(remote):
+                        folders[app_id] = remote
+                except OSError:
+                    continue
+    return folders
+
+
+def _existing_unique(paths: list) -> list:
+    unique = {}
+    for path in paths:
+        if os.path.isdir(path):
+            unique.setdefault(os.path.normcase(os.path.realpath(path)), Path(path))
+    return list(unique.values())
@@ -0,0 +1,196 @@
+import queue
+import logging
+import time
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+QUEUE_SIZE_PER_WORKER = 4
+
+
+class TransferCanceled(Exception):
+    """Raised by `CancelToken.checkpoint` once the run is canceled."""
+
+
+class CancelToken:
+    """Lets the GUI or CLI cancel or pause a run from another thread.
+
+    Transfers call `checkpoint` between files and between chunks, so a
+    cancel takes effect within one chunk and a pause holds every worker
+    where it is until `resume`.
+    """
+
+    def __init__(self):
+        self._canceled = False
+        self._running = threading.Event()
+        self._running.set()
+
+    @property
+    def canceled(self) -> bool:
+        return self._canceled
+
+    @property
+    def paused(self) -> bool:
+        return not self._running.is_set()
+
+    def cancel(self) -> None:
+        self._canceled = True
+        # Paused workers have to wake up to notice.
+        self._running.set()
+
+    def pause(self) -> None:
+        if not self._canceled:
+            self._running.clear()
+
+    def resume(self) -> None:
+        self._running.set()
+
+    def checkpoint(self) -> None:
+        """Blocks while paused, raises TransferCanceled once canceled."""
+        self._running.wait()
+        if self._canceled:
+            raise TransferCanceled()
+
+
+def chunk_callback(file_progress, token: CancelToken):
+    """`on_progress` callback for chunked transfers: counts the chunk, then
+    gives the token its chance to pause or stop the transfer."""
+
+    def on_chunk(done: int) -> None:
+        file_progress.update(done)
+        token.checkpoint()
+
+    return on_chunk
+
+
+class TransferEngine:
+    """Fixed pool of worker threads fed from one bounded queue.
+
+    `submit` blocks once the queue is full, so a producer walking a huge save
+    tree never gets more than a few tasks ahead of the workers.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, queue_size: int = None):
+        self.workers = max(1, workers)
+        self._queue = queue.Queue(queue_size or self.workers * QUEUE_SIZE_PER_WORKER)
+        self._threads = [
+            threading.Thread(target=self._work, name=f"transfer-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def submit(self, func, *args, on_done=None) -> None:
+        """Queues `func(*args)`. `on_done` is called after it finishes, even if
+        it raised, with False if it raised or returned False and True
+        otherwise."""
+        self._queue.put((func, args, on_done))
+
+    def join(self) -> None:
+        """Waits until every submitted task has finished."""
+        self._queue.join()
+
+    def shutdown(self) -> None:
+        self.join()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self) -> None:
+        while True:
+            task = self._queue.get()
+            if task is None:
+                self._queue.task_done()
+                return
+            func, args, on_done = task
+            ok = False
+            try:
+                ok = func(*args) is not False
+            except TransferCanceled:
+                logger.info(f"Transfer task {func.__name__} canceled.")
+            except Exception as e:
+                logger.error(f"Transfer task {func.__name__}{args} failed: {e}")
+            finally:
+                try:
+                    if on_done:
+                        on_done(ok)
+                except Exception as e:
+                    logger.error(f"Completing {func.__name__} failed: {e}")
+                finally:
+                    self._queue.task_done()
+
+
+class GameTracker:
+    """Counts outstanding tasks for one game and fires `on_complete` once the
+    producer is done with it and the last task has finished. Failed tasks
+    are counted too, see `status`. Without `on_complete` the counts are
+    simply read once the engine is done."""
+
+    def __init__(
+        self,
+        game_name: str,
+        on_complete=None,
+        manifest=None,
+        finalize=None,
+        progress=None,
+        token: CancelToken = None,
+    ):
+        self.game_name = game_name
+        self.manifest = manifest
+        # GameProgress that queued files are counted against.
+        self.progress = progress
+        # Once canceled, `finalize` is skipped, the game's files are incomplete.
+        self.token = token
+        # Runs once all tasks are done, before `on_complete`. Returning False
+        # or raising makes the whole game count as failed.
+        self.finalize = finalize
+        self._on_complete = on_complete
+        self._pending = 1  # Held by the producer until `finish_submitting`.
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.tasks = 0
+        self.failed = 0
+        self.finalize_failed = False
+
+    def task_added(self) -> None:
+        with self._lock:
+            self._pending += 1
+            self.tasks += 1
+
+    def task_done(self, ok: bool = True) -> None:
+        with self._lock:
+            self._pending -= 1
+            if not ok:
+                self.failed += 1
+            complete = self._pending == 0
+        if complete:
+            if self.finalize and not (self.token and self.token.canceled):
+                try:
+                    self.finalize_failed = self.finalize() is False
+                except Exception as e:
+                    logger.error(f"Finishing {self.game_name} failed: {e}")
+                    self.finalize_failed = True
+            if self._on_complete:
+                self._on_complete(self)
+
+    @property
+    def status(self) -> str:
+        """How the game's backup went: "completed", "partial" when some
+        files failed, "failed" when all did or the game couldn't be
+        finished, or "canceled"."""
+        if self.token and self.token.canceled:
+            return "canceled"
+        if self.finalize_failed or (self.failed and self.failed >= self.tasks):
+            return "failed"
+        return "partial" if self.failed else "completed"
+
+    def finish_submitting(self) -> None:
+        self.task_done()
@@ -0,0 +1,167 @@
+import json
+import logging
+import threading
+import weakref
+
+import httplib2
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+logger = logging.getLogger(__name__)
+
+HTTP_TIMEOUT = 60
+# Idle services kept around between runs. Each holds its open connection,
+# so the next run's workers skip the TLS handshake.
+DEFAULT_MAX_IDLE = 8
+
+_documents = {}
+_documents_lock = threading.Lock()
+
+
+def discovery_document(api: str = "drive", version: str = "v3") -> str:
+    """The discovery document bundled with googleapiclient, read from disk
+    once per process instead of once per service."""
+    with _documents_lock:
+        document = _documents.get((api, version))
+        if document is None:
+            document = get_static_doc(api, version)
+            if document is None:
+                raise ValueError(f"No bundled discovery document for {api} {version}.")
+            _documents[(api, version)] = document
+    return document
+
+
+def build_drive_service(http: httplib2.Http):
+    # Built from the text, not a shared dict: the client library fills in
+    # the method descriptions it's given as it goes.
+    return build_from_document(discovery_document(), http=http)
+
+
+def keepalive_http() -> httplib2.Http:
+    """An HTTP/1.1 connection that stays open between requests."""
+    http = httplib2.Http(timeout=HTTP_TIMEOUT)
+    # Drive answers incomplete resumable uploads with 308, which isn't a redirect.
+    http.redirect_codes = http.redirect_codes - {308}
+    return http
+
+
+def authorized_http(credentials: Credentials) -> AuthorizedHttp:
+    return AuthorizedHttp(credentials, http=keepalive_http())
+
+
+class SharedCredentials(Credentials):
+    """OAuth credentials shared by every pooled connection.
+
+    google-auth refreshes the token from whichever thread finds it expired,
+    or gets it rejected, so several workers would otherwise refresh at once.
+    Here one thread refreshes while the others wait, and those that were
+    waiting use the token it got instead of refreshing again. `on_refresh`
+    is called with the credentials after each refresh, e.g. to save them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_refresh = None
+        self._refresh_lock = threading.Lock()
+        # The token each thread last sent, to tell whether a rejected token
+        # has already been replaced.
+        self._sent = threading.local()
+
+    @classmethod
+    def from_credentials(cls, credentials: Credentials, scopes: list = None) -> "SharedCredentials":
+        return cls.from_authorized_user_info(json.loads(credentials.to_json()), scopes)
+
+    def apply(self, headers: dict, token: str = None) -> None:
+        super().apply(headers, token)
+        self._sent.token = token or self.token
+
+    def refresh(self, request) -> None:
+        with self._refresh_lock:
+            if self.valid and self.token != getattr(self._sent, "token", None):
+                logger.info("Token already refreshed by another connection.")
+                return
+            super().refresh(request)
+            logger.info("Access token refreshed.")
+        if self.on_refresh:
+            self.on_refresh(self)
+
+
+class ServicePool:
+    """Drive service objects, each on its own keep-alive connection, handed
+    out one per thread.
+
+    httplib2 connections aren't thread safe, so a thread keeps the service
+    it was given for as long as it lives, then the service goes back to the
+    pool for the next thread. Workers started for a later run pick up the
+    open connections instead of making new ones. At most `max_idle`
+    services wait in the pool, extra ones are closed.
+    """
+
+    def __init__(self, build_service, max_idle: int = DEFAULT_MAX_IDLE):
+        """
+        Args:
+            build_service (callable): Returns a new service, e.g.
+                `build_drive_service(authorized_http(credentials))`.
+        """
+        self._build_service = build_service
+        self.max_idle = max_idle
+        self._idle = []
+        self._leased = set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+        self.created = 0
+
+    def service(self):
+        """The service belonging to the calling thread."""
+        lease = getattr(self._local, "lease", None)
+        if lease is None:
+            lease = self._local.lease = _Lease(self._acquire(), self._release)
+        return lease.service
+
+    def _acquire(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The Drive service pool is closed.")
+            if self._idle:
+                service = self._idle.pop()
+                self._leased.add(service)
+                return service
+            self.created += 1
+        service = self._build_service()
+        with self._lock:
+            self._leased.add(service)
+        return service
+
+    def _release(self, service) -> None:
+        with self._lock:
+            self._leased.discard(service)
+            if not self._closed and len(self._idle) < self.max_idle:
+                # Last in, first out: the most recently used connection is
+                # the one most likely to still be open.
+                self._idle.append(service)
+                return
+        service.close()
+
+    def close(self) -> None:
+        """Closes every connection, including those of threads still holding
+        a service."""
+        with self._lock:
+            self._closed = True
+            services = self._idle + list(self._leased)
+            self._idle = []
+            self._leased = set()
+        for service in services:
+            service.close()
+
+
+class _Lease:
+    """A thread's hold on a pooled service. It only lives in that thread's
+    local storage, which Python drops when the thread ends, and that gives
+    the service back."""
+
+    def __init__(self, service, release):
+        self.service = service
+        weakref.finalize(self, release, service)
@@ -0,0 +1,55 @@
+import os
+import threading
+from pathlib import Path
+
+from backend.utilities import load_from_json, save_to_json
+
+UPLOAD_SESSIONS_PATH = Path("./data/upload_sessions.json")
+
+
+class UploadSessions:
+    """Resumable upload sessions that survive a restart.
+
+    Every session is keyed by the absolute local path and remembers what it was
+    uploading to, so it is only resumed when the same file (same size and
+    mtime) is sent to the same place again.
+    """
+
+    def __init__(self, location: Path = UPLOAD_SESSIONS_PATH):
+        self.location = Path(location)
+        self._lock = threading.Lock()
+        self._sessions = load_from_json(self.location) if self.location.exists() else {}
+
+    def get(self, path: str, stat: os.stat_result, target: str) -> dict:
+        with self._lock:
+            session = self._sessions.get(os.path.abspath(path))
+        if (
+            session
+            and session["target"] == target
+            and session["size"] == stat.st_size
+            and session["mtime_ns"] == stat.st_mtime_ns
+        ):
+            return session
+        return None
+
+    def record(
+        self, path: str, stat: os.stat_result, target: str, uri: str, offset: int
+    ) -> None:
+        with self._lock:
+            self._sessions[os.path.abspath(path)] = {
+                "target": target,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "uri": uri,
+                "offset": offset,
+            }
+            self._save()
+
+    def remove(self, path: str) -> None:
+        with self._lock:
+            if self._sessions.pop(os.path.abspath(path), None) is not None:
+                self._save()
+
+    def _save(self) -> None:
+        os.makedirs(self.location.parent, exist_ok=True)
+        save_to_json(self._sessions, self.location)
@@ -1,5 +1,4 @@
 import json
-import timeit
 
 def save_to_json(dict_to_save: dict, destination: str) -> None:
     """Simple method for saving dictionary in json format.
@@ -29,11 +28,3 @@ def load_from_json(location: str) -> dict:
         loaded_dict = {}
 
     return loaded_dict
-
-def timer(func):
-    def wrapper(self, *args):
-        start = timeit.default_timer()
-        func(self, *args)
-        end = timeit.default_timer()
-        print(end - start)
-    return wrapper
@@ -0,0 +1,295 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+
+from backend.manifest import local_stats
+from backend.transfer import CancelToken
+
+logger = logging.getLogger(__name__)
+
+# Seconds without new writes before a game counts as quiet.
+DEFAULT_DEBOUNCE = 10.0
+# Seconds the files must then keep the same size and mtime before uploading,
+# so a save that is still being written isn't captured half way.
+DEFAULT_SETTLE = 5.0
+DEFAULT_POLL_INTERVAL = 30.0
+# Longest the daemon sleeps when nothing is pending.
+IDLE_WAKEUP = 3600.0
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """Watches save folders with Linux inotify.
+
+    Sleeps in `select` until the kernel reports a write, so it costs nothing
+    while no game is running.
+    """
+
+    def __init__(self, roots: dict):
+        """
+        Args:
+            roots (dict): game name -> save folder.
+        """
+        libc_name = ctypes.util.find_library("c")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches = {}
+        self.roots = roots
+        self._wake_read, self._wake_write = os.pipe()
+        try:
+            for game_name, root in roots.items():
+                for path, dirs, files in os.walk(root):
+                    self._add_watch(game_name, path)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, game_name: str, path: str) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"Can't watch {path}: {os.strerror(error)}")
+        self._watches[wd] = (game_name, path)
+
+    def wait(self, timeout: float = None) -> set:
+        """Blocks for up to `timeout` seconds (forever if None).
+
+        Returns:
+            set: Names of the games that saw writes.
+        """
+        readable, _, _ = select.select([self._fd, self._wake_read], [], [], timeout)
+        if self._fd not in readable:
+            return set()
+
+        touched = set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return touched
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + name_length].rstrip(b"\0"))
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped, treat every game as touched.
+                touched.update(self.roots)
+                continue
+            if wd not in self._watches:
+                continue
+            game_name, path = self._watches[wd]
+            touched.add(game_name)
+            if mask & IN_CREATE and mask & IN_ISDIR:
+                new_dir = os.path.join(path, name)
+                for sub_path, dirs, files in os.walk(new_dir):
+                    try:
+                        self._add_watch(game_name, sub_path)
+                    except OSError as e:
+                        logger.error(e)
+            if mask & IN_DELETE_SELF:
+                del self._watches[wd]
+        return touched
+
+    def wake(self) -> None:
+        """Makes a blocked `wait` return early."""
+        os.write(self._wake_write, b"\0")
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            os.close(self._wake_read)
+            os.close(self._wake_write)
+            self._fd = -1
+
+
+class PollingWatcher:
+    """Fallback for platforms without inotify: compares file stats every
+    `interval` seconds."""
+
+    def __init__(self, roots: dict, interval: float = DEFAULT_POLL_INTERVAL):
+        self.roots = roots
+        self.interval = interval
+        self._stats = {game_name: _fingerprint(root) for game_name, root in roots.items()}
+        self._next_poll = time.monotonic() + interval
+        self._woken = threading.Event()
+
+    def wait(self, timeout: float = None) -> set:
+        delay = self._next_poll - time.monotonic()
+        if timeout is not None and timeout < delay:
+            self._woken.wait(max(0.0, timeout))
+            return set()
+        if self._woken.wait(max(0.0, delay)):
+            return set()
+        self._next_poll = time.monotonic() + self.interval
+
+        touched = set()
+        for game_name, root in self.roots.items():
+            try:
+                fingerprint = _fingerprint(root)
+            except OSError as e:
+                logger.error(f"Polling {root} failed: {e}")
+                continue
+            if fingerprint != self._stats[game_name]:
+                self._stats[game_name] = fingerprint
+                touched.add(game_name)
+        return touched
+
+    def wake(self) -> None:
+        self._woken.set()
+
+    def close(self) -> None:
+        pass
+
+
+def _fingerprint(root: str) -> dict:
+    return {
+        rel_path: (stat.st_size, stat.st_mtime_ns)
+        for rel_path, stat in local_stats(root).items()
+    }
+
+
+def create_watcher(roots: dict, poll_interval: float = DEFAULT_POLL_INTERVAL):
+    """inotify on Linux when it's usable, polling everywhere else."""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                logger.error("Out of inotify watches, falling back to polling.")
+            else:
+                logger.error(f"inotify unavailable ({e}), falling back to polling.")
+    return PollingWatcher(roots, poll_interval)
+
+
+class BackupDaemon:
+    """Uploads a game's changed files once its saves have gone quiet.
+
+    A burst of writes only triggers one backup: a game is due `debounce`
+    seconds after its last write, and it is uploaded once its files then keep
+    the same size and mtime for another `settle` seconds. Uploads go through
+    `GDrive.upload_games`, so only files that actually changed are sent.
+    """
+
+    def __init__(
+        self,
+        drive,
+        roots: dict,
+        debounce: float = DEFAULT_DEBOUNCE,
+        settle: float = DEFAULT_SETTLE,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+    ):
+        """
+        Args:
+            drive (GDrive): Used for the uploads.
+            roots (dict): game name -> save folder. Folders that don't exist
+                are ignored.
+        """
+        self.drive = drive
+        self.roots = {name: path for name, path in roots.items() if os.path.isdir(path)}
+        self.debounce = debounce
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+        # Also stops an upload that is under way.
+        self.token = CancelToken()
+        self._watcher = None
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.token.cancel()
+        if self._watcher:
+            self._watcher.wake()
+
+    def run(self) -> None:
+        watcher = self._watcher = create_watcher(self.roots, self.poll_interval)
+        logger.info(f"Watching {len(self.roots)} save folders with {type(watcher).__name__}.")
+        last_write = {}  # game name -> time of the last write seen
+        settling = {}  # game name -> (fingerprint, time it must hold until)
+        try:
+            while not self.stop_event.is_set():
+                deadlines = [t + self.debounce for t in last_write.values()]
+                deadlines += [until for _, until in settling.values()]
+                timeout = (
+                    max(0.0, min(deadlines) - time.monotonic()) if deadlines else IDLE_WAKEUP
+                )
+
+                touched = watcher.wait(timeout)
+                now = time.monotonic()
+                for game_name in touched:
+                    last_write[game_name] = now
+                    settling.pop(game_name, None)
+
+                for game_name, written in list(last_write.items()):
+                    if now - written >= self.debounce:
+                        del last_write[game_name]
+                        fingerprint = self._fingerprint(game_name)
+                        if fingerprint is None:
+                            last_write[game_name] = now
+                        else:
+                            settling[game_name] = (fingerprint, now + self.settle)
+
+                due = []
+                for game_name, (fingerprint, until) in list(settling.items()):
+                    if now < until:
+                        continue
+                    del settling[game_name]
+                    if self._fingerprint(game_name) == fingerprint:
+                        due.append(game_name)
+                    else:
+                        last_write[game_name] = now
+
+                if due:
+                    logger.info(f"Backing up {', '.join(due)}.")
+                    try:
+                        self.drive.upload_games(
+                            [(name, self.roots[name]) for name in due], token=self.token
+                        )
+                    except Exception as e:
+                        logger.error(
+                            f"Backing up {', '.join(due)} failed, trying again later: {e}"
+                        )
+                        now = time.monotonic()
+                        last_write.update({game_name: now for game_name in due})
+        finally:
+            watcher.close()
+
+    def _fingerprint(self, game_name: str) -> dict:
+        """Fingerprint of a game's save folder, None if it couldn't be read."""
+        try:
+            return _fingerprint(self.roots[game_name])
+        except Exception as e:
+            logger.error(f"Reading the saves of {game_name} failed, trying again later: {e}")
+            return None
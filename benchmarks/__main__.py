@@ -0,0 +1,263 @@
+"""Offline benchmark of discovery, backup and restore.
+
+    python -m benchmarks [--scale 0.25] [--storage dedup] [--latency 0.02]
+                         [--json results.json] [--baseline baseline.json]
+
+Synthetic save trees (many tiny files, a few huge ones, deep nesting) are
+backed up to a `FakeDriveServer` by an unmodified GDrive, which only differs
+in how it connects. For every step the requests, calls, bytes and wall time
+are reported. With --baseline the run fails when a step needs more requests
+or bytes than the baseline allows, or gets much slower, so it can gate CI.
+
+Everything happens in a temporary directory, the real registry, caches and
+logs are never touched.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.fake_drive import FakeDriveServer, LocalHttp
+from benchmarks.save_trees import (
+    MB,
+    tiny_files,
+    huge_files,
+    deep_tree,
+    appdata_tree,
+    mutate,
+    tree_digest,
+)
+
+# Counts compared against the baseline, and how much they may grow.
+COUNT_KEYS = ("requests", "calls", "bytes_up", "bytes_down")
+DEFAULT_TOLERANCE = 0.05
+DEFAULT_TIME_TOLERANCE = 0.5
+# Steps faster than this in the baseline are too noisy to compare by time.
+MIN_TIMED_SECONDS = 0.5
+
+
+def parse_args(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.split("\n")[0])
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplies file counts and sizes.")
+    parser.add_argument(
+        "--storage",
+        default="versioned",
+        choices=("versioned", "dedup", "packed", "files"),
+        help="Storage mode of every benchmark game.",
+    )
+    parser.add_argument("--workers", type=int, help="Transfer workers, the app's default if left out.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random seconds on top of --latency.")
+    parser.add_argument("--bandwidth", type=float, help="Bytes per second each way, per request.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Chance of a 500 or 503 per call.")
+    parser.add_argument("--quota", type=float, help="Calls per second before Drive says 403 rate limit.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="Write the results here.")
+    parser.add_argument("--baseline", type=Path, help="Results of an earlier run to compare with.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--time-tolerance", type=float, default=DEFAULT_TIME_TOLERANCE)
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary directory.")
+    return parser.parse_args(argv)
+
+
+def scaled(value: int, scale: float) -> int:
+    return max(1, int(value * scale))
+
+
+def build_trees(root: Path, scale: float) -> dict:
+    """game name -> save folder."""
+    return {
+        "Tiny Files": str(tiny_files(root / "tiny", count=scaled(1000, scale))),
+        "Huge Files": str(huge_files(root / "huge", size=scaled(32 * MB, scale))),
+        "Deep Tree": str(deep_tree(root / "deep", branches=scaled(8, scale))),
+    }
+
+
+def connect(server_url: str, workers: int = None):
+    """A GDrive talking to the fake server, without OAuth."""
+    # Imported once the working directory is set up, the module opens its
+    # log file relative to it.
+    from backend.GDrive import GDrive
+    from backend.transport import build_drive_service
+
+    class FakeGDrive(GDrive):
+        def _authenticate(self):
+            return None
+
+        def _build_service(self):
+            return build_drive_service(LocalHttp(server_url))
+
+    return FakeGDrive(workers) if workers else FakeGDrive()
+
+
+def measure(name: str, server: FakeDriveServer, func) -> dict:
+    """Runs `func` and returns what it cost. `func` may return a dict of
+    extra fields for the step."""
+    server.drive.reset_stats()
+    start = time.perf_counter()
+    extra = func() or {}
+    seconds = time.perf_counter() - start
+    stats = server.drive.stats()
+    step = {
+        "step": name,
+        "seconds": round(seconds, 3),
+        "requests": stats["requests"],
+        "calls": stats["calls"],
+        "bytes_up": stats["bytes_in"],
+        "bytes_down": stats["bytes_out"],
+        "errors": stats["errors"],
+        "throttled": stats["throttled"],
+        "by_kind": stats["by_kind"],
+        **extra,
+    }
+    print(f"{name}: {seconds:.2f}s, {stats['requests']} requests", file=sys.stderr)
+    return step
+
+
+def run(args: argparse.Namespace, work: Path) -> list:
+    from backend.registry import SaveRegistry
+    from backend.file_discovery import discover_folders_parallel
+    from backend.game_settings import set_storage_mode
+
+    server_options = {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "bandwidth": args.bandwidth,
+        "error_rate": args.error_rate,
+        "quota": args.quota,
+        "seed": args.seed,
+    }
+    steps = []
+    with FakeDriveServer(**server_options) as server:
+        appdata = appdata_tree(work / "appdata", games=scaled(200, args.scale))
+
+        def discover():
+            found = discover_folders_parallel(
+                [str(appdata)], use_cache=False, registry=SaveRegistry(work / "data" / "discovered.db")
+            )
+            return {"found": len(found)}
+
+        steps.append(measure("discovery", server, discover))
+
+        games = build_trees(work / "saves", args.scale)
+        registry = SaveRegistry()
+        for game_name, save_path in games.items():
+            registry.add_save(game_name, save_path)
+            set_storage_mode(game_name, args.storage)
+        save_list = list(games.items())
+
+        drive = None
+
+        def connect_drive():
+            nonlocal drive
+            drive = connect(server.url, args.workers)
+
+        steps.append(measure("connect", server, connect_drive))
+        try:
+            steps.append(measure("first backup", server, lambda: drive.upload_games(save_list)))
+            steps.append(measure("no-op backup", server, lambda: drive.upload_games(save_list)))
+            for seed, save_path in enumerate(games.values()):
+                mutate(Path(save_path), seed=seed)
+            steps.append(measure("incremental backup", server, lambda: drive.upload_games(save_list)))
+
+            def restore():
+                verified = True
+                for game_name, save_path in games.items():
+                    target = work / "restored" / game_name
+                    if not drive.restore_game(game_name, str(target)):
+                        verified = False
+                        continue
+                    # The "files" mode doesn't delete remote copies of removed
+                    # files, so only what's still saved has to come back.
+                    restored = tree_digest(target)
+                    if any(restored.get(path) != md5 for path, md5 in tree_digest(save_path).items()):
+                        print(f"Restored {game_name} differs from its saves.", file=sys.stderr)
+                        verified = False
+                return {"verified": verified}
+
+            steps.append(measure("restore", server, restore))
+        finally:
+            if drive:
+                drive.close()
+    return steps
+
+
+def print_table(steps: list) -> None:
+    from backend.status import format_size
+
+    header = f"{'step':<20}{'seconds':>9}{'requests':>10}{'calls':>8}{'up':>11}{'down':>11}{'errors':>8}"
+    print(header)
+    print("-" * len(header))
+    for step in steps:
+        errors = step["errors"] + step["throttled"]
+        print(
+            f"{step['step']:<20}{step['seconds']:>9.2f}{step['requests']:>10}{step['calls']:>8}"
+            f"{format_size(step['bytes_up']):>11}{format_size(step['bytes_down']):>11}{errors:>8}"
+        )
+
+
+def compare(steps: list, baseline: dict, tolerance: float, time_tolerance: float) -> list:
+    """Regressions against `baseline`, as readable lines. A restore that
+    didn't bring back the saves is one even without a baseline."""
+    regressions = []
+    previous = {step["step"]: step for step in baseline.get("steps", [])}
+    for step in steps:
+        if step.get("verified") is False:
+            regressions.append(f"{step['step']}: restored files don't match the saves")
+        old = previous.get(step["step"])
+        if not old:
+            continue
+        for key in COUNT_KEYS:
+            if step[key] > old[key] * (1 + tolerance):
+                regressions.append(f"{step['step']}: {key} {old[key]} -> {step[key]}")
+        if old["seconds"] >= MIN_TIMED_SECONDS and step["seconds"] > old["seconds"] * (1 + time_tolerance):
+            regressions.append(f"{step['step']}: seconds {old['seconds']} -> {step['seconds']}")
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    config = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ("json", "baseline", "tolerance", "time_tolerance", "keep")
+    }
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+    json_path = args.json.resolve() if args.json else None
+
+    cwd = os.getcwd()
+    work = Path(tempfile.mkdtemp(prefix="savesync-benchmark-"))
+    os.makedirs(work / "logs")
+    os.makedirs(work / "data")
+    os.chdir(work)
+    try:
+        steps = run(args, work)
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"Kept {work}", file=sys.stderr)
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+    print_table(steps)
+    if json_path:
+        json_path.write_text(json.dumps({"config": config, "steps": steps}, indent=2))
+
+    if baseline and baseline.get("config") != config:
+        print("Baseline was run with different options, comparing anyway.", file=sys.stderr)
+    regressions = compare(steps, baseline or {}, args.tolerance, args.time_tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
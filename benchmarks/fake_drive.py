@@ -0,0 +1,612 @@
+"""An in-process stand-in for the parts of the Drive v3 API the backend uses.
+
+`FakeDriveServer` serves files.list (with paging and the query forms GDrive
+sends), files.get (metadata and media, with ranges), files.create,
+files.update and files.delete, multipart and resumable uploads, and the
+batch endpoint, over real HTTP on localhost. The unmodified client library
+talks to it through `LocalHttp`, so request counts and payload sizes are the
+ones a real run would produce.
+
+Latency, bandwidth, random server errors and a per-second quota can be
+injected to see how the backend copes with a slow or unwilling Drive.
+"""
+import re
+import json
+import time
+import uuid
+import random
+import hashlib
+import threading
+import urllib.parse
+from email import message_from_string
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httplib2
+
+# What the static discovery document points the client at.
+DRIVE_ROOT_URL = "https://www.googleapis.com/"
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+ROOT_ID = "0AFakeDriveRoot"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+HTTP_TIMEOUT = 60
+
+QUERY_CLAUSE = re.compile(
+    r"""\s*(?:
+        (?P<trashed>trashed\s*=\s*false)
+        | name\s*=\s*'(?P<name>(?:\\.|[^'\\])*)'
+        | '(?P<parent>[^']+)'\s+in\s+parents
+        | mimeType\s*(?P<negate>!)?=\s*'(?P<mime_type>[^']*)'
+    )\s*(?:and\b|$)""",
+    re.VERBOSE,
+)
+STATUS_TEXT = {
+    200: "OK",
+    204: "No Content",
+    206: "Partial Content",
+    308: "Resume Incomplete",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    416: "Requested Range Not Satisfiable",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class DriveError(Exception):
+    def __init__(self, status: int, reason: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.message = message
+
+    def response(self) -> tuple:
+        body = {
+            "error": {
+                "code": self.status,
+                "message": self.message,
+                "errors": [{"domain": "global", "reason": self.reason, "message": self.message}],
+            }
+        }
+        return _json_response(body, self.status)
+
+
+class FakeDrive:
+    """Files, folders and upload sessions kept in memory, plus request
+    accounting. Transport independent, `FakeDriveServer` puts it on HTTP.
+
+    Every API call, batched or not, counts once against the quota and may
+    be failed by error injection. Latency and bandwidth are paid once per
+    HTTP request, so batching pays off here as it does against Drive.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        bandwidth: float = None,
+        error_rate: float = 0.0,
+        quota: float = None,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            latency (float): Seconds added to every HTTP request.
+            jitter (float): Up to this many random seconds on top of `latency`.
+            bandwidth (float): Bytes per second for request and response
+                bodies, unlimited if None.
+            error_rate (float): Chance of a call failing with a 500 or 503.
+            quota (float): Calls allowed per second, bursts included. Calls
+                above it fail with 403 userRateLimitExceeded. Unlimited if None.
+            seed (int): Seeds the random latency and errors.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.quota = quota
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._files = {
+            ROOT_ID: {
+                "id": ROOT_ID,
+                "name": "My Drive",
+                "mimeType": FOLDER_MIME_TYPE,
+                "parents": [],
+                "modifiedTime": _now(),
+            }
+        }
+        self._content = {}
+        self._sessions = {}
+        self._next_id = 0
+        self._quota_tokens = quota or 0.0
+        self._quota_updated = time.monotonic()
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats = {
+                "requests": 0,
+                "calls": 0,
+                "bytes_in": 0,
+                "bytes_out": 0,
+                "errors": 0,
+                "throttled": 0,
+                "by_kind": {},
+            }
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: "requests" (HTTP requests), "calls" (API calls, batched ones
+                counted one by one), "bytes_in" and "bytes_out" (request and
+                response bodies), "errors" and "throttled" (injected failures)
+                and "by_kind" (calls per kind, e.g. "list" or "upload_chunk").
+        """
+        with self._lock:
+            return {**self._stats, "by_kind": dict(self._stats["by_kind"])}
+
+    def file_count(self) -> int:
+        with self._lock:
+            return len(self._files) - 1
+
+    def handle(self, method: str, target: str, headers: dict, body: bytes, base_url: str) -> tuple:
+        """Serves one HTTP request.
+
+        Args:
+            target (str): Path and query string.
+            headers (dict): Lowercase header name -> value.
+            base_url (str): Where the server is reachable, for upload session
+                URIs.
+
+        Returns:
+            tuple: (status, headers, body).
+        """
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["bytes_in"] += len(body)
+        self._delay(len(body))
+
+        path, query = _split_target(target)
+        if method == "POST" and path == "/batch/drive/v3":
+            self._count("batch")
+            response = self._batch(headers, body)
+        else:
+            response = self._call(method, path, query, headers, body, base_url)
+
+        with self._lock:
+            self._stats["bytes_out"] += len(response[2])
+        self._delay(len(response[2]), latency=False)
+        return response
+
+    def _delay(self, size: int, latency: bool = True) -> None:
+        seconds = 0.0
+        if latency and (self.latency or self.jitter):
+            with self._lock:
+                seconds += self.latency + self._random.uniform(0, self.jitter)
+        if self.bandwidth and size:
+            seconds += size / self.bandwidth
+        if seconds:
+            time.sleep(seconds)
+
+    def _count(self, kind: str) -> None:
+        with self._lock:
+            by_kind = self._stats["by_kind"]
+            by_kind[kind] = by_kind.get(kind, 0) + 1
+
+    def _call(self, method, path, query, headers, body, base_url) -> tuple:
+        with self._lock:
+            self._stats["calls"] += 1
+        try:
+            self._inject_failure()
+            return self._route(method, path, query, headers, body, base_url)
+        except DriveError as error:
+            return error.response()
+
+    def _inject_failure(self) -> None:
+        with self._lock:
+            if self.quota:
+                now = time.monotonic()
+                self._quota_tokens = min(
+                    self.quota, self._quota_tokens + (now - self._quota_updated) * self.quota
+                )
+                self._quota_updated = now
+                if self._quota_tokens < 1:
+                    self._stats["throttled"] += 1
+                    raise DriveError(403, "userRateLimitExceeded", "User rate limit exceeded.")
+                self._quota_tokens -= 1
+            if self.error_rate and self._random.random() < self.error_rate:
+                self._stats["errors"] += 1
+                status = self._random.choice((500, 503))
+                raise DriveError(status, "backendError", "Backend Error")
+
+    def _route(self, method, path, query, headers, body, base_url) -> tuple:
+        if path.startswith("/upload/drive/v3/files"):
+            file_id = _file_id(path, "/upload/drive/v3/files")
+            if "upload_id" in query:
+                if method != "PUT":
+                    raise DriveError(400, "badRequest", "Upload sessions take PUT requests.")
+                return self._upload_chunk(query["upload_id"], headers, body)
+            if query.get("uploadType") == "resumable":
+                return self._start_upload(method, file_id, headers, body, base_url)
+            return self._upload(method, file_id, headers, body)
+
+        if path.startswith("/drive/v3/files"):
+            file_id = _file_id(path, "/drive/v3/files")
+            if file_id is None:
+                if method == "GET":
+                    return self._list(query)
+                if method == "POST":
+                    self._count("create")
+                    return _json_response(self._create(_json_body(body), None, None))
+            elif method == "GET":
+                if query.get("alt") == "media":
+                    return self._get_media(file_id, headers)
+                self._count("get")
+                return _json_response(self._metadata(file_id))
+            elif method == "PATCH":
+                self._count("update")
+                return _json_response(self._update(file_id, _json_body(body), query))
+            elif method == "DELETE":
+                self._count("delete")
+                self._delete(file_id)
+                return 204, {}, b""
+        raise DriveError(404, "notFound", f"No such endpoint: {method} {path}")
+
+    def _list(self, query: dict) -> tuple:
+        self._count("list")
+        matches = _parse_query(query.get("q", ""))
+        page_size = min(int(query.get("pageSize", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        offset = int(query.get("pageToken") or 0)
+        with self._lock:
+            found = [
+                dict(file)
+                for file in self._files.values()
+                if file["id"] != ROOT_ID and all(match(file) for match in matches)
+            ]
+        response = {"files": found[offset : offset + page_size]}
+        if offset + page_size < len(found):
+            response["nextPageToken"] = str(offset + page_size)
+        return _json_response(response)
+
+    def _metadata(self, file_id: str) -> dict:
+        with self._lock:
+            file = self._files.get(ROOT_ID if file_id == "root" else file_id)
+            if file is None:
+                raise DriveError(404, "notFound", f"File not found: {file_id}.")
+            return dict(file)
+
+    def _get_media(self, file_id: str, headers: dict) -> tuple:
+        self._count("get_media")
+        with self._lock:
+            if file_id not in self._files:
+                raise DriveError(404, "notFound", f"File not found: {file_id}.")
+            content = self._content.get(file_id, b"")
+        media_headers = {"content-type": "application/octet-stream"}
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", headers.get("range", ""))
+        if not match:
+            return 200, media_headers, content
+
+        start = int(match.group(1))
+        end = min(int(match.group(2) or len(content) - 1), len(content) - 1)
+        if start >= len(content):
+            return 416, {"content-range": f"bytes */{len(content)}"}, b""
+        media_headers["content-range"] = f"bytes {start}-{end}/{len(content)}"
+        return 206, media_headers, content[start : end + 1]
+
+    def _create(self, metadata: dict, content: bytes, mime_type: str) -> dict:
+        parents = metadata.get("parents") or [ROOT_ID]
+        with self._lock:
+            for parent in parents:
+                if self._files.get(parent, {}).get("mimeType") != FOLDER_MIME_TYPE:
+                    raise DriveError(404, "notFound", f"File not found: {parent}.")
+            self._next_id += 1
+            file_id = f"fake{self._next_id:08d}"
+            file = {
+                "id": file_id,
+                "name": metadata.get("name", "Untitled"),
+                "mimeType": metadata.get("mimeType") or mime_type or "application/octet-stream",
+                "parents": list(parents),
+            }
+            self._files[file_id] = file
+            self._set_content(file, content or b"")
+            return dict(file)
+
+    def _update(self, file_id: str, metadata: dict, query: dict, content: bytes = None) -> dict:
+        with self._lock:
+            file = self._files.get(file_id)
+            if file is None:
+                raise DriveError(404, "notFound", f"File not found: {file_id}.")
+            for key in ("name", "mimeType", "properties", "appProperties", "description"):
+                if key in metadata:
+                    file[key] = metadata[key]
+            removed = set(filter(None, query.get("removeParents", "").split(",")))
+            added = [p for p in query.get("addParents", "").split(",") if p]
+            file["parents"] = [p for p in file["parents"] if p not in removed] + added
+            if content is not None:
+                self._set_content(file, content)
+            else:
+                file["modifiedTime"] = _now()
+            return dict(file)
+
+    def _set_content(self, file: dict, content: bytes) -> None:
+        file["modifiedTime"] = _now()
+        if file["mimeType"].startswith("application/vnd.google-apps."):
+            return
+        self._content[file["id"]] = bytes(content)
+        file["md5Checksum"] = hashlib.md5(content).hexdigest()
+        file["size"] = str(len(content))
+
+    def _delete(self, file_id: str) -> None:
+        with self._lock:
+            if file_id not in self._files:
+                raise DriveError(404, "notFound", f"File not found: {file_id}.")
+            doomed = [file_id]
+            while doomed:
+                current = doomed.pop()
+                self._files.pop(current, None)
+                self._content.pop(current, None)
+                doomed += [f["id"] for f in self._files.values() if current in f["parents"]]
+
+    def _upload(self, method: str, file_id: str, headers: dict, body: bytes) -> tuple:
+        """A multipart or simple (media only) upload in one request."""
+        self._count("upload")
+        metadata, content, mime_type = _parse_upload(headers, body)
+        if method == "POST" and file_id is None:
+            return _json_response(self._create(metadata, content, mime_type))
+        if method == "PATCH" and file_id:
+            return _json_response(self._update(file_id, metadata, {}, content))
+        raise DriveError(400, "badRequest", f"Can't upload with {method}.")
+
+    def _start_upload(self, method, file_id, headers, body, base_url) -> tuple:
+        self._count("upload_start")
+        if (method == "PATCH") != (file_id is not None):
+            raise DriveError(400, "badRequest", f"Can't upload with {method}.")
+        total = headers.get("x-upload-content-length")
+        with self._lock:
+            if file_id and file_id not in self._files:
+                raise DriveError(404, "notFound", f"File not found: {file_id}.")
+            self._next_id += 1
+            upload_id = f"upload{self._next_id:08d}"
+            self._sessions[upload_id] = {
+                "file_id": file_id,
+                "metadata": _json_body(body),
+                "mime_type": headers.get("x-upload-content-type"),
+                "total": int(total) if total else None,
+                "data": bytearray(),
+            }
+        location = f"{base_url}/upload/drive/v3/files?uploadType=resumable&upload_id={upload_id}"
+        return 200, {"location": location}, b""
+
+    def _upload_chunk(self, upload_id: str, headers: dict, body: bytes) -> tuple:
+        self._count("upload_chunk")
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            if session is None:
+                raise DriveError(404, "notFound", "Upload session expired.")
+            data = session["data"]
+            content_range = headers.get("content-range", "")
+            match = re.fullmatch(r"bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)", content_range)
+            if content_range and not match:
+                raise DriveError(400, "badRequest", f"Bad Content-Range: {content_range}")
+            if match and match.group(3) != "*":
+                session["total"] = int(match.group(3))
+            if not content_range:
+                # Only an empty file is sent without a range.
+                session["total"] = 0
+            elif match.group(1) is not None and int(match.group(1)) == len(data):
+                data += body
+            if session["total"] is not None and len(data) >= session["total"]:
+                del self._sessions[upload_id]
+                if session["file_id"]:
+                    file = self._update(session["file_id"], session["metadata"], {}, bytes(data))
+                else:
+                    file = self._create(session["metadata"], bytes(data), session["mime_type"])
+                return _json_response(file)
+            received = len(data)
+        return 308, {"range": f"bytes=0-{received - 1}"} if received else {}, b""
+
+    def _batch(self, headers: dict, body: bytes) -> tuple:
+        content_type = headers.get("content-type", "")
+        message = message_from_string(
+            f"Content-Type: {content_type}\r\n\r\n" + body.decode("utf-8")
+        )
+        if not message.is_multipart():
+            return DriveError(400, "badRequest", "Batch body isn't multipart.").response()
+
+        boundary = f"batch_{uuid.uuid4().hex}"
+        parts = []
+        for part in message.get_payload():
+            status, part_headers, part_body = self._batch_call(part.get_payload())
+            lines = [
+                f"--{boundary}",
+                "Content-Type: application/http",
+                f"Content-ID: <response-{part['Content-ID'][1:-1]}>",
+                "",
+                f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+                f"Content-Type: {part_headers.get('content-type', 'application/json')}",
+                f"Content-Length: {len(part_body)}",
+                "",
+                part_body.decode("utf-8"),
+            ]
+            parts.append("\r\n".join(lines))
+        text = "\r\n".join(parts) + f"\r\n--{boundary}--\r\n"
+        return 200, {"content-type": f"multipart/mixed; boundary={boundary}"}, text.encode("utf-8")
+
+    def _batch_call(self, payload: str) -> tuple:
+        request_line, rest = payload.split("\n", 1)
+        method, target, _ = request_line.strip().split(" ", 2)
+        blank_line = re.search(r"\r?\n\r?\n", rest)
+        header_text, body = (
+            (rest[: blank_line.start()], rest[blank_line.end() :]) if blank_line else (rest, "")
+        )
+        headers = {}
+        for line in header_text.splitlines():
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        path, query = _split_target(target)
+        if path.startswith("/upload/"):
+            return DriveError(400, "badRequest", "Media can't be batched.").response()
+        return self._call(method, path, query, headers, body.encode("utf-8"), "")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes, which Nagle plus delayed
+    # ACKs would hold up by tens of milliseconds per request.
+    disable_nagle_algorithm = True
+
+    def _serve(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        headers = {name.lower(): value for name, value in self.headers.items()}
+        status, response_headers, response_body = self.server.drive.handle(
+            self.command, self.path, headers, body, self.server.url
+        )
+        self.send_response(status, STATUS_TEXT.get(status))
+        for name, value in response_headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _serve
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeDriveServer:
+    """Runs a `FakeDrive` on a free localhost port, in background threads.
+
+        with FakeDriveServer(latency=0.05) as server:
+            service = build("drive", "v3", http=LocalHttp(server.url), static_discovery=True)
+    """
+
+    def __init__(self, drive: FakeDrive = None, **options):
+        """
+        Args:
+            options: Passed on to `FakeDrive` when `drive` isn't given.
+        """
+        self.drive = drive or FakeDrive(**options)
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.drive = self.drive
+        self.url = self._server.url = f"http://127.0.0.1:{self._server.server_port}"
+        self._thread = None
+
+    def start(self) -> "FakeDriveServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self) -> "FakeDriveServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+class LocalHttp(httplib2.Http):
+    """An httplib2.Http that sends requests meant for Google's API endpoint
+    to `base_url` instead."""
+
+    def __init__(self, base_url: str):
+        super().__init__(timeout=HTTP_TIMEOUT)
+        self.base_url = base_url.rstrip("/") + "/"
+        # Drive uses 308 for incomplete resumable uploads, not as a redirect.
+        self.redirect_codes = self.redirect_codes - {308}
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        if uri.startswith(DRIVE_ROOT_URL):
+            uri = self.base_url + uri[len(DRIVE_ROOT_URL) :]
+        return super().request(uri, method, body, headers, *args, **kwargs)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def _json_response(body: dict, status: int = 200) -> tuple:
+    return status, {"content-type": "application/json; charset=UTF-8"}, json.dumps(body).encode("utf-8")
+
+
+def _json_body(body: bytes) -> dict:
+    if not body or not body.strip():
+        return {}
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise DriveError(400, "parseError", "Request body isn't JSON.")
+
+
+def _split_target(target: str) -> tuple:
+    parts = urllib.parse.urlsplit(target)
+    return parts.path, dict(urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+
+
+def _file_id(path: str, prefix: str) -> str:
+    rest = path[len(prefix) :].strip("/")
+    return urllib.parse.unquote(rest) if rest else None
+
+
+def _parse_query(q: str) -> list:
+    """Turns the q parameter into a list of predicates on file metadata.
+    Only the conjunctions GDrive builds are understood."""
+    matches = []
+    position = 0
+    while position < len(q):
+        clause = QUERY_CLAUSE.match(q, position)
+        if not clause or clause.end() == position:
+            raise DriveError(400, "invalid", f"Invalid Value: q={q}")
+        position = clause.end()
+        if clause.group("name") is not None:
+            name = re.sub(r"\\(.)", r"\1", clause.group("name"))
+            matches.append(lambda file, name=name: file["name"] == name)
+        elif clause.group("parent"):
+            parent = ROOT_ID if clause.group("parent") == "root" else clause.group("parent")
+            matches.append(lambda file, parent=parent: parent in file["parents"])
+        elif clause.group("mime_type") is not None:
+            mime_type, negate = clause.group("mime_type"), bool(clause.group("negate"))
+            matches.append(
+                lambda file, mime_type=mime_type, negate=negate: (file["mimeType"] == mime_type)
+                != negate
+            )
+    return matches
+
+
+def _parse_upload(headers: dict, body: bytes) -> tuple:
+    """Splits a multipart/related upload into (metadata, content, mime type).
+    A simple upload is all content."""
+    content_type = headers.get("content-type", "application/octet-stream")
+    match = re.search(r'boundary="?([^";]+)"?', content_type)
+    if not content_type.startswith("multipart/related") or not match:
+        return {}, body, content_type
+
+    delimiter = b"--" + match.group(1).encode("ascii")
+    parts = []
+    for chunk in body.split(delimiter)[1:]:
+        if chunk.startswith(b"--"):
+            break
+        chunk = chunk.removeprefix(b"\r\n").removeprefix(b"\n")
+        blank_line = re.search(rb"\r?\n\r?\n", chunk)
+        if not blank_line:
+            raise DriveError(400, "badRequest", "Malformed multipart upload.")
+        head, payload = chunk[: blank_line.start()], chunk[blank_line.end() :]
+        # The line break before the next delimiter belongs to the delimiter.
+        # The client library writes bare newlines, a CR before it is content.
+        payload = payload.removesuffix(b"\n")
+        part_type = re.search(rb"(?im)^content-type:\s*([^\r\n;]+)", head)
+        parts.append((part_type.group(1).decode() if part_type else None, payload))
+    if len(parts) != 2:
+        raise DriveError(400, "badRequest", "Multipart upload needs metadata and media.")
+    return _json_body(parts[0][1]), parts[1][1], parts[1][0]
@@ -0,0 +1,120 @@
+"""Generators for synthetic save folders.
+
+Contents come from a seeded random generator, so the same arguments always
+give the same tree, byte for byte, and nothing compresses or deduplicates
+better than real saves would.
+"""
+import os
+import random
+import hashlib
+from pathlib import Path
+
+KB = 1024
+MB = 1024 * KB
+# Changed files bigger than this only get a region of this size rewritten,
+# the way games update part of a big save in place.
+REWRITE_REGION = 1 * MB
+NOISE_NAMES = ("Cache", "Logs", "Shaders", "CrashDumps", "Config", "Temp", "Mods")
+
+
+def write_file(path: Path, size: int, rng: random.Random) -> None:
+    os.makedirs(path.parent, exist_ok=True)
+    with open(path, "wb") as f:
+        left = size
+        while left:
+            block = min(left, 4 * MB)
+            f.write(rng.randbytes(block))
+            left -= block
+
+
+def tiny_files(root: Path, count: int = 1000, dirs: int = 20, seed: int = 1) -> Path:
+    """Many small files spread over a few folders, like a game that keeps
+    one file per level, character or setting."""
+    rng = random.Random(seed)
+    for i in range(count):
+        folder = root / f"slot{i % dirs:02d}" if dirs else root
+        write_file(folder / f"state{i:05d}.dat", rng.randint(64, 4 * KB), rng)
+    return root
+
+
+def huge_files(root: Path, count: int = 2, size: int = 32 * MB, seed: int = 2) -> Path:
+    """A few big files, like world saves, plus the small files next to them."""
+    rng = random.Random(seed)
+    for i in range(count):
+        write_file(root / f"world{i}.sav", size, rng)
+        write_file(root / f"world{i}.meta", rng.randint(256, 2 * KB), rng)
+    return root
+
+
+def deep_tree(
+    root: Path, branches: int = 8, depth: int = 12, files_per_dir: int = 2, seed: int = 3
+) -> Path:
+    """Chains of nested folders, which need one round of folder creation
+    per level."""
+    rng = random.Random(seed)
+    for branch in range(branches):
+        folder = root / f"profile{branch}"
+        for level in range(depth):
+            for i in range(files_per_dir):
+                write_file(folder / f"data{i}.bin", rng.randint(512, 16 * KB), rng)
+            folder = folder / f"level{level + 1}"
+    return root
+
+
+def appdata_tree(root: Path, games: int = 200, noise: int = 20, seed: int = 4) -> Path:
+    """Something for discovery to search: game folders holding a save
+    folder, under publisher folders, among folders without saves."""
+    rng = random.Random(seed)
+    for i in range(games):
+        game = root / f"Publisher{i % 25:02d}" / f"Game {i:03d}"
+        write_file(game / rng.choice(("Saves", "SaveGames", "saved")) / "slot1.sav", 256, rng)
+        for name in rng.sample(NOISE_NAMES, 2):
+            write_file(game / name / "file.txt", 64, rng)
+    for i in range(games * noise // 10):
+        folder = root / f"Tool{i % 50:02d}"
+        for level in range(rng.randint(1, 6)):
+            folder = folder / rng.choice(NOISE_NAMES)
+        write_file(folder / f"entry{i}.log", 64, rng)
+    return root
+
+
+def mutate(root: Path, fraction: float = 0.05, added: int = 2, removed: int = 1, seed: int = 5) -> dict:
+    """Changes a tree the way a play session would: rewrites part of some
+    files, adds a few and deletes a few.
+
+    Returns:
+        dict: How many files were "changed", "added" and "removed".
+    """
+    rng = random.Random(seed)
+    files = sorted(path for path in Path(root).rglob("*") if path.is_file())
+    changed = rng.sample(files, max(1, int(len(files) * fraction)))
+    for path in changed:
+        size = path.stat().st_size
+        if size <= REWRITE_REGION:
+            write_file(path, size, rng)
+            continue
+        with open(path, "r+b") as f:
+            f.seek(rng.randrange(0, size - REWRITE_REGION))
+            f.write(rng.randbytes(REWRITE_REGION))
+
+    doomed = rng.sample([path for path in files if path not in changed], removed)
+    for path in doomed:
+        path.unlink()
+    for i in range(added):
+        parent = rng.choice(files).parent
+        write_file(parent / f"new{seed}_{i}.dat", rng.randint(64, 4 * KB), rng)
+    return {"changed": len(changed), "added": added, "removed": len(doomed)}
+
+
+def tree_digest(root: Path) -> dict:
+    """Relative path -> md5 of every file under `root`."""
+    root = Path(root)
+    digests = {}
+    for path in root.rglob("*"):
+        if path.is_file():
+            md5 = hashlib.md5()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(MB), b""):
+                    md5.update(block)
+            digests[path.relative_to(root).as_posix()] = md5.hexdigest()
+    return digests
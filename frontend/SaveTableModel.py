@@ -1,27 +1,44 @@
 from PyQt6 import QtCore
 from PyQt6.QtCore import QModelIndex, QObject, Qt
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path[0] += "\\.."
-from backend.file_discovery import *
-from backend.utilities import *
 from backend.GDrive import GDrive
+from backend.registry import SaveRegistry
+from backend.status import game_status, format_size
 import pathlib
 
 
 COL_GAME_NAME = 0
 COL_SAVE_LOCATION = 1
+COL_LAST_BACKUP = 2
+COL_SIZE = 3
+COL_SYNC_STATE = 4
+STATUS_COLUMNS = (COL_LAST_BACKUP, COL_SIZE, COL_SYNC_STATE)
+# Role the sort proxy sorts by: lowercase text, or numbers for sizes and times.
+SORT_ROLE = Qt.ItemDataRole.UserRole
+STATUS_WORKERS = 2
 
 
 class SaveTableModel(QtCore.QAbstractTableModel):
-    cellDataChanged = QtCore.pyqtSignal(int)
+    statusReady = QtCore.pyqtSignal(str, dict)
 
     def __init__(self, parent: QObject | None) -> None:
         super().__init__(parent)
-        self._raw_data = load_from_json(DISCOVERED_FOLDERS_PATH)
+        self.registry = SaveRegistry()
+        self._raw_data = self.registry.saves()
         self._data = self.__format_data(self._raw_data)
-        self._headers = ["Game Name", "Save Location"]
+        self._rows = self.__index_rows(self._data)
+        self._headers = ["Game Name", "Save Location", "Last Backup", "Size", "Sync State"]
         self._checkboxes = [True] * len(self._data)
+        # Status columns are filled in the background, and only for rows the
+        # view actually asks for.
+        self._status = {}
+        self._status_requested = set()
+        self._status_pool = ThreadPoolExecutor(STATUS_WORKERS)
+        self.statusReady.connect(self._store_status)
         self.g_drive = GDrive()
 
     def columnCount(self, parent: QModelIndex) -> int:
@@ -45,9 +62,15 @@ class SaveTableModel(QtCore.QAbstractTableModel):
         row = index.row()
         column = index.column()
 
+        if column in STATUS_COLUMNS:
+            return self._status_data(row, column, role)
+
         if role == Qt.ItemDataRole.DisplayRole or role == Qt.ItemDataRole.EditRole:
             return self._data[row][column]
 
+        if role == SORT_ROLE:
+            return self._data[row][column].lower()
+
         if role == Qt.ItemDataRole.CheckStateRole:
             if column == 0:
                 return (
@@ -74,12 +97,20 @@ class SaveTableModel(QtCore.QAbstractTableModel):
         if role == QtCore.Qt.ItemDataRole.EditRole:
             if not value.strip():
                 return False
-            self._update_underlying_data(index, value)
+            old_name = self._data[row][COL_GAME_NAME]
+            if not self._update_underlying_data(index, value):
+                return False
             self._data[row][col] = (
                 value if col == COL_GAME_NAME else str(pathlib.Path(value))
             )
+            if col == COL_GAME_NAME:
+                del self._rows[old_name]
+                self._rows[value] = row
+            self._forget_status(old_name)
             self.dataChanged.emit(index, index, [role])
-            self.cellDataChanged.emit(col)
+            self.dataChanged.emit(
+                self.index(row, STATUS_COLUMNS[0]), self.index(row, STATUS_COLUMNS[-1])
+            )
             return True
 
         if role == Qt.ItemDataRole.CheckStateRole:
@@ -116,20 +147,98 @@ class SaveTableModel(QtCore.QAbstractTableModel):
         data = [[game_name, save_location] for game_name, save_location in data.items()]
         return data
 
+    def __index_rows(self, data: list) -> dict:
+        return {row[COL_GAME_NAME]: i for i, row in enumerate(data)}
+
     def close_gdrive_service(self):
-        self.g_drive.drive_service.close()
+        self._status_pool.shutdown(wait=False, cancel_futures=True)
+        self.g_drive.close()
 
     def update_saves(self):
-        self._raw_data = load_from_json(DISCOVERED_FOLDERS_PATH)
+        self.beginResetModel()
+        self._raw_data = self.registry.saves()
         self._data = self.__format_data(self._raw_data)
+        self._rows = self.__index_rows(self._data)
         self._checkboxes = [False] * len(self._data)
+        self._status = {}
+        self._status_requested = set()
+        self.endResetModel()
+
+    def add_discovered_row(self, game_name: str, save_location: str) -> None:
+        """Appends a row found by discovery, which has already registered it."""
+        if game_name in self._raw_data:
+            return
+        self._append_row(game_name, save_location, False)
+
+    def _append_row(self, game_name: str, save_location: str, checked: bool) -> None:
+        row = len(self._data)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._raw_data[game_name] = save_location
+        self._data.append([game_name, save_location])
+        self._rows[game_name] = row
+        self._checkboxes.append(checked)
+        self.endInsertRows()
+
+    def _status_data(self, row: int, column: int, role: Qt.ItemDataRole):
+        if role not in (Qt.ItemDataRole.DisplayRole, SORT_ROLE):
+            return None
+        game_name, save_location = self._data[row]
+        status = self._status.get(game_name)
+        if status is None:
+            self._request_status(game_name, save_location)
+            return "..." if role == Qt.ItemDataRole.DisplayRole else None
+
+        if column == COL_LAST_BACKUP:
+            last_backup = status["last_backup"]
+            if role == SORT_ROLE:
+                return last_backup or 0.0
+            return time.strftime("%Y-%m-%d %H:%M", time.localtime(last_backup)) if last_backup else "Never"
+        if column == COL_SIZE:
+            if role == SORT_ROLE:
+                return -1 if status["size"] is None else status["size"]
+            return "" if status["size"] is None else format_size(status["size"])
+        return status["state"]
+
+    def _request_status(self, game_name: str, save_location: str) -> None:
+        if game_name in self._status_requested:
+            return
+        self._status_requested.add(game_name)
+        self._status_pool.submit(self._load_status, game_name, save_location)
+
+    def _load_status(self, game_name: str, save_location: str) -> None:
+        """Runs on the status pool, walks the save folder and reads the
+        registry."""
+        try:
+            status = game_status(game_name, save_location, self.registry)
+        except Exception as e:
+            status = {"state": f"Error: {e}", "size": None, "files": 0, "last_backup": None}
+        self.statusReady.emit(game_name, status)
+
+    def _store_status(self, game_name: str, status: dict) -> None:
+        if game_name not in self._status_requested:
+            # Forgotten while it was being worked out, it's out of date.
+            return
+        self._status[game_name] = status
+        row = self._rows.get(game_name)
+        if row is not None:
+            self.dataChanged.emit(
+                self.index(row, STATUS_COLUMNS[0]), self.index(row, STATUS_COLUMNS[-1])
+            )
 
-    def sort(self, column: int, order: Qt.SortOrder) -> None:
-        if order == Qt.SortOrder.AscendingOrder:
-            self._data.sort(key=lambda x: x[column].lower())
-        else:
-            self._data.sort(key=lambda x: x[column].lower(), reverse=True)
-        self.layoutChanged.emit()
+    def _forget_status(self, game_name: str) -> None:
+        self._status.pop(game_name, None)
+        self._status_requested.discard(game_name)
+
+    def invalidate_status(self) -> None:
+        """Drops every cached status, e.g. after an upload. Visible rows are
+        worked out again as the view repaints them."""
+        self._status = {}
+        self._status_requested = set()
+        if self._data:
+            self.dataChanged.emit(
+                self.index(0, STATUS_COLUMNS[0]),
+                self.index(len(self._data) - 1, STATUS_COLUMNS[-1]),
+            )
 
     def flags(self, index: QModelIndex):
         if not index.isValid():
@@ -147,35 +256,46 @@ class SaveTableModel(QtCore.QAbstractTableModel):
                 QtCore.Qt.ItemFlag.ItemIsEnabled | QtCore.Qt.ItemFlag.ItemIsSelectable
             )
 
-    def add_row(self, game_name: str, save_location: str, index) -> bool:
-        if game_name and save_location and not self._raw_data.get(game_name):
-            self._raw_data[game_name] = save_location
-            save_to_json(self._raw_data, DISCOVERED_FOLDERS_PATH)
-            self._data.append([game_name, save_location])
-            self.dataChanged.emit(index, index, [Qt.ItemDataRole.EditRole])
-            self.cellDataChanged.emit(COL_GAME_NAME)
-            self.layoutChanged.emit()
-
+    def add_row(self, game_name: str, save_location: str) -> bool:
+        if (
+            game_name
+            and save_location
+            and not self._raw_data.get(game_name)
+            and self.registry.add_save(game_name, save_location)
+        ):
+            self._append_row(game_name, save_location, True)
             return True
         return False
 
-    def delete_row(self, index: QModelIndex, role: Qt.ItemDataRole) -> bool:
+    def delete_row(self, index: QModelIndex) -> None:
         row = index.row()
+        game_name = self._data[row][COL_GAME_NAME]
+        self.registry.remove(game_name)
 
-        del self._raw_data[self._data[row][COL_GAME_NAME]]
-        save_to_json(self._raw_data, DISCOVERED_FOLDERS_PATH)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._raw_data[game_name]
         del self._data[row]
+        del self._checkboxes[row]
+        self._forget_status(game_name)
+        self._rows = self.__index_rows(self._data)
+        self.endRemoveRows()
 
-        self.dataChanged.emit(index, index, [role])
-        self.layoutChanged.emit()
-
-    def begin_upload(self, game_name: str, location: str):  
-        self.g_drive.upload_files(location, game_name)
+    def begin_upload(
+        self, save_list: list, progress_callback, token, transfer_callback=None
+    ):
+        self.g_drive.upload_games(
+            save_list, progress_callback, token, transfer_callback=transfer_callback
+        )
 
 
     def select_all(self, isChecked: bool) -> bool:
         self._checkboxes = [isChecked] * len(self._data)
-        self.layoutChanged.emit()
+        if self._data:
+            self.dataChanged.emit(
+                self.index(0, COL_GAME_NAME),
+                self.index(len(self._data) - 1, COL_GAME_NAME),
+                [Qt.ItemDataRole.CheckStateRole],
+            )
 
 
     def retrieve_selected_data(self):
@@ -183,12 +303,11 @@ class SaveTableModel(QtCore.QAbstractTableModel):
 
     def _update_underlying_data(self, index: QModelIndex, new_data: str) -> bool:
         """
-        Update the underlying data and save it to a JSON file.
+        Update the underlying data and save it to the registry.
 
         Returns:
-            bool: True if the update was successful, False otherwise.
-
-        TODO: make this work for deleting and adding new rows as well.
+            bool: True if the update was successful, False otherwise (the new
+                name or location is already taken by another game).
         """
 
         row = index.row()
@@ -198,11 +317,14 @@ class SaveTableModel(QtCore.QAbstractTableModel):
         save_location = self._data[row][COL_SAVE_LOCATION]
 
         if col == COL_GAME_NAME:
+            if not self.registry.rename(game_name, new_data):
+                return False
             del self._raw_data[game_name]
             self._raw_data[new_data] = save_location
         else:
-            self._raw_data[game_name] = str(pathlib.Path(new_data))
-
-        save_to_json(self._raw_data, DISCOVERED_FOLDERS_PATH)
+            new_location = str(pathlib.Path(new_data))
+            if not self.registry.set_path(game_name, new_location):
+                return False
+            self._raw_data[game_name] = new_location
 
         return True
\ No newline at end of file
@@ -1,16 +1,19 @@
 import typing
-from SaveTableModel import SaveTableModel
+from SaveTableModel import SaveTableModel, SORT_ROLE, COL_GAME_NAME, COL_SAVE_LOCATION
 import sys
 sys.path[0] += '\\..'
 import pathlib
 from backend.file_discovery import start_discovery
+from backend.transfer import CancelToken
 from PyQt6 import QtCore, QtGui, QtWidgets, uic
-from PyQt6.QtCore import Qt, QModelIndex, QThread
-from PyQt6.QtGui import QCursor
+from PyQt6.QtCore import Qt, QModelIndex, QThread, QSortFilterProxyModel
 from PyQt6.QtWidgets import QMessageBox, QHeaderView, QProgressDialog
 import time
 
 qt_creator_file = "./frontend/application.ui"
+# Resolution of the upload progress bar, QProgressDialog values are 32-bit
+# so bytes can't be used directly.
+PROGRESS_STEPS = 1000
 Ui_MainWindow, QtBaseClass = uic.loadUiType(qt_creator_file)
 
 
@@ -21,18 +24,27 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.setupUi(self)
         header=CheckBoxHeader(parent=self.savesTableView)
         self.model = SaveTableModel(None)
-        self.savesTableView.setModel(self.model)
+        # Sorting and filtering happen in the proxy, the model keeps its rows
+        # in insertion order and only reports the rows that changed.
+        self.proxy = QSortFilterProxyModel(self)
+        self.proxy.setSourceModel(self.model)
+        self.proxy.setSortRole(SORT_ROLE)
+        self.proxy.setFilterKeyColumn(COL_GAME_NAME)
+        self.proxy.setFilterCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+        self.proxy.setDynamicSortFilter(True)
+        self.savesTableView.setModel(self.proxy)
         header.clicked.connect(self.model.select_all)
         self.savesTableView.setHorizontalHeader(header)
-        self.savesTableView.horizontalHeader().setSortIndicator(0, Qt.SortOrder.AscendingOrder)
+        self.savesTableView.sortByColumn(COL_GAME_NAME, Qt.SortOrder.AscendingOrder)
         
         self.update_view()
+        self.filter_edit.textChanged.connect(self.proxy.setFilterFixedString)
         self.discover_button.clicked.connect(self.discover)
         self.savesTableView.doubleClicked.connect(self.editFilePath)
-        self.model.cellDataChanged.connect(self.sort_by_column)
         self.remove_button.clicked.connect(self.remove_row)
         self.add_button.clicked.connect(self.add_row)
         self.upload_button.clicked.connect(self.upload_data)
+        self.pause_button.clicked.connect(self.toggle_pause)
 
         del_key = QtGui.QShortcut(QtGui.QKeySequence.StandardKey.Delete, self.savesTableView)
         del_key.activated.connect(self.remove_row)
@@ -48,28 +60,48 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
 
 
 
-    def __busy_cursor_decorator(func):
-        def wrapper(self):
-            """Wrapper to change cursor to busy cursor when process is running."""
-            self.setCursor(QCursor(Qt.CursorShape.WaitCursor))
-            func(self)
-            self.setCursor(QCursor(Qt.CursorShape.ArrowCursor))
-        return wrapper  
-
-
-    @__busy_cursor_decorator
     def discover(self):
-        """Method to link backend folder discovery method with frontend."""
-        start_discovery()
-        self.model.update_saves()
-        self.model.layoutChanged.emit()
-        self.sort_by_column(0)
+        """Runs folder discovery on a worker thread. Rows show up as saves are
+        found and the window stays usable meanwhile."""
+        self.discover_button.setDisabled(True)
+        self.found_count = 0
+        self.discovery_progress = self.create_progress_dialog()
+        self.discovery_progress.setWindowTitle('Discovering Saves')
+        self.discovery_progress.setRange(0, 0)
+        self.discovery_progress.setLabelText('Looking for save folders...')
+        self.discovery_progress.setWindowModality(Qt.WindowModality.NonModal)
+        self.discovery_progress.userCancel.disconnect(self.cancel_dialog)
+        self.discovery_progress.userCancel.connect(self.cancel_discovery)
+
+        self.discovery_thread = DiscoveryHelper()
+        self.discovery_thread.found_signal.connect(self.add_discovered_row)
+        self.discovery_thread.progress_signal.connect(self.update_discovery_progress)
+        self.discovery_thread.finished.connect(self.handle_discovery_finish)
+        self.discovery_progress.show()
+        self.discovery_thread.start()
+
+    def add_discovered_row(self, game_name: str, save_location: str):
+        self.found_count += 1
+        self.model.add_discovered_row(game_name, save_location)
+
+    def update_discovery_progress(self, scanned: int):
+        self.discovery_progress.setLabelText(
+            f'Looked through {scanned} folders, found {self.found_count} new saves...'
+        )
+
+    def cancel_discovery(self):
+        self.discovery_progress.setLabelText('Stopping discovery. Please wait.')
+        self.discovery_progress.setDisabled(True)
+        self.discovery_thread.handle_cancelation()
+
+    def handle_discovery_finish(self):
+        self.discovery_progress.close()
+        self.discover_button.setDisabled(False)
         self.update_view()
-        
+
 
     def update_view(self):
         self.savesTableView.resizeColumnsToContents()
-        self.savesTableView.resizeRowsToContents()
 
     def openFileDialog(self) -> str:
         file_dialog = QtWidgets.QFileDialog(self)
@@ -79,7 +111,8 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         return file_dialog
 
     def editFilePath(self, index: QModelIndex) -> bool:
-        if index.column() == 1:
+        index = self.proxy.mapToSource(index)
+        if index.column() == COL_SAVE_LOCATION:
 
             file_dialog = self.openFileDialog()
 
@@ -94,12 +127,6 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
                 self.model.setData(index, selected_path, role)
                 self.update_view()
 
-    def sort_by_column(self, column: int, sortOrder: Qt.SortOrder = None) -> None:
-        if not sortOrder:
-            header = self.savesTableView.horizontalHeader()
-            sortOrder = header.sortIndicatorOrder()
-        self.model.sort(column, sortOrder)
-
     def upload_data(self):
         
         save_list = self.model.retrieve_selected_data()
@@ -127,6 +154,7 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         upload_thread = UploadHelper(self.model.begin_upload)
         upload_thread.started.connect(self.handle_thread_start)
         upload_thread.update_signal.connect(self.update_dialog)
+        upload_thread.transfer_signal.connect(self.update_transfer)
         upload_thread.finished.connect(self.handle_thread_finish)
         upload_thread.set_save_list(save_list)    
 
@@ -140,8 +168,20 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         return progress
 
     def update_dialog(self, value: int, label: str):
-        self.progress.setLabelText(f"Uploading {label}...")
-        self.progress.setValue(value)
+        self.games_completed = value
+        self.progress.setLabelText(
+            f"Uploading {label}... ({value} of {len(self.upload_thread.save_list)} games)"
+        )
+
+    def update_transfer(self, report):
+        if not self.progress.isEnabled() or self.upload_thread.token.paused:
+            # Keep the "please wait" or "paused" text.
+            return
+        self.progress.setLabelText(
+            f"Uploading {report.game_name}... "
+            f"({self.games_completed} of {len(self.upload_thread.save_list)} games)\n{report}"
+        )
+        self.progress.setValue(int(report.fraction * PROGRESS_STEPS))
 
     def cancel_dialog(self):
         if self.upload_thread.isRunning():
@@ -149,49 +189,70 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
             self.progress.setLabelText(f"Finishing {label_text[0].lower() + label_text[1:]}. Please wait.")
             self.progress.setCancelButtonText("Please Wait.")
             self.progress.setDisabled(True)
+            self.pause_button.setDisabled(True)
             self.upload_thread.handle_cancelation()
             self.upload_thread.quit()
-            
+
+    def toggle_pause(self):
+        token = self.upload_thread.token
+        if token.paused:
+            token.resume()
+            self.pause_button.setText('Pause Upload')
+            self.progress.setLabelText('Resuming upload...')
+        else:
+            token.pause()
+            self.pause_button.setText('Resume Upload')
+            self.progress.setLabelText(
+                'Upload paused. Transfers stop after their current chunk.'
+            )
+
 
     def handle_thread_start(self):
-        num_files = len(self.upload_thread.save_list)
+        self.games_completed = 0
         self.progress.setMinimum(0)
-        self.progress.setMaximum(num_files)
+        self.progress.setMaximum(PROGRESS_STEPS)
         self.progress.setWindowTitle('Uploading Saves')
         self.progress.setMinimumDuration(0)
-        self.progress.setWindowModality(Qt.WindowModality.WindowModal)
+        # Not modal, so the pause button stays usable.
+        self.progress.setWindowModality(Qt.WindowModality.NonModal)
+        self.upload_button.setDisabled(True)
+        self.pause_button.setText('Pause Upload')
+        self.pause_button.setDisabled(False)
         self.progress.setValue(0)
         self.progress.setLabelText("Uploading saves...")
         self.progress.show()
         
     def handle_thread_finish(self):
+        self.progress.setValue(PROGRESS_STEPS)
         self.progress.close()
+        self.upload_button.setDisabled(False)
+        self.pause_button.setDisabled(True)
+        self.model.invalidate_status()
 
     def remove_row(self):
         index = self.savesTableView.currentIndex()
         
         if index.row() == -1:
-            index = self.model.index(self.model.rowCount(index) - 1, 0)    
-        if index.column() != 0:
-            index = index.siblingAtColumn(0)
+            index = self.proxy.index(self.proxy.rowCount() - 1, COL_GAME_NAME)
+        if not index.isValid():
+            return
+        index = self.proxy.mapToSource(index.siblingAtColumn(COL_GAME_NAME))
 
         game_name = index.data(Qt.ItemDataRole.EditRole)
 
         self.confirmation_box.setText(f"Are you sure you want stop tracking saves for {game_name}?")
         confirmation_choice = self.confirmation_box.exec()
         if confirmation_choice == QMessageBox.StandardButton.Yes:
-            role = Qt.ItemDataRole.EditRole
-            self.model.delete_row(index, role)
+            self.model.delete_row(index)
 
     def add_row(self):
         file_dialog = self.openFileDialog()
         path = pathlib.Path(file_dialog.getExistingDirectory(self, "Select Directory"))
         input_message = QtWidgets.QInputDialog()
         game_name = input_message.getText(self, 'Game Name', 'Choose Game Name')
-        index = self.savesTableView.currentIndex()
         if game_name[1]:
         
-            self.model.add_row(game_name[0], str(path), index)
+            self.model.add_row(game_name[0], str(path))
 
 class CleanupProcessingProgressDialog(QProgressDialog):
     userCancel = QtCore.pyqtSignal()
@@ -213,28 +274,47 @@ class CleanupProcessingProgressDialog(QProgressDialog):
 
 class UploadHelper(QThread):
     update_signal = QtCore.pyqtSignal(int, str)
+    transfer_signal = QtCore.pyqtSignal(object)
 
     def __init__(self, upload_function, save_list: list = None):
         super().__init__()
         self.upload_function = upload_function
         self.save_list = save_list
-        self.canceled = False
+        self.token = CancelToken()
         
     def handle_cancelation(self):
-        self.canceled = True
+        self.token.cancel()
 
     def run(self):
-        for i, (game_name, location) in enumerate(self.save_list):
-            if self.canceled:
-                break
-            self.update_signal.emit(i, game_name)
-            self.upload_function(game_name, location)
+        self.upload_function(
+            self.save_list,
+            self.update_signal.emit,
+            self.token,
+            self.transfer_signal.emit,
+        )
         self.update_signal.emit(len(self.save_list), 'Finished!')
-        self.canceled = False
         
     def set_save_list(self, save_list: list):
         self.save_list = save_list
 
+class DiscoveryHelper(QThread):
+    found_signal = QtCore.pyqtSignal(str, str)
+    progress_signal = QtCore.pyqtSignal(int)
+
+    def __init__(self):
+        super().__init__()
+        self.canceled = False
+
+    def handle_cancelation(self):
+        self.canceled = True
+
+    def run(self):
+        start_discovery(
+            on_found=self.found_signal.emit,
+            progress_callback=self.progress_signal.emit,
+            should_stop=lambda: self.canceled,
+        )
+
 class CheckBoxHeader(QHeaderView):
     ''' Class to add a header checkbox to the first column of horizontal header.
         Modified from https://stackoverflow.com/questions/30932528/adding-checkbox-as-vertical-header-in-qtableview/30934160#30934160
@@ -261,6 +341,10 @@ class CheckBoxHeader(QHeaderView):
             self.style().drawControl(QtWidgets.QStyle.ControlElement.CE_CheckBox,option,painter)
 
     def mousePressEvent(self,event):
+        if self.logicalIndexAt(event.position().toPoint()) != 0 or event.position().x() > 23:
+            # Anywhere but the checkbox sorts as usual.
+            super(CheckBoxHeader,self).mousePressEvent(event)
+            return
         if self.isChecked:
             self.isChecked=False
         else:
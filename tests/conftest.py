@@ -0,0 +1,45 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Runs every test in an empty application directory. The backend keeps
+    its registry, caches and logs relative to the working directory."""
+    os.makedirs(tmp_path / "data")
+    os.makedirs(tmp_path / "logs")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def fake_drive():
+    """The Drive behind `drive`. Override it to make Drive misbehave."""
+    from benchmarks.fake_drive import FakeDrive
+
+    return FakeDrive()
+
+
+@pytest.fixture
+def fake_server(fake_drive):
+    from benchmarks.fake_drive import FakeDriveServer
+
+    with FakeDriveServer(drive=fake_drive) as server:
+        yield server
+
+
+@pytest.fixture
+def drive(fake_server):
+    """A GDrive backed up to `fake_drive`, as the benchmarks use it."""
+    from benchmarks.__main__ import connect
+
+    drive = connect(fake_server.url, 2)
+    yield drive
+    drive.close()
@@ -0,0 +1,199 @@
+import json
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from backend import api_calls
+from backend.api_calls import (
+    ApiCaller,
+    AdaptiveConcurrency,
+    TokenBucket,
+    BACKOFF_BASE,
+    DECREASE_COOLDOWN,
+)
+from backend.game_settings import set_storage_mode
+from benchmarks.fake_drive import FakeDrive
+from benchmarks.save_trees import tiny_files, tree_digest
+
+
+class FakeTime:
+    """Stands in for the `time` module: sleeping only moves the clock."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    perf_counter = monotonic
+    time = monotonic
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(api_calls, "time", clock)
+    # Jitter always adds its most.
+    monkeypatch.setattr(api_calls.random, "uniform", lambda low, high: high)
+    return clock
+
+
+def http_error(status: int, reason: str = None, **headers) -> HttpError:
+    resp = httplib2.Response({"status": str(status), **headers})
+    errors = [{"reason": reason}] if reason else []
+    content = json.dumps({"error": {"code": status, "errors": errors}}).encode()
+    return HttpError(resp, content)
+
+
+class Failing:
+    """Raises `errors` one per call, then returns "done"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "done"
+
+
+def caller(**options) -> ApiCaller:
+    return ApiCaller(rate=1000.0, burst=1000, **options)
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        http_error(429),
+        http_error(403, "rateLimitExceeded"),
+        http_error(403, "userRateLimitExceeded"),
+        http_error(500),
+        http_error(503),
+        ConnectionResetError("reset"),
+        httplib2.ServerNotFoundError("offline"),
+    ],
+)
+def test_retries_throttling_and_transient_errors(clock, error):
+    func = Failing(error, error)
+    assert caller().call(func, method="list") == "done"
+    assert func.calls == 3
+    # Exponential backoff, the jitter adding up to half of it.
+    assert clock.sleeps == [BACKOFF_BASE, 2 * BACKOFF_BASE]
+
+
+@pytest.mark.parametrize(
+    "error", [http_error(400), http_error(404), http_error(403, "insufficientPermissions")]
+)
+def test_other_errors_are_raised_right_away(clock, error):
+    func = Failing(error)
+    with pytest.raises(HttpError):
+        caller().call(func, method="list")
+    assert func.calls == 1
+    assert clock.sleeps == []
+
+
+def test_retry_after_is_honored(clock):
+    func = Failing(http_error(429, **{"retry-after": "7"}))
+    assert caller().call(func, method="list") == "done"
+    assert clock.sleeps == [7 + BACKOFF_BASE]
+
+
+def test_gives_up_after_max_retries(clock):
+    func = Failing(*[http_error(503)] * 10)
+    with pytest.raises(HttpError):
+        caller(max_retries=3).call(func, method="list")
+    assert func.calls == 4
+    assert len(clock.sleeps) == 3
+
+
+def test_backoff_is_capped(clock):
+    assert api_calls.retry_delay(20) == api_calls.BACKOFF_CAP
+
+
+def test_retries_are_counted(clock):
+    api = caller()
+    api.call(Failing(http_error(429), http_error(500)), method="list")
+    counters = api.metrics._counters
+    assert counters[("api_calls", (("method", "list"),))] == 3
+    assert counters[("api_retries", (("method", "list"), ("reason", "throttled")))] == 1
+    assert counters[("api_retries", (("method", "list"), ("reason", "server_error")))] == 1
+
+
+def test_throttling_halves_concurrency_and_successes_restore_it(clock):
+    concurrency = AdaptiveConcurrency(8)
+    concurrency.acquire()
+    concurrency.release(throttled=True)
+    assert concurrency.limit == 4
+
+    # Requests in flight when throttling started count as the same signal.
+    concurrency.acquire()
+    concurrency.release(throttled=True)
+    assert concurrency.limit == 4
+    clock.now += DECREASE_COOLDOWN
+    concurrency.acquire()
+    concurrency.release(throttled=True)
+    assert concurrency.limit == 2
+
+    # Each run of `limit` successes adds one.
+    for expected in (3, 4, 5):
+        for _ in range(expected - 1):
+            concurrency.acquire()
+            concurrency.release()
+        assert concurrency.limit == expected
+    for _ in range(100):
+        concurrency.acquire()
+        concurrency.release()
+    assert concurrency.limit == 8
+
+
+def test_concurrency_never_drops_below_the_minimum(clock):
+    concurrency = AdaptiveConcurrency(2)
+    for _ in range(3):
+        concurrency.acquire()
+        concurrency.release(throttled=True)
+        clock.now += DECREASE_COOLDOWN
+    assert concurrency.limit == 1
+
+
+def test_token_bucket_allows_bursts_then_paces(clock):
+    bucket = TokenBucket(rate=10.0, burst=5)
+    for _ in range(5):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.1)]
+    # A batch waits for its whole share.
+    bucket.acquire(10)
+    assert clock.sleeps[-1] == pytest.approx(1.0)
+
+    clock.now += 60
+    bucket.acquire(5)
+    assert len(clock.sleeps) == 2
+
+
+@pytest.fixture
+def fake_drive():
+    # Throttles and fails a share of the calls.
+    return FakeDrive(error_rate=0.2, quota=50.0, seed=3)
+
+
+def test_backup_and_restore_through_throttling_and_errors(drive, fake_drive, workdir, monkeypatch):
+    monkeypatch.setattr(api_calls, "BACKOFF_BASE", 0.01)
+    saves = tiny_files(workdir / "saves", count=30, dirs=3)
+    set_storage_mode("Game", "files")
+    assert drive.upload_files(str(saves), "Game") == "completed"
+    restored = workdir / "restored"
+    assert drive.restore_game("Game", str(restored))
+    assert tree_digest(restored) == tree_digest(saves)
+
+    stats = fake_drive.stats()
+    assert stats["errors"] and stats["throttled"]
@@ -0,0 +1,115 @@
+import random
+import threading
+
+import pytest
+
+from backend import chunking
+from backend.chunking import (
+    iter_chunks,
+    chunkable,
+    ChunkRegistry,
+    MIN_CHUNK_SIZE,
+    MAX_CHUNK_SIZE,
+    SLOW_CHUNKING_MAX_FILE_SIZE,
+)
+
+MB = 1024 * 1024
+
+
+@pytest.fixture(params=["numpy", "python"])
+def hash_backend(request, monkeypatch):
+    """Runs a test with the numpy gear hash and with the plain loop."""
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(chunking, "numpy", None)
+    return request.param
+
+
+def random_file(path, size, seed=0):
+    data = random.Random(seed).randbytes(size)
+    path.write_bytes(data)
+    return data
+
+
+def test_chunks_rebuild_the_file(workdir, hash_backend):
+    data = random_file(workdir / "save.bin", 3 * MB + 12345)
+    chunks = list(iter_chunks(workdir / "save.bin"))
+    assert b"".join(chunks) == data
+    assert all(MIN_CHUNK_SIZE <= len(chunk) <= MAX_CHUNK_SIZE for chunk in chunks[:-1])
+    assert len(chunks) > 3
+
+
+def test_small_and_empty_files(workdir, hash_backend):
+    random_file(workdir / "small.bin", 100)
+    (workdir / "empty.bin").write_bytes(b"")
+    assert [len(chunk) for chunk in iter_chunks(workdir / "small.bin")] == [100]
+    assert list(iter_chunks(workdir / "empty.bin")) == []
+
+
+def test_uniform_data_is_cut_at_the_maximum(workdir, hash_backend):
+    (workdir / "zeros.bin").write_bytes(bytes(2 * MAX_CHUNK_SIZE + 5))
+    sizes = [len(chunk) for chunk in iter_chunks(workdir / "zeros.bin")]
+    assert sizes == [MAX_CHUNK_SIZE, MAX_CHUNK_SIZE, 5]
+
+
+def test_an_insert_only_changes_nearby_chunks(workdir, hash_backend):
+    data = random_file(workdir / "save.bin", 4 * MB)
+    before = list(iter_chunks(workdir / "save.bin"))
+    (workdir / "save.bin").write_bytes(data[: 2 * MB] + b"new bytes" + data[2 * MB :])
+    after = list(iter_chunks(workdir / "save.bin"))
+
+    assert len(set(before) - set(after)) <= 2
+    assert len(set(after) - set(before)) <= 2
+
+
+def test_numpy_finds_the_same_cuts(workdir, monkeypatch):
+    pytest.importorskip("numpy")
+    for seed in range(5):
+        random_file(workdir / "save.bin", 2 * MB + seed * 100_003, seed)
+        fast = [len(chunk) for chunk in iter_chunks(workdir / "save.bin")]
+        with monkeypatch.context() as patch:
+            patch.setattr(chunking, "numpy", None)
+            slow = [len(chunk) for chunk in iter_chunks(workdir / "save.bin")]
+        assert fast == slow
+
+
+def test_big_files_are_only_chunked_with_numpy(monkeypatch):
+    monkeypatch.setattr(chunking, "numpy", None)
+    assert chunkable(SLOW_CHUNKING_MAX_FILE_SIZE)
+    assert not chunkable(SLOW_CHUNKING_MAX_FILE_SIZE + 1)
+    monkeypatch.setattr(chunking, "numpy", object())
+    assert chunkable(SLOW_CHUNKING_MAX_FILE_SIZE + 1)
+
+
+def test_registry_claims_each_digest_once():
+    registry = ChunkRegistry(["stored"])
+    assert not registry.claim("stored")
+    assert registry.wait("stored")
+    assert registry.claim("new")
+    assert not registry.claim("new")
+    registry.release("new")
+    assert not registry.wait("new")
+    assert registry.claim("new")
+    registry.confirm("new")
+    assert not registry.claim("new")
+    assert registry.wait("new")
+
+
+@pytest.mark.parametrize("stored", [True, False])
+def test_registry_waits_for_claimed_uploads(stored):
+    registry = ChunkRegistry()
+    assert registry.claim("chunk")
+    assert not registry.claim("chunk")
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(registry.wait("chunk")))
+    waiter.start()
+    waiter.join(0.1)
+    assert waiter.is_alive()
+
+    if stored:
+        registry.confirm("chunk")
+    else:
+        registry.release("chunk")
+    waiter.join(5)
+    assert results == [stored]
@@ -0,0 +1,61 @@
+import pytest
+
+import backend.__main__ as cli
+from backend.registry import SaveRegistry
+from backend.game_settings import set_storage_mode
+from benchmarks.__main__ import connect
+from benchmarks.fake_drive import FakeDrive, DriveError
+from benchmarks.save_trees import tiny_files, tree_digest
+
+BROKEN = b"refused by Drive"
+
+
+class RefusingDrive(FakeDrive):
+    """Refuses every upload whose content holds BROKEN."""
+
+    def _create(self, metadata, content, mime_type):
+        if content and BROKEN in content:
+            raise DriveError(400, "badRequest", "Refused.")
+        return super()._create(metadata, content, mime_type)
+
+
+@pytest.fixture
+def fake_drive():
+    return RefusingDrive()
+
+
+@pytest.fixture
+def saves(fake_server, workdir, monkeypatch):
+    # Every command closes its drive, so each one gets a new one.
+    monkeypatch.setattr(cli, "connect", lambda: connect(fake_server.url, 2))
+    registry = SaveRegistry()
+    roots = {}
+    for game_name in ("A", "B"):
+        roots[game_name] = tiny_files(workdir / game_name, count=3, dirs=1)
+        registry.add_save(game_name, str(roots[game_name]))
+        set_storage_mode(game_name, "files")
+    return roots
+
+
+def test_backup_exits_zero_when_everything_is_stored(saves):
+    assert cli.main(["backup"]) == 0
+
+
+def test_backup_exits_non_zero_when_files_fail(saves, capsys):
+    (saves["B"] / "slot00" / "state00001.dat").write_bytes(BROKEN)
+    assert cli.main(["backup"]) == 1
+    assert "B (partial)" in capsys.readouterr().err
+
+    (saves["B"] / "slot00" / "state00001.dat").write_bytes(b"fine now")
+    assert cli.main(["backup", "B"]) == 0
+
+
+def test_restore_exit_status(saves, fake_drive, workdir):
+    assert cli.main(["backup"]) == 0
+    assert cli.main(["restore", "A", "--to", str(workdir / "restored")]) == 0
+    assert tree_digest(workdir / "restored") == tree_digest(saves["A"])
+
+    with fake_drive._lock:
+        for file_id, content in fake_drive._content.items():
+            fake_drive._content[file_id] = content + b"corrupt"
+    assert cli.main(["restore", "A", "--to", str(workdir / "corrupt")]) == 1
@@ -0,0 +1,75 @@
+import os
+import time
+
+from backend.file_discovery import DirectoryScanner
+from backend.discovery_cache import DiscoveryCache
+
+
+def age(root, hours: int = 1) -> None:
+    """Backdates every directory, listings of fresh ones aren't cached."""
+    old = time.time() // 3600 * 3600 - hours * 3600
+    for path, dirs, files in os.walk(root):
+        os.utime(path, (old, old))
+
+
+def save_folder(path) -> str:
+    os.makedirs(path)
+    (path / "slot.sav").write_bytes(b"save")
+    return str(path)
+
+
+def scan(workdir, root) -> tuple:
+    cache = DiscoveryCache(workdir / "cache.json")
+    found = DirectoryScanner(workers=2, cache=cache).scan([root])
+    cache.save()
+    return found, cache
+
+
+def tree(workdir):
+    root = workdir / "AppData"
+    for vendor in range(3):
+        for depth in range(4):
+            os.makedirs(root / f"Vendor{vendor}" / "Game" / "/".join(["sub"] * depth) / "x")
+    found = save_folder(root / "Vendor1" / "Game" / "Saves")
+    age(root)
+    return root, found
+
+
+def test_unchanged_tree_comes_from_the_cache(workdir):
+    root, found = tree(workdir)
+    first, cache = scan(workdir, root)
+    assert first == [("Game", found)]
+    assert cache.hits == 0
+    written = os.stat(workdir / "cache.json").st_mtime_ns
+
+    second, cache = scan(workdir, root)
+    assert second == first
+    assert cache.misses == 0 and cache.hits > 0
+    # Nothing changed, so the cache file isn't rewritten.
+    assert os.stat(workdir / "cache.json").st_mtime_ns == written
+
+
+def test_changes_deep_in_a_cached_tree_are_found(workdir):
+    root, found = tree(workdir)
+    scan(workdir, root)
+
+    deep = root / "Vendor2" / "Game" / "sub" / "sub" / "x"
+    new = save_folder(deep / "SaveData")
+    age(deep, hours=2)
+    second, cache = scan(workdir, root)
+    assert sorted(second) == sorted([("Game", found), ("x", new)])
+    assert cache.misses == 1
+
+    # The new listing was kept.
+    third, cache = scan(workdir, root)
+    assert sorted(third) == sorted(second)
+    assert cache.misses == 0
+
+
+def test_removed_folders_drop_out(workdir):
+    root, found = tree(workdir)
+    scan(workdir, root)
+    os.remove(os.path.join(found, "slot.sav"))
+    os.rmdir(found)
+    age(root / "Vendor1", hours=2)
+    assert scan(workdir, root)[0] == []
@@ -0,0 +1,43 @@
+import os
+from pathlib import Path
+
+from backend.file_discovery import DirectoryScanner, steam_search_roots
+from backend.steam import SteamApp
+
+
+def save_folder(path: Path) -> str:
+    os.makedirs(path, exist_ok=True)
+    (path / "slot1.sav").write_bytes(b"save")
+    return str(path)
+
+
+def scan(roots) -> list:
+    return DirectoryScanner(workers=2).scan(roots)
+
+
+def test_first_non_empty_save_folder_wins(workdir):
+    os.makedirs(workdir / "Game" / "SaveCache")
+    found = save_folder(workdir / "Game" / "Saves")
+    save_folder(workdir / "Game" / "Saves" / "Profiles" / "Saves")
+    assert scan([workdir]) == [("Game", found)]
+
+
+def test_empty_save_folder_doesnt_stop_the_search(workdir):
+    os.makedirs(workdir / "user" / "Saved Games")
+    found = save_folder(workdir / "user" / "AppData" / "Local" / "Game" / "Saves")
+    assert scan([workdir / "user"]) == [("Game", found)]
+
+
+def test_proton_prefix_folders_are_searched(workdir):
+    app = SteamApp("504230", "Celeste", "Celeste", workdir / "Library")
+    os.makedirs(app.install_path)
+    user = app.compat_user_path
+    os.makedirs(user / "Saved Games")
+    in_appdata = save_folder(user / "AppData" / "LocalLow" / "Studio" / "Celeste" / "Saves")
+
+    roots = steam_search_roots({workdir / "Steam": [app]})
+    assert scan(roots) == [("Celeste", in_appdata)]
+
+    # Saves in Saved Games are found too, after the AppData ones.
+    in_saved_games = save_folder(user / "Saved Games" / "Celeste" / "Saves")
+    assert scan(roots) == [("Celeste", in_appdata), ("Celeste", in_saved_games)]
@@ -0,0 +1,98 @@
+import os
+import json
+import hashlib
+
+import pytest
+
+from backend import hash_cache
+from backend.hash_cache import HashCache
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    """Paths md5_of_file actually read."""
+    read = []
+    md5_of_file = hash_cache.md5_of_file
+
+    def counting(path):
+        read.append(os.path.basename(path))
+        return md5_of_file(path)
+
+    monkeypatch.setattr(hash_cache, "md5_of_file", counting)
+    return read
+
+
+def replace(path, data: bytes) -> None:
+    """Saves the way many games do, by renaming a new file over the old one."""
+    temp = path.with_suffix(".tmp")
+    temp.write_bytes(data)
+    os.replace(temp, path)
+
+
+def test_unchanged_files_are_hashed_once(workdir, hashed):
+    path = workdir / "slot.sav"
+    path.write_bytes(b"save")
+    cache = HashCache(workdir / "cache.json")
+    assert cache.md5(str(path)) == hashlib.md5(b"save").hexdigest()
+    cache.save()
+
+    assert HashCache(workdir / "cache.json").md5(str(path)) == hashlib.md5(b"save").hexdigest()
+    assert hashed == ["slot.sav"]
+
+
+def test_new_inode_is_hashed_again(workdir, hashed):
+    path = workdir / "slot.sav"
+    path.write_bytes(b"save")
+    stat = os.stat(path)
+    cache = HashCache(workdir / "cache.json")
+    cache.md5(str(path))
+
+    # Same size and mtime, but another file.
+    replace(path, b"evas")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert cache.md5(str(path)) == hashlib.md5(b"evas").hexdigest()
+    assert hashed == ["slot.sav", "slot.sav"]
+
+
+def test_renamed_saves_dont_grow_the_cache(workdir):
+    path = workdir / "slot.sav"
+    cache = HashCache(workdir / "cache.json")
+    for i in range(5):
+        replace(path, f"save {i}".encode())
+        cache.md5(str(path))
+        cache.save()
+    assert list(json.loads((workdir / "cache.json").read_text())) == [str(path)]
+
+
+def test_entries_of_deleted_files_are_dropped(workdir):
+    kept, deleted = workdir / "kept.sav", workdir / "deleted.sav"
+    kept.write_bytes(b"kept")
+    deleted.write_bytes(b"deleted")
+    cache = HashCache(workdir / "cache.json")
+    cache.md5(str(kept))
+    cache.md5(str(deleted))
+    cache.save()
+
+    deleted.unlink()
+    # Files not looked at this time are kept as long as they exist.
+    HashCache(workdir / "cache.json").save()
+    assert list(json.loads((workdir / "cache.json").read_text())) == [str(kept)]
+
+
+def test_caches_keyed_by_inode_are_dropped(workdir, hashed):
+    path = workdir / "slot.sav"
+    path.write_bytes(b"save")
+    stat = os.stat(path)
+    old = {
+        f"{stat.st_dev}:{stat.st_ino}": {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "md5": "stale",
+        }
+    }
+    (workdir / "cache.json").write_text(json.dumps(old))
+
+    cache = HashCache(workdir / "cache.json")
+    assert cache.md5(str(path)) == hashlib.md5(b"save").hexdigest()
+    cache.save()
+    assert list(json.loads((workdir / "cache.json").read_text())) == [str(path)]
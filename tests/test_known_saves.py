@@ -0,0 +1,78 @@
+import os
+import json
+from pathlib import Path
+
+from backend.known_saves import (
+    KnownSaveIndex,
+    build_index,
+    expand,
+    load_known_saves,
+    KNOWN_SAVES_PATH,
+)
+from backend.steam import SteamApp
+
+
+def save_folder(path: Path) -> str:
+    os.makedirs(path, exist_ok=True)
+    (path / "slot1.sav").write_bytes(b"save")
+    return str(path)
+
+
+def test_expand_every_value():
+    variables = {"steam": [Path("/a"), Path("/b")], "home": [Path("/home/me")], "empty": []}
+    assert expand("<steam>/userdata/<storeUserId>/1/remote", {**variables, "storeuserid": ["*"]}) == [
+        os.path.normpath("/a/userdata/*/1/remote"),
+        os.path.normpath("/b/userdata/*/1/remote"),
+    ]
+    assert expand("<home>/.game", variables) == [os.path.normpath("/home/me/.game")]
+    assert expand("<empty>/x", variables) == []
+    assert expand("<unknown>/x", variables) == []
+
+
+def test_resolve_finds_existing_non_empty_folders(workdir):
+    index = KnownSaveIndex()
+    index.add("Found", save_folder(workdir / "AppData" / "Found" / "Saves"))
+    index.add("Empty", str(workdir / "AppData" / "Empty"))
+    os.makedirs(workdir / "AppData" / "Empty")
+    index.add("Missing", str(workdir / "AppData" / "Missing"))
+
+    assert index.resolve() == {"Found": str(workdir / "AppData" / "Found" / "Saves")}
+
+
+def test_earliest_listed_path_wins(workdir):
+    first = save_folder(workdir / "first")
+    second = save_folder(workdir / "second")
+    index = KnownSaveIndex()
+    index.add("Game", second, priority=1)
+    index.add("Game", first, priority=0)
+    assert index.resolve() == {"Game": first}
+
+
+def test_wildcards_match_folders(workdir):
+    found = save_folder(workdir / "userdata" / "12345" / "504230" / "remote")
+    index = KnownSaveIndex()
+    index.add("Celeste", str(workdir / "userdata" / "*" / "504230" / "remote"))
+    assert index.resolve() == {"Celeste": found}
+
+
+def test_installed_games_use_their_install_folder_and_steam_name(workdir):
+    library = workdir / "Library"
+    app = SteamApp("646570", "Slay the Spire", "SlayTheSpire", library)
+    found = save_folder(app.install_path / "saves")
+    known = {"StS": {"steam_id": "646570", "paths": ["<base>/saves"]}}
+
+    index = build_index(known, {workdir / "Steam": [app]})
+    assert index.resolve() == {"Slay the Spire": found}
+    # Without the installation <base> has no value.
+    assert build_index(known, {}).resolve() == {}
+
+
+def test_user_entries_win_over_shipped_ones(workdir):
+    user_file = workdir / "data" / "known_saves.json"
+    user_file.write_text(json.dumps({"Celeste": {"paths": ["<home>/celeste"]}, "Mine": {"paths": []}}))
+
+    shipped = load_known_saves((KNOWN_SAVES_PATH,))
+    merged = load_known_saves((KNOWN_SAVES_PATH, user_file))
+    assert "Celeste" in shipped
+    assert merged["Celeste"] == {"paths": ["<home>/celeste"]}
+    assert set(merged) == set(shipped) | {"Mine"}
@@ -0,0 +1,119 @@
+import os
+
+from backend.manifest import SyncManifest, local_stats
+from backend.registry import SaveRegistry
+
+
+def write(path, data: bytes):
+    os.makedirs(path.parent, exist_ok=True)
+    path.write_bytes(data)
+    return os.stat(path)
+
+
+def test_is_unchanged_after_record(workdir):
+    stat = write(workdir / "saves" / "slot1.sav", b"one")
+    manifest = SyncManifest("Game")
+    assert not manifest.is_unchanged("slot1.sav", stat)
+
+    manifest.record("slot1.sav", stat, "md5", "remote", "time")
+    assert manifest.is_unchanged("slot1.sav", stat)
+
+
+def test_is_unchanged_notices_size_and_mtime(workdir):
+    path = workdir / "saves" / "slot1.sav"
+    stat = write(path, b"one")
+    manifest = SyncManifest("Game")
+    manifest.record("slot1.sav", stat, "md5", "remote", "time")
+
+    assert not manifest.is_unchanged("slot1.sav", write(path, b"longer"))
+    write(path, b"two")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert not manifest.is_unchanged("slot1.sav", os.stat(path))
+
+
+def test_is_unchanged_needs_a_remote_copy(workdir):
+    stat = write(workdir / "saves" / "slot1.sav", b"one")
+    manifest = SyncManifest("Game")
+    manifest.record("slot1.sav", stat, "md5", None, None)
+    assert not manifest.is_unchanged("slot1.sav", stat)
+
+
+def test_all_unchanged_notices_added_and_removed_files(workdir):
+    saves = workdir / "saves"
+    write(saves / "a.sav", b"a")
+    write(saves / "sub" / "b.sav", b"b")
+    manifest = SyncManifest("Game")
+    stats = local_stats(saves)
+    assert set(stats) == {"a.sav", "sub/b.sav"}
+    for rel_path, stat in stats.items():
+        manifest.record(rel_path, stat, "md5", "remote", "time")
+    assert manifest.all_unchanged(stats)
+
+    write(saves / "c.sav", b"c")
+    assert not manifest.all_unchanged(local_stats(saves))
+    os.remove(saves / "c.sav")
+    os.remove(saves / "a.sav")
+    assert not manifest.all_unchanged(local_stats(saves))
+
+
+def test_save_and_load(workdir):
+    stat = write(workdir / "saves" / "big.sav", b"big")
+    registry = SaveRegistry()
+    manifest = SyncManifest("Game", registry)
+    manifest.use_mode("dedup")
+    manifest.folders["."] = "folder"
+    manifest.record("big.sav", stat, None, "chunks", None, chunks=["a", "b"])
+    manifest.save()
+
+    loaded = SyncManifest("Game", registry)
+    assert loaded.mode == "dedup"
+    assert loaded.folders == {".": "folder"}
+    assert loaded.files["big.sav"]["chunks"] == ["a", "b"]
+    assert loaded.is_unchanged("big.sav", stat)
+
+
+def test_use_mode_forgets_entries_of_other_modes(workdir):
+    stat = write(workdir / "saves" / "slot1.sav", b"one")
+    registry = SaveRegistry()
+    manifest = SyncManifest("Game", registry)
+    assert not manifest.use_mode("versioned")
+    manifest.record("slot1.sav", stat, "md5", "objects", None)
+    manifest.save()
+
+    manifest = SyncManifest("Game", registry)
+    assert not manifest.use_mode("versioned")
+    assert manifest.is_unchanged("slot1.sav", stat)
+    assert manifest.use_mode("files")
+    assert not manifest.files
+    manifest.save()
+
+    manifest = SyncManifest("Game", registry)
+    assert manifest.mode == "files"
+    assert not manifest.files
+
+
+def test_reconcile_drops_stale_entries(workdir):
+    saves = workdir / "saves"
+    manifest = SyncManifest("Game")
+    for name in ("kept.sav", "replaced.sav", "gone.sav"):
+        manifest.record(name, write(saves / name, b"x"), "md5", f"id-{name}", "t1")
+    manifest.folders.update({".": "root", "sub": "sub-id", "old": "old-id"})
+
+    dropped = manifest.reconcile(
+        {
+            "kept.sav": {"id": "id-kept.sav", "modifiedTime": "t1"},
+            "replaced.sav": {"id": "id-replaced.sav", "modifiedTime": "t2"},
+        },
+        {"sub": "sub-id"},
+    )
+    assert dropped == 2
+    assert set(manifest.files) == {"kept.sav"}
+    assert manifest.folders == {".": "root", "sub": "sub-id"}
+
+
+def test_local_stats_skip_files_that_disappear(workdir):
+    (workdir / "saves").mkdir()
+    (workdir / "saves" / "slot.sav").write_bytes(b"save")
+    # Listed by the walk, but gone by the time it's looked at.
+    os.symlink(workdir / "saves" / "gone.tmp", workdir / "saves" / "save.tmp")
+    assert set(local_stats(str(workdir / "saves"))) == {"slot.sav"}
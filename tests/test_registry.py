@@ -0,0 +1,56 @@
+import os
+
+from backend.registry import SaveRegistry, LEGACY_SAVES_PATH, LEGACY_MANIFEST_DIR
+from backend.utilities import save_to_json
+
+ENTRY = {
+    "size": 4,
+    "mtime_ns": 1_700_000_000_000_000_000,
+    "md5": "0cc175b9c0f1b6a831c399e269772661",
+    "remote_id": "file-1",
+    "remote_modified_time": "2024-01-01T00:00:00.000Z",
+}
+
+
+def write_legacy_data():
+    save_to_json({"Game": "/saves/game", "Other": "/saves/other"}, LEGACY_SAVES_PATH)
+    os.makedirs(LEGACY_MANIFEST_DIR)
+    save_to_json(
+        {
+            "game_name": "Game",
+            "files": {"slot1.sav": ENTRY, "big.sav": {**ENTRY, "chunks": ["a", "b"]}},
+            "folders": {"": "folder-root"},
+        },
+        LEGACY_MANIFEST_DIR / "Game.json",
+    )
+    save_to_json({"files": {"lost.sav": ENTRY}}, LEGACY_MANIFEST_DIR / "nameless.json")
+
+
+def test_json_data_is_imported_when_the_registry_is_created():
+    write_legacy_data()
+    registry = SaveRegistry()
+
+    assert registry.saves() == {"Game": "/saves/game", "Other": "/saves/other"}
+    files, folders = registry.load_file_state("Game")
+    assert files == {"slot1.sav": ENTRY, "big.sav": {**ENTRY, "chunks": ["a", "b"]}}
+    assert folders == {"": "folder-root"}
+    assert registry.load_file_state("Other") == ({}, {})
+    # A manifest without a game name has nothing to attach to.
+    assert registry._connection().execute(
+        "SELECT COUNT(*) FROM file_state WHERE rel_path = 'lost.sav'"
+    ).fetchone() == (0,)
+
+
+def test_json_data_is_imported_only_once():
+    write_legacy_data()
+    SaveRegistry().remove("Other")
+
+    save_to_json({"Late": "/saves/late"}, LEGACY_SAVES_PATH)
+    assert SaveRegistry().saves() == {"Game": "/saves/game"}
+
+
+def test_missing_or_empty_json_data_is_skipped(workdir):
+    assert SaveRegistry().saves() == {}
+
+    LEGACY_SAVES_PATH.write_text("")
+    assert SaveRegistry(workdir / "data" / "other.db").saves() == {}
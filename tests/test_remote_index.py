@@ -0,0 +1,46 @@
+import pytest
+
+from backend.game_settings import set_storage_mode
+from benchmarks.fake_drive import FakeDrive, DriveError
+from benchmarks.save_trees import tiny_files, mutate, tree_digest
+
+
+class UnlistableDrive(FakeDrive):
+    """Refuses every folder listing while `refuse_lists` is set."""
+
+    refuse_lists = False
+
+    def _list(self, query):
+        if self.refuse_lists:
+            raise DriveError(400, "badRequest", "Refused.")
+        return super()._list(query)
+
+
+@pytest.fixture
+def fake_drive():
+    return UnlistableDrive()
+
+
+@pytest.mark.parametrize("mode", ["files", "versioned"])
+def test_failed_listing_isnt_taken_for_an_empty_folder(drive, fake_drive, workdir, mode):
+    saves = tiny_files(workdir / "saves", count=6, dirs=2)
+    set_storage_mode("Game", mode)
+    assert drive.upload_files(str(saves), "Game") == "completed"
+    files = fake_drive.file_count()
+
+    mutate(saves)
+    fake_drive.refuse_lists = True
+    assert drive.upload_files(str(saves), "Game", rebuild_manifest=True) == "failed"
+    assert fake_drive.file_count() == files
+    assert not drive.restore_game("Game", str(workdir / "refused"))
+
+    fake_drive.refuse_lists = False
+    assert drive.upload_files(str(saves), "Game", rebuild_manifest=True) == "completed"
+    names = [
+        (tuple(file["parents"]), file["name"])
+        for file in fake_drive._files.values()
+    ]
+    assert len(names) == len(set(names))
+    restored = workdir / "restored"
+    assert drive.restore_game("Game", str(restored))
+    assert tree_digest(saves).items() <= tree_digest(restored).items()
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta, timezone
+
+from backend.retention import snapshots_to_keep, DEFAULT_RETENTION
+
+NOW = datetime(2024, 3, 15, 18, 0, tzinfo=timezone.utc)
+
+
+def hourly(count: int) -> dict:
+    """`count` snapshots an hour apart, the newest at NOW."""
+    return {f"s{i:03d}": NOW - timedelta(hours=i) for i in range(count)}
+
+
+def test_keeps_the_newest_ones():
+    created = hourly(10)
+    assert snapshots_to_keep(created, keep_last=3) == {"s000", "s001", "s002"}
+
+
+def test_always_keeps_the_newest():
+    assert snapshots_to_keep(hourly(3)) == {"s000"}
+    assert snapshots_to_keep({}) == set()
+
+
+def test_keeps_the_newest_per_day():
+    created = hourly(24 * 5)
+    keep = snapshots_to_keep(created, daily=3)
+    assert {created[name].date() for name in keep} == {
+        NOW.date(),
+        NOW.date() - timedelta(days=1),
+        NOW.date() - timedelta(days=2),
+    }
+    for name in keep:
+        same_day = [n for n in created if created[n].date() == created[name].date()]
+        assert created[name] == max(created[n] for n in same_day)
+
+
+def test_keeps_the_newest_per_week():
+    created = {f"d{i:02d}": NOW - timedelta(days=i) for i in range(30)}
+    keep = snapshots_to_keep(created, weekly=2)
+    weeks = {created[name].isocalendar()[:2] for name in keep}
+    assert len(keep) == 2 and len(weeks) == 2
+    assert "d00" in keep
+
+
+def test_rules_add_up():
+    created = hourly(24 * 40)
+    keep = snapshots_to_keep(created, **DEFAULT_RETENTION)
+    # 5 newest, 7 days whose newest is already counted once, 4 weeks.
+    assert {"s000", "s001", "s002", "s003", "s004"} <= keep
+    assert len(keep) <= 5 + 7 + 4
+    assert len({created[name].date() for name in keep}) >= 7
+
+
+def test_days_without_snapshots_dont_count():
+    created = {
+        "today": NOW,
+        "last_week": NOW - timedelta(days=7),
+        "last_month": NOW - timedelta(days=30),
+    }
+    assert snapshots_to_keep(created, daily=3) == set(created)
@@ -0,0 +1,96 @@
+from pathlib import Path
+
+from backend.steam import parse_vdf, library_folders, installed_apps
+
+LIBRARY_FOLDERS = r'''
+"libraryfolders"
+{
+	"contentstatsid"		"-123"
+	"0"
+	{
+		"path"		"{root}"
+		"apps"
+		{
+			"228980"		"0"
+		}
+	}
+	"1"
+	{
+		"path"		"{library}"
+	}
+}
+'''
+
+OLD_LIBRARY_FOLDERS = r'''
+"LibraryFolders"
+{
+	"TimeNextStatsReport"		"1"
+	"1"		"{library}"
+}
+'''
+
+
+def appmanifest(app_id: str, name: str, install_dir: str) -> str:
+    return (
+        f'"AppState"\n{{\n\t"appid"\t\t"{app_id}"\n\t"name"\t\t"{name}"\n'
+        f'\t"installdir"\t\t"{install_dir}"\n\t"UserConfig"\n\t{{\n\t}}\n}}\n'
+    )
+
+
+def test_nested_sections_and_lowercase_keys():
+    data = parse_vdf('"AppState" { "appid" "504230" "Name" "Celeste" "UserConfig" { "language" "english" } }')
+    assert data == {
+        "appstate": {
+            "appid": "504230",
+            "name": "Celeste",
+            "userconfig": {"language": "english"},
+        }
+    }
+
+
+def test_escapes_comments_and_conditionals():
+    text = r'''
+    // written by Steam
+    "root"
+    {
+        "path"  "C:\\Games\\Steam"
+        "quote" "say \"hi\""
+        "bare"  value [$WIN32]
+    }
+    '''
+    assert parse_vdf(text) == {
+        "root": {"path": "C:\\Games\\Steam", "quote": 'say "hi"', "bare": "value"}
+    }
+
+
+def test_unbalanced_braces_dont_raise():
+    assert parse_vdf('"a" { "b" "c" } } "d" "e"') == {"a": {"b": "c"}, "d": "e"}
+    assert parse_vdf('"a" { "b" { "c" "d"') == {"a": {"b": {"c": "d"}}}
+    assert parse_vdf("") == {}
+
+
+def test_library_folders_in_both_formats(workdir):
+    root, library = workdir / "Steam", workdir / "Library"
+    for folder in (root / "steamapps", library / "steamapps"):
+        folder.mkdir(parents=True)
+    vdf = root / "steamapps" / "libraryfolders.vdf"
+
+    for template in (LIBRARY_FOLDERS, OLD_LIBRARY_FOLDERS):
+        vdf.write_text(
+            template.replace("{root}", str(root)).replace("{library}", str(library))
+        )
+        assert library_folders(root) == [root, library]
+
+
+def test_installed_apps_leave_out_tools(workdir):
+    steamapps = workdir / "Library" / "steamapps"
+    steamapps.mkdir(parents=True)
+    (steamapps / "appmanifest_504230.acf").write_text(appmanifest("504230", "Celeste", "Celeste"))
+    (steamapps / "appmanifest_1493710.acf").write_text(
+        appmanifest("1493710", "Proton Experimental", "Proton - Experimental")
+    )
+    (steamapps / "appmanifest_1.acf").write_text('"AppState" { "appid" "1" }')
+
+    apps = installed_apps(workdir / "Library")
+    assert [(app.app_id, app.name) for app in apps] == [("504230", "Celeste")]
+    assert apps[0].install_path == Path(workdir / "Library" / "steamapps" / "common" / "Celeste")
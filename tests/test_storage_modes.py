@@ -0,0 +1,150 @@
+import os
+import time
+import random
+
+import pytest
+
+from backend.game_settings import (
+    set_storage_mode,
+    load_game_settings,
+    GAME_SETTINGS_PATH,
+    STORAGE_MODES,
+)
+from backend.utilities import save_to_json
+from benchmarks.save_trees import tiny_files, deep_tree, write_file, mutate, tree_digest
+
+
+@pytest.fixture
+def saves(workdir):
+    """A small save folder with nested folders, an empty file and a file
+    big enough to be sent in several chunks."""
+    root = tiny_files(workdir / "saves", count=12, dirs=3)
+    deep_tree(root / "deep", branches=1, depth=3, files_per_dir=1)
+    write_file(root / "world.sav", 1024 * 1024 + 17, random.Random(9))
+    (root / "empty.dat").write_bytes(b"")
+    return root
+
+
+def restored(drive, game_name, workdir, name="restored", **kwargs):
+    target = workdir / name
+    assert drive.restore_game(game_name, str(target), **kwargs)
+    return tree_digest(target)
+
+
+@pytest.mark.parametrize("mode", STORAGE_MODES)
+def test_backup_and_restore(drive, fake_server, saves, workdir, mode):
+    set_storage_mode("Game", mode)
+    drive.upload_files(str(saves), "Game")
+    assert restored(drive, "Game", workdir, "first") == tree_digest(saves)
+
+    fake_server.drive.reset_stats()
+    drive.upload_files(str(saves), "Game")
+    assert fake_server.drive.stats()["requests"] == 0
+
+    mutate(saves)
+    drive.upload_files(str(saves), "Game")
+    digest = restored(drive, "Game", workdir, "second")
+    if mode == "files":
+        # Mirrors keep the remote copies of deleted files.
+        assert tree_digest(saves).items() <= digest.items()
+    else:
+        assert digest == tree_digest(saves)
+
+
+@pytest.mark.parametrize(
+    "before, after",
+    [(before, after) for before in STORAGE_MODES for after in STORAGE_MODES if before != after],
+)
+def test_switching_storage_modes(drive, saves, workdir, before, after):
+    set_storage_mode("Game", before)
+    drive.upload_files(str(saves), "Game")
+    set_storage_mode("Game", after)
+    drive.upload_files(str(saves), "Game")
+
+    # Nothing of the earlier layout, like objects/ or snapshots/, comes back.
+    assert restored(drive, "Game", workdir) == tree_digest(saves)
+
+
+def test_switching_back_restores_the_latest_backup(drive, saves, workdir):
+    set_storage_mode("Game", "versioned")
+    drive.upload_files(str(saves), "Game")
+    set_storage_mode("Game", "files")
+    (saves / "new.sav").write_bytes(b"only in the mirror")
+    drive.upload_files(str(saves), "Game")
+
+    assert restored(drive, "Game", workdir) == tree_digest(saves)
+
+
+def test_restoring_backups_from_before_storage_modes(drive, saves, workdir):
+    # Older versions only mirrored files and kept no mode anywhere.
+    set_storage_mode("Game", "files")
+    drive.upload_files(str(saves), "Game")
+    connection = drive.registry._connection()
+    with connection:
+        connection.execute("UPDATE games SET storage_mode = NULL")
+    save_to_json({}, GAME_SETTINGS_PATH)
+    assert "Game" not in load_game_settings()
+
+    assert restored(drive, "Game", workdir, "before") == tree_digest(saves)
+    mutate(saves)
+    drive.upload_files(str(saves), "Game")
+    assert restored(drive, "Game", workdir, "after") == tree_digest(saves)
+
+
+def test_restoring_an_older_snapshot(drive, saves, workdir):
+    set_storage_mode("Game", "versioned")
+    drive.upload_files(str(saves), "Game")
+    first = tree_digest(saves)
+    # Snapshot names go down to the second, a later one in the same second
+    # replaces the first.
+    time.sleep(1.1)
+    (saves / "new.sav").write_bytes(b"new")
+    drive.upload_files(str(saves), "Game")
+
+    snapshots = drive.list_snapshots("Game")
+    assert len(snapshots) == 2
+    assert restored(drive, "Game", workdir, "old", snapshot=snapshots[0]) == first
+
+
+def corrupt(fake_drive, keep=lambda file: False):
+    """Flips the content of every stored file, leaving its md5 as it was."""
+    with fake_drive._lock:
+        for file_id, content in fake_drive._content.items():
+            if content and not keep(fake_drive._files[file_id]):
+                fake_drive._content[file_id] = bytes(b ^ 0xFF for b in content)
+
+
+@pytest.mark.parametrize("mode", STORAGE_MODES)
+def test_restoring_corrupt_backups_fails(drive, fake_drive, saves, workdir, mode):
+    set_storage_mode("Game", mode)
+    drive.upload_files(str(saves), "Game")
+    # Snapshot manifests stay readable so every file gets its turn.
+    corrupt(fake_drive, keep=lambda file: file["name"].endswith(".json"))
+
+    target = workdir / "restored"
+    assert not drive.restore_game("Game", str(target))
+    # Nothing to corrupt in an empty file.
+    assert set(tree_digest(target)) <= {"empty.dat"}
+
+
+def test_restoring_a_corrupt_snapshot_fails(drive, fake_drive, saves, workdir):
+    set_storage_mode("Game", "versioned")
+    drive.upload_files(str(saves), "Game")
+    corrupt(fake_drive)
+
+    assert not drive.restore_game("Game", str(workdir / "restored"))
+
+
+@pytest.mark.parametrize("mode", STORAGE_MODES)
+def test_files_disappearing_during_backup_are_skipped(drive, saves, workdir, mode):
+    set_storage_mode("Game", mode)
+    # Listed by the walk, but gone by the time it's looked at.
+    os.symlink("gone.tmp", saves / "save.tmp")
+    drive.upload_games([("Game", str(saves)), ("Other", str(saves / "slot00"))])
+
+    history = drive.registry._connection().execute(
+        "SELECT name, status FROM backups JOIN games ON games.id = backups.game_id"
+    ).fetchall()
+    assert sorted(history) == [("Game", "completed"), ("Other", "completed")]
+    os.remove(saves / "save.tmp")
+    assert restored(drive, "Game", workdir) == tree_digest(saves)
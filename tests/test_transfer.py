@@ -0,0 +1,154 @@
+import time
+
+import pytest
+
+from backend.transfer import TransferEngine, GameTracker, CancelToken, TransferCanceled
+from backend.game_settings import set_storage_mode
+from benchmarks.fake_drive import FakeDrive, DriveError
+from benchmarks.save_trees import tiny_files, tree_digest
+
+BROKEN = b"refused by Drive"
+
+
+class RefusingDrive(FakeDrive):
+    """Refuses every upload whose content holds BROKEN, after `delay`
+    seconds, while `refuse_broken` is set, and snapshots while
+    `refuse_snapshots` is."""
+
+    refuse_broken = True
+    refuse_snapshots = False
+    delay = 0.0
+
+    def _create(self, metadata, content, mime_type):
+        refused = self.refuse_broken and content and BROKEN in content
+        if self.refuse_snapshots and metadata.get("name", "").endswith(".json"):
+            refused = True
+        if refused:
+            time.sleep(self.delay)
+            raise DriveError(400, "badRequest", "Refused.")
+        return super()._create(metadata, content, mime_type)
+
+
+@pytest.fixture
+def fake_drive():
+    return RefusingDrive()
+
+
+def history(drive, game_name: str) -> list:
+    return drive.registry._connection().execute(
+        "SELECT files, status FROM backups JOIN games ON games.id = backups.game_id "
+        "WHERE name = ? ORDER BY backups.id",
+        (game_name,),
+    ).fetchall()
+
+
+def run_tasks(*results, token=None, finalize=None):
+    """Runs one task per result through an engine and returns the tracker."""
+    done = []
+    tracker = GameTracker("Game", done.append, finalize=finalize, token=token)
+
+    def task(result):
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    with TransferEngine(2) as engine:
+        for result in results:
+            tracker.task_added()
+            engine.submit(task, result, on_done=tracker.task_done)
+        tracker.finish_submitting()
+    assert done == [tracker]
+    return tracker
+
+
+def test_status_counts_failed_tasks():
+    assert run_tasks(None, True).status == "completed"
+    assert run_tasks(None, False, RuntimeError("boom")).failed == 2
+    assert run_tasks(None, False, RuntimeError("boom")).status == "partial"
+    assert run_tasks(False, False).status == "failed"
+    assert run_tasks().status == "completed"
+
+
+def test_status_after_finalize_and_cancel():
+    assert run_tasks(None, finalize=lambda: False).status == "failed"
+    assert run_tasks(None, finalize=lambda: 1 / 0).status == "failed"
+    assert run_tasks(None, finalize=lambda: None).status == "completed"
+
+    token = CancelToken()
+    token.cancel()
+    called = []
+    tracker = run_tasks(TransferCanceled(), token=token, finalize=lambda: called.append(1))
+    assert tracker.status == "canceled"
+    assert not called
+
+
+def test_failed_files_are_recorded_and_retried(drive, workdir):
+    saves = tiny_files(workdir / "saves", count=5, dirs=1)
+    broken = saves / "slot00" / "state00002.dat"
+    broken.write_bytes(BROKEN)
+    set_storage_mode("Game", "files")
+
+    assert drive.upload_files(str(saves), "Game") == "partial"
+    assert history(drive, "Game") == [(4, "partial")]
+
+    broken.write_bytes(b"fine now")
+    assert drive.upload_files(str(saves), "Game") == "completed"
+    assert history(drive, "Game")[-1] == (1, "completed")
+    restored = workdir / "restored"
+    assert drive.restore_game("Game", str(restored))
+    assert tree_digest(restored) == tree_digest(saves)
+
+
+@pytest.mark.parametrize("mode", ["versioned", "dedup"])
+def test_no_snapshot_until_every_file_is_stored(drive, workdir, mode):
+    saves = tiny_files(workdir / "saves", count=5, dirs=1)
+    broken = saves / "slot00" / "state00002.dat"
+    broken.write_bytes(BROKEN)
+    set_storage_mode("Game", mode)
+
+    drive.upload_files(str(saves), "Game")
+    assert history(drive, "Game") == [(4, "failed")]
+    assert drive.list_snapshots("Game") == []
+
+    broken.write_bytes(b"fine now")
+    drive.upload_files(str(saves), "Game")
+    assert history(drive, "Game")[-1] == (1, "completed")
+    assert len(drive.list_snapshots("Game")) == 1
+
+
+def test_failed_snapshot_is_written_next_run(drive, fake_drive, fake_server, workdir):
+    saves = tiny_files(workdir / "saves", count=5, dirs=1)
+    set_storage_mode("Game", "versioned")
+    fake_drive.refuse_snapshots = True
+    drive.upload_files(str(saves), "Game")
+    assert history(drive, "Game") == [(5, "failed")]
+    assert drive.list_snapshots("Game") == []
+
+    fake_drive.refuse_snapshots = False
+    fake_server.drive.reset_stats()
+    drive.upload_files(str(saves), "Game")
+    assert history(drive, "Game")[-1] == (5, "completed")
+    assert len(drive.list_snapshots("Game")) == 1
+    # The objects were already there, only the snapshot was sent.
+    assert fake_server.drive.stats()["by_kind"].get("upload") == 1
+
+
+@pytest.mark.parametrize("mode", ["versioned", "dedup"])
+def test_shared_content_isnt_recorded_when_its_upload_fails(drive, fake_drive, workdir, mode):
+    saves = workdir / "saves"
+    saves.mkdir()
+    (saves / "a.sav").write_bytes(BROKEN)
+    (saves / "b.sav").write_bytes(BROKEN)
+    set_storage_mode("Game", mode)
+    # One worker claims the content, the other finds it claimed meanwhile.
+    fake_drive.delay = 0.3
+    assert drive.upload_files(str(saves), "Game") == "failed"
+    assert history(drive, "Game") == [(0, "failed")]
+
+    # b.sav is unchanged, and nothing else is going to store its content.
+    (saves / "a.sav").unlink()
+    fake_drive.refuse_broken = False
+    assert drive.upload_files(str(saves), "Game") == "completed"
+    restored = workdir / "restored"
+    assert drive.restore_game("Game", str(restored))
+    assert tree_digest(restored) == tree_digest(saves)
@@ -0,0 +1,130 @@
+import pytest
+
+from backend import watcher
+from backend.watcher import BackupDaemon
+
+DEBOUNCE = 10.0
+SETTLE = 5.0
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+class ScriptedWatcher:
+    """Replays `script`, (time, games, action) tuples in time order, on a
+    fake clock, and stops the daemon once it's idle with nothing left."""
+
+    def __init__(self, clock: Clock, daemon: BackupDaemon, script: list):
+        self.clock = clock
+        self.daemon = daemon
+        self.script = list(script)
+
+    def wait(self, timeout: float = None) -> set:
+        if self.script and self.clock.now + timeout >= self.script[0][0]:
+            at, games, action = self.script.pop(0)
+            self.clock.now = at
+            if action:
+                action()
+            return set(games)
+        if not self.script and timeout == watcher.IDLE_WAKEUP:
+            self.daemon.stop()
+            return set()
+        self.clock.now += timeout
+        return set()
+
+    def wake(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class StubDrive:
+    """Records upload times, failing the first `failures` uploads."""
+
+    def __init__(self, clock: Clock, failures: int = 0):
+        self.clock = clock
+        self.failures = failures
+        self.uploads = []
+
+    def upload_games(self, games, token=None) -> dict:
+        self.uploads.append((self.clock.now, sorted(name for name, _ in games)))
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("offline")
+        return {name: "completed" for name, _ in games}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(watcher.time, "monotonic", clock.monotonic)
+    return clock
+
+
+@pytest.fixture
+def saves(workdir):
+    roots = {}
+    for name in ("A", "B"):
+        root = workdir / name
+        root.mkdir()
+        (root / "slot.sav").write_bytes(b"0")
+        roots[name] = str(root)
+    return roots
+
+
+def run(monkeypatch, clock, drive, saves, script) -> list:
+    daemon = BackupDaemon(drive, saves, debounce=DEBOUNCE, settle=SETTLE)
+    monkeypatch.setattr(
+        watcher, "create_watcher", lambda roots, interval: ScriptedWatcher(clock, daemon, script)
+    )
+    daemon.run()
+    return drive.uploads
+
+
+def test_burst_of_writes_is_one_backup(monkeypatch, clock, saves):
+    drive = StubDrive(clock)
+    script = [(t, {"A"}, None) for t in (1.0, 3.0, 8.0)] + [(9.0, {"B"}, None)]
+    uploads = run(monkeypatch, clock, drive, saves, script)
+    assert uploads == [(8.0 + DEBOUNCE + SETTLE, ["A"]), (9.0 + DEBOUNCE + SETTLE, ["B"])]
+
+
+def test_write_while_settling_restarts_debounce(monkeypatch, clock, saves):
+    def write():
+        with open(f"{saves['A']}/slot.sav", "ab") as f:
+            f.write(b"more")
+
+    drive = StubDrive(clock)
+    # The write isn't reported, only the changed fingerprint gives it away.
+    script = [(1.0, {"A"}, None), (1.0 + DEBOUNCE + 1.0, (), write)]
+    uploads = run(monkeypatch, clock, drive, saves, script)
+    settled = 1.0 + DEBOUNCE + SETTLE
+    assert uploads == [(settled + DEBOUNCE + SETTLE, ["A"])]
+
+
+def test_failed_upload_is_retried(monkeypatch, clock, saves):
+    drive = StubDrive(clock, failures=2)
+    uploads = run(monkeypatch, clock, drive, saves, [(1.0, {"A"}, None)])
+    first = 1.0 + DEBOUNCE + SETTLE
+    retry = DEBOUNCE + SETTLE
+    assert uploads == [(first, ["A"]), (first + retry, ["A"]), (first + 2 * retry, ["A"])]
+
+
+def test_unreadable_saves_are_retried(monkeypatch, clock, saves):
+    fingerprint = watcher._fingerprint
+    failures = [FileNotFoundError("gone")]
+
+    def flaky_fingerprint(root):
+        if failures:
+            raise failures.pop()
+        return fingerprint(root)
+
+    monkeypatch.setattr(watcher, "_fingerprint", flaky_fingerprint)
+    drive = StubDrive(clock)
+    uploads = run(monkeypatch, clock, drive, saves, [(1.0, {"A"}, None)])
+    assert uploads == [(1.0 + 2 * DEBOUNCE + SETTLE, ["A"])]